@@ -1,47 +1,117 @@
 import os
-import urllib.request
+import http.client
 import subprocess
 import threading
 import time
 import json
-import urllib
-import uuid
-import websocket
 import random
 import requests
 import shutil
 import custom_node_helpers as helpers
 from cog import Path
-from node import Node
 from weights_downloader import WeightsDownloader
-from urllib.error import URLError
+from weights_integrity import IntegrityScanner
+from weights_prefetcher import WeightsPrefetcher
+from page_cache import PageCacheWarmer
+from workflow_analyzer import WorkflowAnalyzer
+from workflow_graph import output_nodes, prune_to_outputs
+from workflow_optimizer import optimize_workflow
+from execution_cache import ExecutionCache
+from comfyui_websocket import ComfyUIWebSocket
+from comfyui_client import ComfyUIClient, ComfyUIRequestError
+from comfyui_pool import ServerPool
 
 
 class ComfyUI:
     def __init__(self, server_address):
-        self.weights_downloader = WeightsDownloader()
+        self.weights_downloader = WeightsDownloader.shared()
+        self.weights_prefetcher = WeightsPrefetcher(self.weights_downloader)
+        self.workflow_analyzer = WorkflowAnalyzer(self.weights_downloader)
         self.server_address = server_address
+        self.client = ComfyUIClient(server_address)
+        self.temp_directory = "ComfyUI/temp"
+        # In production, nodes the outputs do not need, like previews, are
+        # removed before queueing. WORKFLOW_MODE=development runs workflows
+        # as they are.
+        self.workflow_mode = os.getenv("WORKFLOW_MODE", "production").lower()
+        self._output_node_types = None
+        self.execution_cache = ExecutionCache()
+        # Set while a prompt we queued may still be running
+        self.prompt_in_flight = False
+        self.ws = None
+        # Optional limit on how long a prompt may run, in seconds
+        prompt_timeout = os.getenv("COMFYUI_PROMPT_TIMEOUT")
+        self.prompt_timeout = float(prompt_timeout) if prompt_timeout else None
+        # Optionally merge duplicate nodes and fold constant arithmetic
+        # before queueing
+        self.optimize_workflows = (
+            os.getenv("WORKFLOW_OPTIMIZE", "false").lower() == "true"
+        )
 
-    def start_server(self, output_directory, input_directory):
+    def start_server(self, output_directory, input_directory, wait=True):
+        # With wait=False the server boots in the background, so other setup
+        # work such as downloading weights can run alongside it. Call
+        # wait_for_server before using the server.
         self.input_directory = input_directory
         self.output_directory = output_directory
         self.apply_helper_methods("prepare", weights_downloader=self.weights_downloader)
 
-        start_time = time.time()
+        self.server_process = None
+        self.server_start_time = time.time()
         server_thread = threading.Thread(
             target=self.run_server, args=(output_directory, input_directory)
         )
         server_thread.start()
+
+        if wait:
+            self.wait_for_server()
+
+    def start_server_pool(
+        self, size, devices=None, command=None, remote_addresses=None, timeout=120
+    ):
+        # This instance's server plus size - 1 more, launched with the same
+        # options on their own ports and output directories. They share the
+        # input directory, where request inputs are saved. Remote servers
+        # must have the same custom nodes and weights as this one.
+        pool = ServerPool()
+        server = pool.add_existing(
+            "0",
+            self.server_address,
+            self.output_directory,
+            self.input_directory,
+            self.temp_directory,
+        )
+        # Lets health checks see this server's process exit straight away
+        server.process = self.server_process
+        if size > 1:
+            command = command or (
+                "python ./ComfyUI/main.py --port {port} --output-directory {output_directory} "
+                "--input-directory {input_directory} --temp-directory {temp_parent_directory} "
+                f"--disable-metadata{self.execution_cache.server_args()}"
+            )
+            pool.launch(
+                size - 1, command, devices=devices, input_directory=self.input_directory
+            )
+        for address in remote_addresses or []:
+            pool.add_remote(str(len(pool.instances)), address)
+        pool.wait_until_ready(timeout)
+        return pool
+
+    def wait_for_server(self, timeout=60):
         while not self.is_server_running():
-            if time.time() - start_time > 60:
-                raise TimeoutError("Server did not start within 60 seconds")
+            if self.server_process is not None and self.server_process.poll() is not None:
+                raise RuntimeError(
+                    f"Server exited with code {self.server_process.returncode} before it started"
+                )
+            if time.time() - self.server_start_time > timeout:
+                raise TimeoutError(f"Server did not start within {timeout} seconds")
             time.sleep(0.5)
 
-        elapsed_time = time.time() - start_time
+        elapsed_time = time.time() - self.server_start_time
         print(f"Server started in {elapsed_time:.2f} seconds")
 
     def run_server(self, output_directory, input_directory):
-        command = f"python ./ComfyUI/main.py --output-directory {output_directory} --input-directory {input_directory} --disable-metadata"
+        command = f"python ./ComfyUI/main.py --output-directory {output_directory} --input-directory {input_directory} --disable-metadata{self.execution_cache.server_args()}"
 
         """
         We need to capture the stdout and stderr from the server process
@@ -56,6 +126,7 @@ class ComfyUI:
             stderr=subprocess.PIPE,
             universal_newlines=True,
         )
+        self.server_process = server_process
 
         def print_stdout():
             for stdout_line in iter(server_process.stdout.readline, ""):
@@ -69,11 +140,9 @@ class ComfyUI:
 
     def is_server_running(self):
         try:
-            with urllib.request.urlopen(
-                "http://{}/history/{}".format(self.server_address, "123")
-            ) as response:
-                return response.status == 200
-        except URLError:
+            self.client.request("GET", "/history/123", timeout=5, idempotent=False)
+            return True
+        except (ComfyUIRequestError, http.client.HTTPException, OSError):
             return False
 
     def apply_helper_methods(self, method_name, *args, **kwargs):
@@ -85,124 +154,122 @@ class ComfyUI:
             if callable(method):
                 method(*args, **kwargs)
 
-    def handle_weights(self, workflow, weights_to_download=None):
+    def handle_weights(self, workflow, weights_to_download=None, plan=None, lease_id=None):
         if weights_to_download is None:
             weights_to_download = []
 
         print("Checking weights")
-        embeddings = self.weights_downloader.get_weights_by_type("EMBEDDINGS")
-        embedding_to_fullname = {emb.split(".")[0]: emb for emb in embeddings}
-        weights_filetypes = self.weights_downloader.supported_filetypes
+        if plan is None:
+            plan = self.workflow_analyzer.analyze(workflow)
 
-        self.convert_lora_loader_nodes(workflow)
+        requested_weights = list(weights_to_download)
+        weights_to_download.extend(plan.weights)
+        self.resolved_weights = list(dict.fromkeys(plan.weights + requested_weights))
 
-        for node in workflow.values():
-            # Skip HFHubLoraLoader and LoraLoaderFromURL nodes since they handle their own weights
-            if node.get("class_type") in ["HFHubLoraLoader", "LoraLoaderFromURL"]:
-                continue
-
-            self.apply_helper_methods("add_weights", weights_to_download, Node(node))
-
-            for input_key, input_value in node["inputs"].items():
-                if isinstance(input_value, str):
-                    if any(key in input_value for key in embedding_to_fullname):
-                        weights_to_download.extend(
-                            embedding_to_fullname[key]
-                            for key in embedding_to_fullname
-                            if key in input_value
-                        )
-                    elif any(input_value.endswith(ft) for ft in weights_filetypes):
-                        # Sometimes a model will have a number of common filenames
-                        weight_str = self.weights_downloader.get_canonical_weight_str(
-                            input_value
-                        )
-                        if weight_str != input_value:
-                            print(
-                                f"Converting model synonym {input_value} to {weight_str}"
-                            )
-                            node["inputs"][input_key] = weight_str
-
-                        weights_to_download.append(weight_str)
-
-        weights_to_download = list(set(weights_to_download))
-
-        for weight in weights_to_download:
-            self.weights_downloader.download_weights(weight)
+        # Concurrent requests lease their weights, so another request's
+        # downloads cannot evict them before this one's prompt has run
+        if lease_id is not None:
+            self.weights_downloader.lease_weights(lease_id, weights_to_download)
+        self.weights_prefetcher.on_request(weights_to_download)
+        self.weights_downloader.download_all_weights(weights_to_download)
 
         print("====================================")
 
-    def is_image_or_video_value(self, value):
-        filetypes = [".png", ".jpg", ".jpeg", ".webp", ".mp4", ".webm"]
-        return isinstance(value, str) and any(
-            value.lower().endswith(ft) for ft in filetypes
+    def warm_page_cache(self, weights=None):
+        # Optionally reads the workflow's weights into the page cache in the
+        # background, so the first load after a restart is not a cold read
+        if os.getenv("WEIGHTS_WARM_PAGE_CACHE", "false").lower() != "true":
+            return
+
+        max_mbps = os.getenv("WEIGHTS_WARM_MAX_MBPS")
+        paths = self.weights_downloader.installed_files(
+            weights if weights is not None else self.resolved_weights
         )
+        self.page_cache_warmer = PageCacheWarmer(
+            paths,
+            max_bytes_per_second=float(max_mbps) * 1024 * 1024 if max_mbps else None,
+        )
+        self.page_cache_warmer.start()
 
-    def handle_known_unsupported_nodes(self, workflow):
-        for node in workflow.values():
-            self.apply_helper_methods("check_for_unsupported_nodes", Node(node))
+    def report_page_cache(self):
+        if getattr(self, "page_cache_warmer", None) is not None:
+            self.page_cache_warmer.report()
 
-    def handle_inputs(self, workflow):
+    def scan_weights_in_background(self):
+        # Validates every weight in the ledger so truncated files are removed
+        # and re-downloaded instead of failing a prediction
+        weights = list(self.weights_downloader.weights_ledger.entries)
+        self.integrity_scanner = IntegrityScanner(self.weights_downloader)
+        self.integrity_scanner.start(weights)
+
+    def handle_inputs(self, workflow, plan=None, input_directory=None):
         print("Checking inputs")
-        seen_inputs = set()
+        if plan is None:
+            plan = self.workflow_analyzer.analyze(workflow)
+        input_directory = input_directory or self.input_directory
+
         missing_inputs = []
-        for node in workflow.values():
-            # Skip URLs in LoraLoader nodes
-            if node.get("class_type") in ["LoraLoaderFromURL", "LoraLoader"]:
-                continue
-
-            if "inputs" in node:
-                for input_key, input_value in node["inputs"].items():
-                    if isinstance(input_value, str) and input_value not in seen_inputs:
-                        seen_inputs.add(input_value)
-                        if input_value.startswith(("http://", "https://")):
-                            filename = os.path.join(
-                                self.input_directory, os.path.basename(input_value)
-                            )
-                            if not os.path.exists(filename):
-                                print(f"Downloading {input_value} to {filename}")
-                                try:
-                                    response = requests.get(input_value)
-                                    response.raise_for_status()
-                                    with open(filename, "wb") as file:
-                                        file.write(response.content)
-                                    print(f"✅ {filename}")
-                                except requests.exceptions.RequestException as e:
-                                    print(f"❌ Error downloading {input_value}: {e}")
-                                    missing_inputs.append(filename)
-
-                            # The same URL may be included in a workflow more than once
-                            node["inputs"][input_key] = filename
-
-                        elif self.is_image_or_video_value(input_value):
-                            filename = os.path.join(
-                                self.input_directory, os.path.basename(input_value)
-                            )
-                            if not os.path.exists(filename):
-                                print(f"❌ {filename} not provided")
-                                missing_inputs.append(filename)
-                            else:
-                                print(f"✅ {filename}")
+        downloaded = {}
+        for node_id, input_key, url in plan.input_urls:
+            filename = os.path.join(input_directory, os.path.basename(url))
+            if url not in downloaded:
+                downloaded[url] = filename
+                if not os.path.exists(filename):
+                    print(f"Downloading {url} to {filename}")
+                    try:
+                        response = requests.get(url)
+                        response.raise_for_status()
+                        with open(filename, "wb") as file:
+                            file.write(response.content)
+                        print(f"✅ {filename}")
+                    except requests.exceptions.RequestException as e:
+                        print(f"❌ Error downloading {url}: {e}")
+                        missing_inputs.append(filename)
+
+            workflow[node_id]["inputs"][input_key] = filename
+
+        for input_file in plan.input_files:
+            filename = os.path.join(input_directory, os.path.basename(input_file))
+            if not os.path.exists(filename):
+                print(f"❌ {filename} not provided")
+                missing_inputs.append(filename)
+            else:
+                print(f"✅ {filename}")
+                if input_directory != self.input_directory:
+                    # ComfyUI looks for names in its input directory, so
+                    # files in a request's subdirectory are named from there
+                    self._rename_input(
+                        workflow,
+                        input_file,
+                        os.path.relpath(filename, self.input_directory),
+                    )
 
         if missing_inputs:
             raise Exception(f"Missing required input files: {', '.join(missing_inputs)}")
 
         print("====================================")
 
+    @staticmethod
+    def _rename_input(workflow, value, new_value):
+        for node in workflow.values():
+            inputs = node.get("inputs", {})
+            for input_key, input_value in inputs.items():
+                if input_value == value:
+                    inputs[input_key] = new_value
+
     def connect(self):
-        self.client_id = str(uuid.uuid4())
-        self.ws = websocket.WebSocket()
-        self.ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}")
+        # The websocket is opened once and shared by every prediction
+        if self.ws is None:
+            self.ws = ComfyUIWebSocket(self.server_address, self.client)
+            self.ws.start()
+        self.client_id = self.ws.client_id
 
     def post_request(self, endpoint, data=None):
-        url = f"http://{self.server_address}{endpoint}"
-        headers = {"Content-Type": "application/json"} if data else {}
-        json_data = json.dumps(data).encode("utf-8") if data else None
-        req = urllib.request.Request(
-            url, data=json_data, headers=headers, method="POST"
-        )
-        with urllib.request.urlopen(req) as response:
-            if response.status != 200:
-                print(f"Failed: {endpoint}, status code: {response.status}")
+        # Used for control requests that are safe to repeat
+        try:
+            self.client.request("POST", endpoint, data=data, idempotent=True)
+        except ComfyUIRequestError as e:
+            print(f"Failed: {endpoint}, status code: {e.status}")
 
     # https://github.com/comfyanonymous/ComfyUI/blob/master/server.py
     def clear_queue(self):
@@ -213,15 +280,10 @@ class ComfyUI:
         try:
             # Prompt is the loaded workflow (prompt is the label comfyUI uses)
             p = {"prompt": prompt, "client_id": self.client_id}
-            data = json.dumps(p).encode("utf-8")
-            req = urllib.request.Request(
-                f"http://{self.server_address}/prompt?{self.client_id}", data=data
-            )
-
-            output = json.loads(urllib.request.urlopen(req).read())
+            output = self.client.post_json("/prompt", p)
             return output["prompt_id"]
-        except urllib.error.HTTPError as e:
-            print(f"ComfyUI error: {e.code} {e.reason}")
+        except ComfyUIRequestError as e:
+            print(f"ComfyUI error: {e.status} {e.body.decode('utf-8', 'replace')}")
             http_error = True
 
         if http_error:
@@ -243,47 +305,66 @@ class ComfyUI:
 
             for weight_file in list(set(weights_to_delete)):
                 self.weights_downloader.delete_weights(weight_file)
+            self.execution_cache.invalidate("corrupted weights were deleted")
 
             raise Exception(
                 "The weights for this workflow have been corrupted. They have been deleted and will be re-downloaded on the next run. Please try again."
             )
 
-    def wait_for_prompt_completion(self, workflow, prompt_id):
-        while True:
-            out = self.ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
-
-                if message["type"] == "execution_error":
-                    error_data = message["data"]
-
-                    if (
-                        "exception_type" in error_data
-                        and error_data["exception_type"]
-                        == "safetensors_rust.SafetensorError"
-                    ):
-                        self._delete_corrupted_weights(error_data)
+    def wait_for_prompt_completion(self, workflow, prompt_id, timeout=None):
+        handle = self.ws.watch(prompt_id)
+        deadline = time.time() + timeout if timeout else None
+        try:
+            self._wait_for_messages(workflow, prompt_id, handle, deadline)
+        finally:
+            self.ws.release(prompt_id)
 
-                    error_message = json.dumps(message, indent=2)
-                    raise Exception(
-                        f"There was an error executing your workflow:\n\n{error_message}"
-                    )
+    def _wait_for_messages(self, workflow, prompt_id, handle, deadline):
+        while True:
+            remaining = max(deadline - time.time(), 0) if deadline else None
+            message = handle.next(remaining)
+            self.execution_cache.on_message(message, prompt_id)
+
+            if message["type"] == "execution_error":
+                self.raise_execution_error(message)
+
+            if message["type"] == "executing":
+                data = message["data"]
+                if data["node"] is None:
+                    break
+                self.print_executing_node(workflow, data["node"])
+
+    def raise_execution_error(self, message):
+        error_data = message["data"]
+
+        if (
+            "exception_type" in error_data
+            and error_data["exception_type"] == "safetensors_rust.SafetensorError"
+        ):
+            self._delete_corrupted_weights(error_data)
+
+        error_message = json.dumps(message, indent=2)
+        raise Exception(
+            f"There was an error executing your workflow:\n\n{error_message}"
+        )
 
-                if message["type"] == "executing":
-                    data = message["data"]
-                    if data["node"] is None and data["prompt_id"] == prompt_id:
-                        break
-                    elif data["prompt_id"] == prompt_id:
-                        node = workflow.get(data["node"], {})
-                        meta = node.get("_meta", {})
-                        class_type = node.get("class_type", "Unknown")
-                        print(
-                            f"Executing node {data['node']}, title: {meta.get('title', 'Unknown')}, class type: {class_type}"
-                        )
-            else:
-                continue
+    @staticmethod
+    def print_executing_node(workflow, node_id):
+        node = workflow.get(node_id, {})
+        meta = node.get("_meta", {})
+        class_type = node.get("class_type", "Unknown")
+        print(
+            f"Executing node {node_id}, title: {meta.get('title', 'Unknown')}, class type: {class_type}"
+        )
 
-    def load_workflow(self, workflow):
+    def load_workflow(
+        self,
+        workflow,
+        plan=None,
+        input_directory=None,
+        lease_id=None,
+        download_weights=True,
+    ):
         if not isinstance(workflow, dict):
             wf = json.loads(workflow)
         else:
@@ -296,16 +377,31 @@ class ComfyUI:
                 "You need to use the API JSON version of a ComfyUI workflow. To do this go to your ComfyUI settings and turn on 'Enable Dev mode Options'. Then you can save your ComfyUI workflow via the 'Save (API Format)' button."
             )
 
-        self.handle_known_unsupported_nodes(wf)
-        self.handle_inputs(wf)
-        self.handle_weights(wf)
+        # One pass over the graph plans the inputs, weights and rewrites,
+        # unless the caller already has a plan for this workflow
+        if plan is None:
+            plan = self.workflow_analyzer.analyze(wf)
+        self.handle_inputs(wf, plan, input_directory=input_directory)
+        # Remote servers load weights from their own disks
+        if download_weights:
+            self.handle_weights(wf, plan=plan, lease_id=lease_id)
         return wf
 
     def reset_execution_cache(self):
+        # Running reset.json evicts the default cache, which only holds the
+        # last prompt's outputs, and leaves models loaded. The LRU cache keeps
+        # older prompts too, and only the /free free_memory flag clears it.
+        # ComfyUI reads that flag after the next prompt and unloads every
+        # model along with it, so it is only sent in lru mode.
         print("Resetting execution cache")
+        if self.execution_cache.mode == "lru":
+            self.post_request("/free", {"free_memory": True})
+        self.queue_prompt(self.reset_workflow())
+        self.execution_cache.reset_done()
+
+    def reset_workflow(self):
         with open("reset.json", "r") as file:
-            reset_workflow = json.loads(file.read())
-        self.queue_prompt(reset_workflow)
+            return json.loads(file.read())
 
     def randomise_input_seed(self, input_key, inputs):
         if input_key in inputs and isinstance(inputs[input_key], (int, float)):
@@ -320,20 +416,76 @@ class ComfyUI:
             for seed_key in seed_keys:
                 self.randomise_input_seed(seed_key, inputs)
 
-    def run_workflow(self, workflow):
+    def output_node_types(self):
+        # Class types ComfyUI runs workflows for, from the node definitions
+        if self._output_node_types is None:
+            try:
+                object_info = self.client.get_json("/object_info")
+            except (
+                ComfyUIRequestError,
+                http.client.HTTPException,
+                OSError,
+                ValueError,
+            ) as e:
+                print(f"⚠️  Could not read output node types from ComfyUI: {e}")
+                return None
+            self._output_node_types = {
+                class_type
+                for class_type, info in object_info.items()
+                if info.get("output_node")
+            }
+        return self._output_node_types
+
+    def prune_workflow(self, workflow, outputs=None):
+        # Keeps only the nodes needed for the outputs, by default every
+        # output but previews
+        if self.workflow_mode == "development":
+            return workflow
+
+        if outputs is None:
+            outputs = output_nodes(workflow, self.output_node_types())
+        pruned = prune_to_outputs(workflow, outputs)
+        removed = [node_id for node_id in workflow if node_id not in pruned]
+        if removed:
+            print(
+                f"Pruned {len(removed)} nodes not needed for outputs {', '.join(outputs)}: {', '.join(removed)}"
+            )
+        return pruned
+
+    def optimize_workflow(self, workflow):
+        optimized, eliminated = optimize_workflow(workflow)
+        for node_id, replacement in eliminated.items():
+            class_type = workflow[node_id].get("class_type")
+            print(f"Optimized away node {node_id} ({class_type}), {replacement}")
+        return optimized
+
+    def prepare_for_queue(self, workflow, outputs=None):
+        workflow = self.prune_workflow(workflow, outputs)
+        if self.optimize_workflows:
+            workflow = self.optimize_workflow(workflow)
+        return workflow
+
+    def run_workflow(self, workflow, outputs=None):
         print("Running workflow")
+        workflow = self.prepare_for_queue(workflow, outputs)
+        if self.execution_cache.needs_reset():
+            self.reset_execution_cache()
+        self.prompt_in_flight = True
         prompt_id = self.queue_prompt(workflow)
-        self.wait_for_prompt_completion(workflow, prompt_id)
+        self.execution_cache.start_prompt(prompt_id)
+        try:
+            self.wait_for_prompt_completion(workflow, prompt_id, self.prompt_timeout)
+        finally:
+            self.execution_cache.report(prompt_id)
+        self.prompt_in_flight = False
+        self.client.report()
         output_json = self.get_history(prompt_id)
         print("outputs: ", output_json)
         print("====================================")
 
     def get_history(self, prompt_id):
-        with urllib.request.urlopen(
-            f"http://{self.server_address}/history/{prompt_id}"
-        ) as response:
-            output = json.loads(response.read())
-            return output[prompt_id]["outputs"]
+        output = self.client.get_json(f"/history/{prompt_id}")
+        return output[prompt_id]["outputs"]
 
     def get_files(self, directories, prefix="", file_extensions=None):
         files = []
@@ -358,21 +510,13 @@ class ComfyUI:
         return sorted(files)
 
     def cleanup(self, directories):
-        self.clear_queue()
+        self.client.reset_stats()
+        # Only a prediction that did not finish leaves work in ComfyUI's
+        # queue, otherwise there is nothing to clear or interrupt
+        if self.prompt_in_flight:
+            self.clear_queue()
+            self.prompt_in_flight = False
         for directory in directories:
             if os.path.exists(directory):
                 shutil.rmtree(directory)
             os.makedirs(directory)
-
-    def convert_lora_loader_nodes(self, workflow):
-        for node_id, node in workflow.items():
-            if node.get("class_type") == "LoraLoader":
-                inputs = node.get("inputs", {})
-                if "lora_name" in inputs and isinstance(inputs["lora_name"], str):
-                    if inputs["lora_name"].startswith(("http://", "https://")):
-                        print(
-                            f"Converting LoraLoader node {node_id} to LoraLoaderFromURL"
-                        )
-                        node["class_type"] = "LoraLoaderFromURL"
-                        node["inputs"]["url"] = inputs["lora_name"]
-                        del node["inputs"]["lora_name"]
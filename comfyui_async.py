@@ -0,0 +1,448 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import aiohttp
+
+HEARTBEAT_INTERVAL = 15
+RECONNECT_DELAYS = [0.5, 1, 2, 5]
+# Messages for prompts nobody is waiting on yet are kept for this many prompts
+UNCLAIMED_PROMPTS = 32
+# Output directories of finished requests kept for the files to be uploaded
+KEPT_REQUEST_OUTPUTS = 16
+OUTPUT_KEYS = ["images", "gifs", "videos", "audio"]
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+# Uploads of these are not compressed, it would not make them smaller
+COMPRESSED_EXTENSIONS = [
+    ".png", ".jpg", ".jpeg", ".webp", ".gif", ".mp4", ".webm", ".mov",
+    ".mp3", ".ogg", ".flac", ".zip", ".gz", ".tar",
+]
+
+
+def input_choices(spec):
+    # The values a node input accepts, from its /object_info spec. Older
+    # ComfyUI lists them first, newer versions as COMBO options.
+    if not isinstance(spec, list) or not spec:
+        return []
+    if isinstance(spec[0], list):
+        return spec[0]
+    if spec[0] == "COMBO" and len(spec) > 1 and isinstance(spec[1], dict):
+        return spec[1].get("options", [])
+    return []
+
+
+class RequestDirectories:
+    def __init__(self, request_id, input_directory, output_directory):
+        self.request_id = request_id
+        self.input_directory = input_directory
+        self.output_directory = output_directory
+
+
+class AsyncComfyUI:
+    """
+    Runs many prompts at once on one ComfyUI server, from asyncio.
+
+    A single aiohttp session queues prompts over kept-alive connections,
+    and one websocket, read by a background task, routes messages to the
+    prompt they belong to, the same way ComfyUIWebSocket does for the
+    synchronous client. ComfyUI still runs one prompt at a time, but the
+    next prompt is already queued when the last one finishes, so the GPU
+    does not wait on the work between predictions.
+
+    Each request gets its own input and output subdirectories. Its outputs
+    are found from the prompt's history, rather than by listing the output
+    directory, so concurrent requests never see each other's files.
+
+    A remote server, on another host, cannot see those directories. Inputs
+    are uploaded to it with /upload/image and outputs downloaded with
+    /view, streamed in chunks rather than read into memory. Weights are not
+    downloaded for it. It must already have every weight the workflow
+    names, which is checked against its /object_info before queueing.
+
+    The ComfyUI instance's ExecutionCache policy applies to every server.
+    A reset is queued just ahead of the prompt that needs it, under a lock
+    so another request's prompt cannot land in between.
+    """
+
+    def __init__(self, comfyui, server=None):
+        # server is a ServerInstance when ComfyUI runs a pool of servers,
+        # otherwise prompts go to the ComfyUI instance's own server
+        self.comfyui = comfyui
+        self.server = server
+        self.server_address = server.address if server else comfyui.server_address
+        self.remote = server is not None and server.remote
+        self.client_id = str(uuid.uuid4())
+        self.session = None
+        self.ws = None
+        self.reader = None
+        self.queues = {}
+        self.unclaimed = {}
+        self.closed = False
+        self.started = None
+        self.name = server.name if server else "0"
+        self.reset_lock = asyncio.Lock()
+
+    async def start(self):
+        # Safe to call from every request, the first call connects and the
+        # rest wait for it. A failed start is tried again next time.
+        if self.started is None or (
+            self.started.done() and self.started.exception() is not None
+        ):
+            self.started = asyncio.ensure_future(self._start())
+        await self.started
+
+    async def _start(self):
+        if self.session is not None:
+            await self.session.close()
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=self.comfyui.client.timeout)
+        )
+        # Transfers can take longer than control requests, so they only time
+        # out when the connection stalls
+        self.transfer_timeout = aiohttp.ClientTimeout(
+            total=None, sock_read=self.comfyui.client.timeout
+        )
+        await self._connect()
+        self.reader = asyncio.ensure_future(self._read())
+
+    async def close(self):
+        self.closed = True
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.ws is not None:
+            await self.ws.close()
+        if self.session is not None:
+            await self.session.close()
+
+    async def _connect(self):
+        self.ws = await self.session.ws_connect(
+            f"http://{self.server_address}/ws?clientId={self.client_id}",
+            heartbeat=HEARTBEAT_INTERVAL,
+        )
+
+    async def _read(self):
+        while not self.closed:
+            async for message in self.ws:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    try:
+                        self._dispatch(message.json())
+                    except ValueError:
+                        continue
+                elif message.type in (
+                    aiohttp.WSMsgType.CLOSED,
+                    aiohttp.WSMsgType.ERROR,
+                ):
+                    break
+            if not self.closed:
+                await self._reconnect()
+
+    async def _reconnect(self):
+        attempt = 0
+        while not self.closed:
+            await asyncio.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            try:
+                await self._connect()
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                attempt += 1
+                print(f"⚠️  Could not reconnect to ComfyUI websocket: {e}")
+                continue
+            print("🔗 Reconnected to ComfyUI websocket")
+            await self._recover()
+            return
+
+    async def _recover(self):
+        # Messages sent while disconnected are lost, finished prompts are
+        # completed from their history
+        for prompt_id in list(self.queues):
+            try:
+                history = await self._get_json(f"/history/{prompt_id}")
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError, ValueError):
+                continue
+            if prompt_id not in history:
+                continue
+            status = history[prompt_id].get("status", {})
+            errors = [
+                {"type": name, "data": data}
+                for name, data in status.get("messages", [])
+                if name == "execution_error"
+            ]
+            for message in errors or [
+                {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}}
+            ]:
+                self._dispatch(message)
+
+    def _dispatch(self, message):
+        data = message.get("data")
+        prompt_id = data.get("prompt_id") if isinstance(data, dict) else None
+        if prompt_id is None:
+            return
+
+        messages = self.queues.get(prompt_id)
+        if messages is None:
+            self.unclaimed.setdefault(prompt_id, []).append(message)
+            while len(self.unclaimed) > UNCLAIMED_PROMPTS:
+                del self.unclaimed[next(iter(self.unclaimed))]
+            return
+        messages.put_nowait(message)
+
+    async def _get_json(self, endpoint):
+        async with self.session.get(f"http://{self.server_address}{endpoint}") as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def reset_execution_cache(self):
+        # The same reset as ComfyUI.reset_execution_cache, on this server.
+        # Messages for the reset prompt are left unclaimed.
+        print(f"Resetting execution cache on server {self.name}")
+        if self.comfyui.execution_cache.mode == "lru":
+            async with self.session.post(
+                f"http://{self.server_address}/free", json={"free_memory": True}
+            ) as response:
+                if response.status >= 400:
+                    print(f"Failed: /free, status code: {response.status}")
+        reset_workflow = await asyncio.to_thread(self.comfyui.reset_workflow)
+        prompt_id = await self.queue_prompt(reset_workflow)
+        self.queues.pop(prompt_id, None)
+        self.comfyui.execution_cache.reset_done(self.name)
+
+    async def queue_prompt(self, workflow):
+        async with self.session.post(
+            f"http://{self.server_address}/prompt",
+            json={"prompt": workflow, "client_id": self.client_id},
+        ) as response:
+            if response.status >= 400:
+                print(f"ComfyUI error: {response.status} {await response.text()}")
+                raise Exception(
+                    "ComfyUI Error – Your workflow could not be run. Please check the logs for details."
+                )
+            output = await response.json()
+
+        prompt_id = output["prompt_id"]
+        messages = asyncio.Queue()
+        for message in self.unclaimed.pop(prompt_id, []):
+            messages.put_nowait(message)
+        self.queues[prompt_id] = messages
+        return prompt_id
+
+    async def wait_for_prompt_completion(self, workflow, prompt_id, timeout=None):
+        messages = self.queues[prompt_id]
+        deadline = time.time() + timeout if timeout else None
+        try:
+            while True:
+                # Woken up every heartbeat interval, so a prompt on a server
+                # the pool finds dead fails rather than waiting forever
+                remaining = max(deadline - time.time(), 0) if deadline else None
+                wait = min(remaining, HEARTBEAT_INTERVAL) if deadline else HEARTBEAT_INTERVAL
+                try:
+                    message = await asyncio.wait_for(messages.get(), wait)
+                except asyncio.TimeoutError:
+                    if deadline and time.time() >= deadline:
+                        raise TimeoutError(
+                            f"Prompt {prompt_id} did not finish within {timeout:.1f} seconds"
+                        )
+                    if self.server is not None and not self.server.healthy:
+                        raise Exception(
+                            f"ComfyUI server {self.server.name} at {self.server_address} stopped responding while running prompt {prompt_id}"
+                        )
+                    continue
+
+                self.comfyui.execution_cache.on_message(message, prompt_id)
+                if message["type"] == "execution_error":
+                    self.comfyui.raise_execution_error(message)
+                if message["type"] == "executing":
+                    node_id = message["data"]["node"]
+                    if node_id is None:
+                        break
+                    self.comfyui.print_executing_node(workflow, node_id)
+        finally:
+            self.queues.pop(prompt_id, None)
+
+    async def run_workflow(self, workflow, outputs=None, timeout=None, directories=None):
+        await self.start()
+        workflow = await asyncio.to_thread(
+            self.comfyui.prepare_for_queue, workflow, outputs
+        )
+        if self.remote:
+            await self.check_weights(workflow)
+        if self.remote and directories is not None:
+            workflow = await self.upload_inputs(workflow, directories)
+        execution_cache = self.comfyui.execution_cache
+        async with self.reset_lock:
+            if execution_cache.needs_reset(self.name):
+                await self.reset_execution_cache()
+            prompt_id = await self.queue_prompt(workflow)
+        execution_cache.start_prompt(prompt_id)
+        print(f"Queued prompt {prompt_id}")
+        try:
+            await self.wait_for_prompt_completion(workflow, prompt_id, timeout)
+        finally:
+            execution_cache.report(prompt_id)
+        history = await self._get_json(f"/history/{prompt_id}")
+        return history[prompt_id]["outputs"]
+
+    async def check_weights(self, workflow):
+        filetypes = tuple(self.comfyui.weights_downloader.supported_filetypes)
+        needed = {
+            value
+            for node in workflow.values()
+            for value in node.get("inputs", {}).values()
+            if isinstance(value, str)
+            and value.endswith(filetypes)
+            and not os.path.isabs(value)
+            and not value.startswith(("http://", "https://"))
+        }
+        if not needed:
+            return
+
+        object_info = await self._get_json("/object_info")
+        available = set()
+        for info in object_info.values():
+            inputs = info.get("input", {})
+            for section in ("required", "optional"):
+                for spec in inputs.get(section, {}).values():
+                    available.update(
+                        choice for choice in input_choices(spec) if isinstance(choice, str)
+                    )
+
+        missing = sorted(needed - available)
+        if missing:
+            raise Exception(
+                f"ComfyUI server {self.name} at {self.server_address} does not have the weights {', '.join(missing)}"
+            )
+
+    def request_directories(self, request_id=None):
+        request_id = request_id or uuid.uuid4().hex
+        directories = RequestDirectories(
+            request_id,
+            os.path.join(self.comfyui.input_directory, request_id),
+            os.path.join(self.comfyui.output_directory, request_id),
+        )
+        os.makedirs(directories.input_directory, exist_ok=True)
+        os.makedirs(directories.output_directory, exist_ok=True)
+        self._remove_old_outputs()
+        return directories
+
+    def finish_request(self, directories):
+        shutil.rmtree(directories.input_directory, ignore_errors=True)
+
+    def _remove_old_outputs(self):
+        # Files are uploaded after predict returns, so output directories
+        # are only removed once newer requests have replaced them
+        try:
+            with os.scandir(self.comfyui.output_directory) as entries:
+                request_outputs = sorted(
+                    (entry for entry in entries if entry.is_dir()),
+                    key=lambda entry: entry.stat().st_mtime,
+                )
+        except FileNotFoundError:
+            return
+        for entry in request_outputs[:-KEPT_REQUEST_OUTPUTS]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _input_path(self, value, directories):
+        # The request input file a workflow value refers to, if any. Inputs
+        # from URLs are absolute paths, provided inputs are named relative
+        # to the input directory, like "<request_id>/image.png".
+        if not isinstance(value, str) or not value:
+            return None
+        path = os.path.join(self.comfyui.input_directory, value)
+        if os.path.dirname(path) != directories.input_directory:
+            return None
+        return path if os.path.isfile(path) else None
+
+    async def upload_inputs(self, workflow, directories):
+        # Files are uploaded into a subfolder of the server's input directory
+        # named after the request, and the workflow points to them there
+        references = []
+        for node in workflow.values():
+            inputs = node.get("inputs", {})
+            for key, value in inputs.items():
+                path = self._input_path(value, directories)
+                if path is not None:
+                    references.append((inputs, key, path))
+
+        paths = list(dict.fromkeys(path for _, _, path in references))
+        names = await asyncio.gather(
+            *[self._upload(path, directories.request_id) for path in paths]
+        )
+        uploaded = dict(zip(paths, names))
+        for inputs, key, path in references:
+            inputs[key] = uploaded[path]
+        return workflow
+
+    async def _upload(self, path, subfolder):
+        filename = os.path.basename(path)
+        compress = not filename.lower().endswith(tuple(COMPRESSED_EXTENSIONS))
+        start_time = time.time()
+        with open(path, "rb") as file:
+            form = aiohttp.FormData()
+            form.add_field("image", file, filename=filename)
+            form.add_field("type", "input")
+            form.add_field("subfolder", subfolder)
+            form.add_field("overwrite", "true")
+            async with self.session.post(
+                f"http://{self.server_address}/upload/image",
+                data=form,
+                compress="deflate" if compress else None,
+                timeout=self.transfer_timeout,
+            ) as response:
+                if response.status >= 400:
+                    raise Exception(
+                        f"Could not upload {filename} to ComfyUI server {self.server_address}: {response.status} {await response.text()}"
+                    )
+                result = await response.json()
+        print(
+            f"Uploaded {filename} to {self.server_address} in {time.time() - start_time:.2f} seconds"
+        )
+        return os.path.join(result.get("subfolder", ""), result["name"])
+
+    async def _download(self, item, destination):
+        params = {
+            "filename": item["filename"],
+            "subfolder": item.get("subfolder", ""),
+            "type": item["type"],
+        }
+        async with self.session.get(
+            f"http://{self.server_address}/view",
+            params=params,
+            timeout=self.transfer_timeout,
+        ) as response:
+            if response.status >= 400:
+                raise Exception(
+                    f"Could not download {item['filename']} from ComfyUI server {self.server_address}: {response.status} {await response.text()}"
+                )
+            with open(destination, "wb") as file:
+                async for chunk in response.content.iter_chunked(TRANSFER_CHUNK_SIZE):
+                    file.write(chunk)
+
+    async def collect_outputs(self, outputs, directories):
+        # Moves the files listed in a prompt's history outputs into the
+        # request's output directory, or downloads them from a remote server
+        server = self.server or self.comfyui
+        roots = {
+            "output": server.output_directory,
+            "temp": server.temp_directory,
+        }
+        files = []
+        for node_outputs in outputs.values():
+            for key in OUTPUT_KEYS:
+                for item in node_outputs.get(key, []):
+                    if not isinstance(item, dict) or item.get("type") not in roots:
+                        continue
+                    destination = os.path.join(
+                        directories.output_directory, item["filename"]
+                    )
+                    if self.remote:
+                        await self._download(item, destination)
+                        files.append(destination)
+                        continue
+
+                    source = os.path.join(
+                        roots[item["type"]], item.get("subfolder", ""), item["filename"]
+                    )
+                    if not os.path.isfile(source):
+                        continue
+                    shutil.move(source, destination)
+                    files.append(destination)
+        return sorted(files)
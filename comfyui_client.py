@@ -0,0 +1,118 @@
+import json
+import time
+import threading
+import http.client
+from http_pool import HTTPConnectionPool
+
+CONTROL_TIMEOUT = 30
+CONTROL_RETRIES = 2
+RETRY_DELAY = 0.2
+
+
+class ComfyUIRequestError(Exception):
+    def __init__(self, method, endpoint, status, body):
+        self.status = status
+        self.body = body
+        super().__init__(f"{method} {endpoint} failed with status {status}")
+
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+
+class ComfyUIClient:
+    """
+    Requests to ComfyUI's HTTP endpoints over kept-alive connections.
+
+    Every request has the same timeout. Requests that are safe to repeat,
+    GETs and POSTs marked idempotent, are retried on connection errors;
+    queueing a prompt is not, as it could queue the prompt twice. Time
+    spent on each endpoint is counted, so report() shows how much of a
+    prediction goes on the control plane rather than on running the
+    workflow.
+    """
+
+    def __init__(self, server_address, timeout=CONTROL_TIMEOUT, retries=CONTROL_RETRIES):
+        self.server_address = server_address
+        self.timeout = timeout
+        self.retries = retries
+        self.pool = HTTPConnectionPool(timeout=timeout, max_connections_per_host=4)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def request(self, method, endpoint, data=None, timeout=None, idempotent=None):
+        if idempotent is None:
+            idempotent = method == "GET"
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        body = json.dumps(data).encode("utf-8") if data is not None else None
+        url = f"http://{self.server_address}{endpoint}"
+
+        attempts = 1 + (self.retries if idempotent else 0)
+        for attempt in range(attempts):
+            start_time = time.time()
+            try:
+                with self.pool.request(
+                    method,
+                    url,
+                    headers=headers,
+                    body=body,
+                    timeout=timeout,
+                    idempotent=idempotent,
+                ) as response:
+                    status = response.status
+                    content = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(RETRY_DELAY * (attempt + 1))
+            finally:
+                self._record(method, endpoint, time.time() - start_time)
+
+        if status >= 400:
+            raise ComfyUIRequestError(method, endpoint, status, content)
+        return content
+
+    def get_json(self, endpoint, timeout=None):
+        return json.loads(self.request("GET", endpoint, timeout=timeout))
+
+    def post_json(self, endpoint, data=None, timeout=None, idempotent=False):
+        content = self.request(
+            "POST", endpoint, data=data, timeout=timeout, idempotent=idempotent
+        )
+        return json.loads(content) if content else None
+
+    def _record(self, method, endpoint, elapsed):
+        # Prompt ids and query strings are left out, so requests to the
+        # same endpoint are counted together
+        path = endpoint.split("?")[0]
+        if path.startswith("/history/"):
+            path = "/history/{prompt_id}"
+        with self.lock:
+            self.stats.setdefault(f"{method} {path}", EndpointStats()).add(elapsed)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {}
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+        if not stats:
+            return
+        total = sum(endpoint.total_time for endpoint in stats.values())
+        print(f"ComfyUI control requests: {total * 1000:.1f}ms")
+        for name, endpoint in sorted(stats.items()):
+            print(
+                f"  {name}: {endpoint.count} requests, "
+                f"{endpoint.total_time / endpoint.count * 1000:.2f}ms average, "
+                f"{endpoint.max_time * 1000:.2f}ms max"
+            )
@@ -0,0 +1,285 @@
+import os
+import time
+import socket
+import threading
+import subprocess
+import http.client
+from comfyui_client import ComfyUIClient, ComfyUIRequestError
+
+POOL_DIRECTORY = "/tmp/comfyui_pool"
+HEALTH_CHECK_INTERVAL = 5
+HEALTH_CHECK_TIMEOUT = 5
+RESTART_DELAY = 5
+
+
+def free_port(start_port, taken):
+    port = start_port
+    while True:
+        if port not in taken:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                try:
+                    s.bind(("127.0.0.1", port))
+                    return port
+                except OSError:
+                    pass
+        port += 1
+
+
+class ServerInstance:
+    """
+    One ComfyUI server in a pool, launched by the pool or already running.
+
+    A launched server has its own port, output, input and temp directories,
+    and optionally a device: a CUDA device index, or "cpu". A remote server
+    runs on another host and has no directories here, files go to and from
+    it over HTTP.
+    """
+
+    def __init__(
+        self,
+        name,
+        address,
+        output_directory,
+        input_directory,
+        temp_directory,
+        device=None,
+        command=None,
+    ):
+        self.name = name
+        self.address = address
+        self.port = int(address.rsplit(":", 1)[1]) if ":" in address else 80
+        self.output_directory = output_directory
+        self.input_directory = input_directory
+        self.temp_directory = temp_directory
+        self.device = device
+        self.command = command
+        self.client = ComfyUIClient(address, retries=0)
+        self.process = None
+        self.healthy = False
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.started_time = None
+
+    @property
+    def launched(self):
+        return self.command is not None
+
+    @property
+    def remote(self):
+        return self.output_directory is None
+
+    @property
+    def load(self):
+        # Prompts we dispatched that have not finished, or the server's own
+        # count of running and pending prompts if that is higher
+        return max(self.in_flight, self.queue_depth)
+
+    def start(self):
+        for directory in [
+            self.output_directory,
+            self.input_directory,
+            self.temp_directory,
+        ]:
+            os.makedirs(directory, exist_ok=True)
+
+        # ComfyUI keeps temp files in a temp directory below --temp-directory
+        command = self.command.format(
+            port=self.port,
+            output_directory=self.output_directory,
+            input_directory=self.input_directory,
+            temp_parent_directory=os.path.dirname(self.temp_directory),
+        )
+        if self.device == "cpu":
+            command += " --cpu"
+        elif self.device is not None:
+            command += f" --cuda-device {self.device}"
+
+        print(f"Starting ComfyUI server {self.name} on port {self.port}")
+        self.started_time = time.time()
+        self.healthy = False
+        self.process = subprocess.Popen(
+            command,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        threading.Thread(
+            target=self._print_output, args=(self.process,), daemon=True
+        ).start()
+
+    def _print_output(self, process):
+        for line in iter(process.stdout.readline, ""):
+            print(f"[ComfyUI {self.name}] {line.strip()}")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def exited(self):
+        return self.process is not None and self.process.poll() is not None
+
+    def check_health(self):
+        if self.exited():
+            self.healthy = False
+            return False
+        try:
+            queue = self.client.get_json("/queue", timeout=HEALTH_CHECK_TIMEOUT)
+        except (ComfyUIRequestError, http.client.HTTPException, OSError, ValueError):
+            self.healthy = False
+            return False
+        self.queue_depth = len(queue.get("queue_running", [])) + len(
+            queue.get("queue_pending", [])
+        )
+        self.healthy = True
+        return True
+
+
+class ServerPool:
+    """
+    Several ComfyUI servers on one host, with prompts sent to the least
+    loaded.
+
+    The pool can include a server that is already running, like the one
+    ComfyUI.start_server launches, and servers on other hosts, and launches
+    the rest itself, each on a free port from base_port up, with
+    directories under POOL_DIRECTORY. Devices are handed out to launched
+    servers in turn.
+
+    A background thread checks every server's /queue, which keeps queue
+    depths current, marks servers that stop answering unhealthy, and
+    restarts launched servers whose process exited. acquire() picks the
+    healthy server with the lowest load, so a dead host gets no prompts
+    until it answers again.
+    """
+
+    def __init__(self):
+        self.instances = []
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.closed = False
+        self.health_thread = None
+
+    def add_existing(self, name, address, output_directory, input_directory, temp_directory):
+        instance = ServerInstance(
+            name, address, output_directory, input_directory, temp_directory
+        )
+        instance.healthy = True
+        self.instances.append(instance)
+        return instance
+
+    def add_remote(self, name, address):
+        # Checked before use, a host that is down is not given prompts
+        instance = ServerInstance(name, address, None, None, None)
+        self.instances.append(instance)
+        if instance.check_health():
+            print(f"✅ Remote ComfyUI server {name} at {address} is healthy")
+        else:
+            print(f"⚠️  Remote ComfyUI server {name} at {address} is not responding")
+        return instance
+
+    def launch(self, count, command, base_port=8189, devices=None, input_directory=None):
+        # Servers can share an input directory, so inputs saved once can be
+        # loaded by whichever server runs the prompt
+        taken = {instance.port for instance in self.instances}
+        for index in range(count):
+            name = str(len(self.instances))
+            port = free_port(base_port, taken)
+            taken.add(port)
+            directory = os.path.join(POOL_DIRECTORY, name)
+            instance = ServerInstance(
+                name,
+                f"127.0.0.1:{port}",
+                os.path.join(directory, "output"),
+                input_directory or os.path.join(directory, "input"),
+                os.path.join(directory, "temp"),
+                device=devices[index % len(devices)] if devices else None,
+                command=command,
+            )
+            instance.start()
+            self.instances.append(instance)
+
+    def wait_until_ready(self, timeout=120):
+        start_time = time.time()
+        pending = [instance for instance in self.instances if instance.launched]
+        while pending:
+            for instance in list(pending):
+                if instance.exited():
+                    raise RuntimeError(
+                        f"ComfyUI server {instance.name} exited with code {instance.process.returncode} before it started"
+                    )
+                if instance.check_health():
+                    print(
+                        f"ComfyUI server {instance.name} started in {time.time() - instance.started_time:.2f} seconds"
+                    )
+                    pending.remove(instance)
+            if pending and time.time() - start_time > timeout:
+                raise TimeoutError(
+                    f"ComfyUI servers {', '.join(i.name for i in pending)} did not start within {timeout} seconds"
+                )
+            if pending:
+                time.sleep(0.5)
+
+        self.health_thread = threading.Thread(target=self._check_health, daemon=True)
+        self.health_thread.start()
+
+    def _check_health(self):
+        while not self.closed:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            for instance in self.instances:
+                was_healthy = instance.healthy
+                healthy = instance.check_health()
+                if was_healthy and not healthy:
+                    print(f"⚠️  ComfyUI server {instance.name} is not responding")
+                elif healthy and not was_healthy:
+                    print(f"✅ ComfyUI server {instance.name} is healthy")
+                if (
+                    instance.launched
+                    and instance.exited()
+                    and time.time() - instance.started_time > RESTART_DELAY
+                    and not self.closed
+                ):
+                    print(
+                        f"⚠️  ComfyUI server {instance.name} exited with code {instance.process.returncode}, restarting"
+                    )
+                    instance.start()
+            with self.condition:
+                self.condition.notify_all()
+
+    def acquire(self, timeout=None):
+        # The healthy server with the lowest load, counted as busy until
+        # release()
+        deadline = time.time() + timeout if timeout else None
+        with self.condition:
+            while True:
+                healthy = [instance for instance in self.instances if instance.healthy]
+                if healthy:
+                    instance = min(healthy, key=lambda instance: instance.load)
+                    instance.in_flight += 1
+                    return instance
+                remaining = deadline - time.time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    raise Exception("No healthy ComfyUI server is available")
+                self.condition.wait(remaining)
+
+    def release(self, instance):
+        with self.condition:
+            instance.in_flight -= 1
+            self.condition.notify_all()
+
+    def stop(self):
+        self.closed = True
+        for instance in self.instances:
+            instance.stop()
+
+    def report(self):
+        for instance in self.instances:
+            state = "healthy" if instance.healthy else "unhealthy"
+            print(
+                f"ComfyUI server {instance.name} at {instance.address}: {state}, "
+                f"{instance.in_flight} in flight, queue depth {instance.queue_depth}"
+            )
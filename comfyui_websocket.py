@@ -0,0 +1,187 @@
+import json
+import time
+import uuid
+import queue
+import threading
+import http.client
+from collections import OrderedDict
+import websocket
+from comfyui_client import ComfyUIRequestError
+
+HEARTBEAT_INTERVAL = 15
+RECONNECT_DELAYS = [0.5, 1, 2, 5]
+# Messages for prompts nobody is waiting on yet are kept for this many prompts
+UNCLAIMED_PROMPTS = 32
+
+
+class PromptHandle:
+    def __init__(self, prompt_id):
+        self.prompt_id = prompt_id
+        self.messages = queue.Queue()
+
+    def next(self, timeout=None):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(
+                f"No message from ComfyUI for prompt {self.prompt_id} within {timeout:.1f} seconds"
+            )
+
+
+class ComfyUIWebSocket:
+    """
+    One websocket connection to ComfyUI, shared by every prediction.
+
+    A background thread reads messages and hands each one to the handle
+    watching its prompt_id. Messages that arrive before anyone watches
+    their prompt, which happens when a prompt starts right after it is
+    queued, are kept until watch() is called.
+
+    The thread pings the server when the connection is quiet, and
+    reconnects with the same client_id when it drops. Messages sent while
+    disconnected are lost, so after reconnecting, prompts being watched
+    are looked up in ComfyUI's history and their outcome is delivered from
+    there.
+    """
+
+    def __init__(self, server_address, client, client_id=None):
+        self.server_address = server_address
+        self.client = client
+        self.client_id = client_id or str(uuid.uuid4())
+        self.lock = threading.Lock()
+        self.handles = {}
+        self.unclaimed = OrderedDict()
+        self.ws = None
+        self.closed = False
+        self.reconnects = 0
+        self.last_received = time.time()
+        self.thread = None
+
+    def start(self):
+        # The first connection is made here, so a server that is not up
+        # fails the caller rather than the background thread
+        self._connect()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.closed = True
+        if self.ws is not None:
+            self.ws.close()
+
+    def watch(self, prompt_id):
+        handle = PromptHandle(prompt_id)
+        with self.lock:
+            self.handles[prompt_id] = handle
+            for message in self.unclaimed.pop(prompt_id, []):
+                handle.messages.put(message)
+        return handle
+
+    def release(self, prompt_id):
+        with self.lock:
+            self.handles.pop(prompt_id, None)
+
+    def _connect(self):
+        ws = websocket.WebSocket()
+        ws.connect(
+            f"ws://{self.server_address}/ws?clientId={self.client_id}",
+            timeout=HEARTBEAT_INTERVAL,
+        )
+        self.ws = ws
+        self.last_received = time.time()
+
+    def _run(self):
+        while not self.closed:
+            try:
+                opcode, data = self.ws.recv_data(control_frame=True)
+            except websocket.WebSocketTimeoutException:
+                self._heartbeat()
+                continue
+            except (websocket.WebSocketException, OSError):
+                if not self.closed:
+                    self._reconnect()
+                continue
+
+            self.last_received = time.time()
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                if not self.closed:
+                    self._reconnect()
+            elif opcode == websocket.ABNF.OPCODE_TEXT:
+                try:
+                    message = json.loads(data)
+                except ValueError:
+                    continue
+                self._dispatch(message)
+
+    def _heartbeat(self):
+        # Nothing heard for two intervals, not even a pong, means the
+        # connection is gone even if the socket has not noticed
+        if time.time() - self.last_received > 2 * HEARTBEAT_INTERVAL:
+            print("⚠️  ComfyUI websocket stopped responding, reconnecting")
+            self._reconnect()
+            return
+        try:
+            self.ws.ping()
+        except (websocket.WebSocketException, OSError):
+            self._reconnect()
+
+    def _reconnect(self):
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except (websocket.WebSocketException, OSError):
+                pass
+
+        attempt = 0
+        while not self.closed:
+            delay = RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+            time.sleep(delay)
+            try:
+                self._connect()
+            except (websocket.WebSocketException, OSError) as e:
+                attempt += 1
+                print(f"⚠️  Could not reconnect to ComfyUI websocket: {e}")
+                continue
+            self.reconnects += 1
+            print("🔗 Reconnected to ComfyUI websocket")
+            self._recover()
+            return
+
+    def _recover(self):
+        with self.lock:
+            prompt_ids = list(self.handles)
+        for prompt_id in prompt_ids:
+            try:
+                history = self.client.get_json(f"/history/{prompt_id}")
+            except (ComfyUIRequestError, http.client.HTTPException, OSError, ValueError):
+                continue
+            if prompt_id not in history:
+                # Still queued or running, its messages will follow
+                continue
+
+            status = history[prompt_id].get("status", {})
+            errors = [
+                {"type": name, "data": data}
+                for name, data in status.get("messages", [])
+                if name == "execution_error"
+            ]
+            for message in errors or [
+                {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}}
+            ]:
+                self._dispatch(message)
+
+    def _dispatch(self, message):
+        data = message.get("data")
+        prompt_id = data.get("prompt_id") if isinstance(data, dict) else None
+        if prompt_id is None:
+            return
+
+        with self.lock:
+            handle = self.handles.get(prompt_id)
+            if handle is None:
+                self.unclaimed.setdefault(prompt_id, []).append(message)
+                self.unclaimed.move_to_end(prompt_id)
+                while len(self.unclaimed) > UNCLAIMED_PROMPTS:
+                    self.unclaimed.popitem(last=False)
+                return
+        handle.messages.put(message)
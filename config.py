@@ -4,4 +4,10 @@ config = {
     "MODELS_PATH": "ComfyUI/models",
     "USER_WEIGHTS_PATH": "downloaded_user_models",
     "USER_WEIGHTS_MANIFEST_PATH": "downloaded_user_models/weights.json",
+    "WEIGHTS_STORE_PATH": "ComfyUI/models/.weights_store",
+    "WEIGHTS_LEDGER_PATH": "ComfyUI/models/.weights_ledger.json",
+    "WEIGHTS_STAGING_PATH": "ComfyUI/models/.weights_staging",
+    "WEIGHTS_COOCCURRENCE_PATH": "ComfyUI/models/.weights_cooccurrence.json",
+    "WEIGHTS_TELEMETRY_PATH": "ComfyUI/models/.weights_telemetry.jsonl",
+    "WEIGHTS_MANIFEST_SNAPSHOT_PATH": "ComfyUI/models/.weights_manifest_snapshot.json",
 }
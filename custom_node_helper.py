@@ -11,6 +11,12 @@ class CustomNodeHelper:
         # Placeholder method for mapping weights based on a base URL.
         return {}
 
+    @staticmethod
+    def node_types():
+        # Placeholder method listing the node class types that add_weights and
+        # check_for_unsupported_nodes act on. None means every node.
+        return None
+
     @staticmethod
     def add_weights(weights_to_download, node):
         # Placeholder method to add weights to download list based on node specifications.
@@ -11,6 +11,13 @@ MODELS = [
 
 
 class ComfyUI_Advanced_Live_Portrait(CustomNodeHelper):
+    @staticmethod
+    def node_types():
+        return [
+            "ExpressionEditor",
+            "AdvancedLivePortrait",
+        ]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type_in(["ExpressionEditor", "AdvancedLivePortrait"]):
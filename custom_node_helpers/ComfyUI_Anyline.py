@@ -8,6 +8,10 @@ class ComfyUI_Anyline(CustomNodeHelper):
     def models():
         return MODELS
 
+    @staticmethod
+    def node_types():
+        return ["AnyLinePreprocessor"]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type("AnyLinePreprocessor"):
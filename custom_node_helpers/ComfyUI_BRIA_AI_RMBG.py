@@ -9,6 +9,10 @@ class ComfyUI_BRIA_AI_RMBG(CustomNodeHelper):
     def models():
         return MODELS
 
+    @staticmethod
+    def node_types():
+        return ["BRIA_RMBG_ModelLoader_Zho"]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type("BRIA_RMBG_ModelLoader_Zho"):
@@ -15,6 +15,13 @@ class ComfyUI_BiRefNet(CustomNodeHelper):
     def models():
         return MODELS
 
+    @staticmethod
+    def node_types():
+        return [
+            "BiRefNet_ModelLoader_Zho",
+            "AutoDownloadBiRefNetModel",
+        ]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type("BiRefNet_ModelLoader_Zho"):
@@ -173,6 +173,10 @@ class ComfyUI_Controlnet_Aux(CustomNodeHelper):
             ],
         }
 
+    @staticmethod
+    def node_types():
+        return [*ComfyUI_Controlnet_Aux.node_class_mapping(), "AIO_Preprocessor"]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         node_mapping = ComfyUI_Controlnet_Aux.node_class_mapping()
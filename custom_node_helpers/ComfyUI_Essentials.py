@@ -2,6 +2,10 @@ from custom_node_helper import CustomNodeHelper
 
 
 class ComfyUI_Essentials(CustomNodeHelper):
+    @staticmethod
+    def node_types():
+        return ["LoadCLIPSegModels"]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type("LoadCLIPSegModels"):
@@ -1,6 +1,10 @@
 from custom_node_helper import CustomNodeHelper
 
 class ComfyUI_FBCNN(CustomNodeHelper):
+    @staticmethod
+    def node_types():
+        return ["JPEG artifacts removal FBCNN"]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type("JPEG artifacts removal FBCNN"):
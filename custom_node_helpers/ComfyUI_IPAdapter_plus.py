@@ -142,6 +142,15 @@ class ComfyUI_IPAdapter_plus(CustomNodeHelper):
 
         return weights_to_add
 
+    @staticmethod
+    def node_types():
+        return [
+            "IPAdapterUnifiedLoader",
+            "IPAdapterUnifiedLoaderFaceID",
+            "IPAdapterUnifiedLoaderCommunity",
+            "IPAdapterInsightFaceLoader",
+        ]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type_in(
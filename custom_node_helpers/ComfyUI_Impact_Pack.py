@@ -1,6 +1,10 @@
 from custom_node_helper import CustomNodeHelper
 
 class ComfyUI_Impact_Pack(CustomNodeHelper):
+    @staticmethod
+    def node_types():
+        return ["UltralyticsDetectorProvider"]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type("UltralyticsDetectorProvider"):
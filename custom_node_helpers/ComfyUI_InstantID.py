@@ -2,6 +2,14 @@ from custom_node_helper import CustomNodeHelper
 
 
 class ComfyUI_InstantID(CustomNodeHelper):
+    @staticmethod
+    def node_types():
+        return [
+            "InstantIDFaceAnalysis",
+            "InstantIDModelLoader",
+            "ControlNetLoader",
+        ]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type("InstantIDFaceAnalysis"):
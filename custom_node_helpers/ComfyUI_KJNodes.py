@@ -1,6 +1,16 @@
 from custom_node_helper import CustomNodeHelper
 
+UNSUPPORTED_NODES = {
+    "StabilityAPI_SD3": "Calling an external API and passing your key is not supported and is unsafe",
+    "Superprompt": "Superprompt is not supported as it needs to download T5 weights",
+}
+
+
 class ComfyUI_KJNodes(CustomNodeHelper):
+    @staticmethod
+    def node_types():
+        return ["BatchCLIPSeg", "DownloadAndLoadCLIPSeg", *UNSUPPORTED_NODES]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type_in(["BatchCLIPSeg", "DownloadAndLoadCLIPSeg"]):
@@ -8,8 +18,4 @@ class ComfyUI_KJNodes(CustomNodeHelper):
 
     @staticmethod
     def check_for_unsupported_nodes(node):
-        unsupported_nodes = {
-            "StabilityAPI_SD3": "Calling an external API and passing your key is not supported and is unsafe",
-            "Superprompt": "Superprompt is not supported as it needs to download T5 weights",
-        }
-        node.raise_if_unsupported(unsupported_nodes)
+        node.raise_if_unsupported(UNSUPPORTED_NODES)
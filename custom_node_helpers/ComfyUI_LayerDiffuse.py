@@ -33,6 +33,19 @@ class ComfyUI_LayerDiffuse(CustomNodeHelper):
 
         return vae_weights_map.get(config, [])
 
+    @staticmethod
+    def node_types():
+        return [
+            "LayeredDiffusionApply",
+            "LayeredDiffusionJointApply",
+            "LayeredDiffusionCondApply",
+            "LayeredDiffusionCondJointApply",
+            "LayeredDiffusionDiffApply",
+            "LayeredDiffusionDecode",
+            "LayeredDiffusionDecodeRGBA",
+            "LayeredDiffusionDecodeSplit",
+        ]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type_in(
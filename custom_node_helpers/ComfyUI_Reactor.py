@@ -9,6 +9,15 @@ class ComfyUI_Reactor(CustomNodeHelper):
         "YOLOv5n": "yolov5n-face.pth",
     }
 
+    @staticmethod
+    def node_types():
+        return [
+            "ReActorFaceSwap",
+            "ReActorLoadFaceModel",
+            "ReActorSaveFaceModel",
+            "ReActorFaceSwapOpt",
+        ]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type_in(
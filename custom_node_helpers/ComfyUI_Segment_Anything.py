@@ -14,6 +14,13 @@ MODEL_WEIGHTS = {
 
 
 class ComfyUI_Segment_Anything(CustomNodeHelper):
+    @staticmethod
+    def node_types():
+        return [
+            "SAMModelLoader (segment anything)",
+            "GroundingDinoModelLoader (segment anything)",
+        ]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type_in(
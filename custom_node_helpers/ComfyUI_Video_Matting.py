@@ -15,6 +15,13 @@ class ComfyUI_Video_Matting(CustomNodeHelper):
     def models():
         return RVM_MODELS + BRIAAI_MODELS
 
+    @staticmethod
+    def node_types():
+        return [
+            "BRIAAI Matting",
+            "Robust Video Matting",
+        ]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         if node.is_type("BRIAAI Matting"):
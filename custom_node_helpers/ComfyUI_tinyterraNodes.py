@@ -2,6 +2,10 @@ from custom_node_helper import CustomNodeHelper
 
 
 class ComfyUI_tinyterraNodes(CustomNodeHelper):
+    @staticmethod
+    def node_types():
+        return ["ttN imageREMBG"]
+
     @staticmethod
     def check_for_unsupported_nodes(node):
         if node.is_type("ttN imageREMBG"):
@@ -3,7 +3,6 @@ from config import config
 
 HUGGINGFACE_CACHE_PATH = "/root/.cache/huggingface/hub"
 FACEXLIB_PATH = f"{config['MODELS_PATH']}/facexlib"
-BASE_FILE_PATH = "https://weights.replicate.delivery/default/comfy-ui"
 
 facexlib_models = [
     "detection_Resnet50_Final.pth",
@@ -14,28 +13,34 @@ facexlib_models = [
 
 class PuLID(CustomNodeHelper):
     @staticmethod
-    def add_weights(weights_to_download, node):
-        if node.is_type_in(
-            [
-                "PulidEvaClipLoader",
-                "PulidFluxEvaClipLoader",
-                "ApplyPulid",
-                "ApplyPulidFlux",
-            ]
-        ):
-            from weights_downloader import WeightsDownloader
-
-            weights_downloader = WeightsDownloader()
+    def node_types():
+        return [
+            "PulidEvaClipLoader",
+            "PulidFluxEvaClipLoader",
+            "ApplyPulid",
+            "ApplyPulidFlux",
+            "PulidInsightFaceLoader",
+            "PulidFluxInsightFaceLoader",
+        ]
 
-            if node.is_type_in(["PulidEvaClipLoader", "PulidFluxEvaClipLoader"]):
-                weights_to_download.append("EVA02_CLIP_L_336_psz14_s6B.pt")
+    @staticmethod
+    def weights_map(base_url):
+        # PuLID loads facexlib models from its own folder. These share names
+        # and urls with the facedetection weights, so each name maps to both
+        # destinations and the weights store links the second copy.
+        return {
+            file: {
+                "url": f"{base_url}/facedetection/{file}.tar",
+                "dest": FACEXLIB_PATH,
+            }
+            for file in facexlib_models
+        }
 
-            if node.is_type_in(["ApplyPulid", "ApplyPulidFlux"]):
-                for file in facexlib_models:
-                    weights_downloader.download_if_not_exists(
-                        file,
-                        f"{BASE_FILE_PATH}/facedetection/{file}.tar",
-                        FACEXLIB_PATH,
-                    )
+    @staticmethod
+    def add_weights(weights_to_download, node):
+        if node.is_type_in(["PulidEvaClipLoader", "PulidFluxEvaClipLoader"]):
+            weights_to_download.append("EVA02_CLIP_L_336_psz14_s6B.pt")
+        elif node.is_type_in(["ApplyPulid", "ApplyPulidFlux"]):
+            weights_to_download.extend(facexlib_models)
         elif node.is_type_in(["PulidInsightFaceLoader", "PulidFluxInsightFaceLoader"]):
             weights_to_download.append("models/antelopev2")
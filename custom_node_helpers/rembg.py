@@ -2,6 +2,13 @@ from custom_node_helper import CustomNodeHelper
 
 
 class rembg(CustomNodeHelper):
+    @staticmethod
+    def node_types():
+        return [
+            "RemBGSession+",
+            "Image Rembg (Remove Background)",
+        ]
+
     @staticmethod
     def add_weights(weights_to_download, node):
         # RemBGSession+ is in ComfyUI_essentials
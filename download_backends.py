@@ -0,0 +1,266 @@
+import os
+import abc
+import shutil
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from http_pool import default_pool
+from resumable_download import ResumableDownload
+from weights_store import extract_tar
+
+# Downloads at least this big are staged with a journal so they can resume
+RESUMABLE_MIN_BYTES = int(
+    float(os.getenv("WEIGHTS_RESUMABLE_MIN_GB", "1")) * 1024 * 1024 * 1024
+)
+STREAM_CHUNK_SIZE = 16 * 1024 * 1024
+STREAM_CONCURRENCY = 8
+READ_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadBackend(abc.ABC):
+    name = None
+
+    def __init__(self, pool=default_pool):
+        self.pool = pool
+
+    @staticmethod
+    def available():
+        return True
+
+    @abc.abstractmethod
+    def download_file(self, url, path, timeout=None):
+        pass
+
+    @abc.abstractmethod
+    def download_and_extract(self, url, directory, transfer=None):
+        pass
+
+    def fetch(self, url, staged, size=None, transfer=None):
+        # Downloads the tarball at url and extracts it into the staging area.
+        # Large or previously interrupted downloads keep the tarball on disk
+        # with a journal so they can resume; everything else goes through
+        # the backend's own download_and_extract. Backends that see the
+        # responses mark the first byte on transfer for telemetry.
+        hashes = transfer.hashes if transfer is not None else None
+        if os.path.exists(staged.tar_path):
+            print(f"Using previously downloaded {url}")
+            staged.extract(hashes)
+        elif staged.has_partial_download() or (
+            size is not None and size >= RESUMABLE_MIN_BYTES
+        ):
+            ResumableDownload(
+                url, staged.tar_path, pool=self.pool, transfer=transfer
+            ).run()
+            staged.extract(hashes)
+        else:
+            self.download_and_extract(url, staged.extract_dir, transfer)
+
+
+class PgetBackend(DownloadBackend):
+    name = "pget"
+
+    @staticmethod
+    def available():
+        return shutil.which("pget") is not None
+
+    def _pget(self, args, timeout=None):
+        try:
+            subprocess.check_call(
+                ["pget", "--log-level", "warn", *args],
+                close_fds=False,
+                timeout=timeout,
+            )
+        except subprocess.CalledProcessError as e:
+            raise DownloadError(f"pget exited with status {e.returncode}") from e
+        except subprocess.TimeoutExpired as e:
+            raise DownloadError(f"pget timed out after {timeout}s") from e
+
+    def download_file(self, url, path, timeout=None):
+        self._pget(["-f", url, path], timeout=timeout)
+
+    def download_and_extract(self, url, directory, transfer=None):
+        # pget cannot be limited to a rate, throttled transfers are read by
+        # the Python backend instead
+        if transfer is not None and transfer.throttled:
+            HttpBackend(self.pool).download_and_extract(url, directory, transfer)
+            return
+        self._pget(["-xf", url, directory])
+
+
+class ThrottledReader:
+    # Reports each read to the transfer, which limits its rate
+
+    def __init__(self, stream, transfer):
+        self.stream = stream
+        self.transfer = transfer
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.transfer.received(len(data))
+        return data
+
+
+class RangeStream:
+    """
+    A file-like object reading a URL in order while fetching it in parallel.
+
+    The URL is split into fixed-size byte ranges. A window of ranges is
+    fetched concurrently ahead of the reader and handed over in order, so
+    memory use is bounded by the window rather than the file size.
+    """
+
+    def __init__(self, pool, url, size, chunk_size, concurrency, transfer=None):
+        self.pool = pool
+        self.transfer = transfer
+        self.url = url
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_count = (size + chunk_size - 1) // chunk_size
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.window = concurrency * 2
+        self.futures = {}
+        self.next_chunk = 0
+        self.buffer = memoryview(b"")
+        self.position = 0
+        for _ in range(min(self.window, self.chunk_count)):
+            self._submit_next()
+
+    def _submit_next(self):
+        index = self.next_chunk
+        self.futures[index] = self.executor.submit(self._fetch_chunk, index)
+        self.next_chunk += 1
+
+    def _fetch_chunk(self, index):
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, self.size) - 1
+        with self.pool.request(
+            "GET", self.url, headers={"Range": f"bytes={start}-{end}"}
+        ) as response:
+            if response.status != 206:
+                raise DownloadError(
+                    f"Expected a partial response for {self.url}, got {response.status}"
+                )
+            if self.transfer is not None:
+                self.transfer.first_byte()
+            pieces = []
+            for piece in iter(lambda: response.read(READ_SIZE), b""):
+                pieces.append(piece)
+                if self.transfer is not None:
+                    self.transfer.received(len(piece))
+            data = b"".join(pieces)
+        if len(data) != end - start + 1:
+            raise DownloadError(f"Chunk {index} of {self.url} was truncated")
+        return data
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if not self.buffer:
+                index = self.position // self.chunk_size
+                if index >= self.chunk_count:
+                    break
+                self.buffer = memoryview(self.futures.pop(index).result())
+                if self.next_chunk < self.chunk_count:
+                    self._submit_next()
+
+            take = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+            chunks.append(self.buffer[:take].tobytes())
+            self.buffer = self.buffer[take:]
+            self.position += take
+            if size > 0:
+                size -= take
+        return b"".join(chunks)
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown(wait=True)
+
+
+class HttpBackend(DownloadBackend):
+    """
+    Downloads with parallel HTTP range requests over pooled connections.
+
+    Tarballs are extracted as they stream in, without being written to disk
+    first. Servers that do not support range requests are read in a single
+    stream instead.
+    """
+
+    name = "python"
+
+    def __init__(
+        self, pool=default_pool, chunk_size=STREAM_CHUNK_SIZE, concurrency=STREAM_CONCURRENCY
+    ):
+        super().__init__(pool)
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+
+    def _head(self, url, timeout=None):
+        with self.pool.request("HEAD", url, timeout=timeout) as response:
+            if response.status >= 400:
+                raise DownloadError(f"{url} returned {response.status}")
+            size = response.getheader("Content-Length")
+            accepts_ranges = response.getheader("Accept-Ranges", "").lower() == "bytes"
+            return (int(size) if size else None), accepts_ranges
+
+    def download_file(self, url, path, timeout=None):
+        tmp_path = f"{path}.tmp"
+        try:
+            with self.pool.request("GET", url, timeout=timeout) as response:
+                if response.status >= 400:
+                    raise DownloadError(f"{url} returned {response.status}")
+                with open(tmp_path, "wb") as f:
+                    shutil.copyfileobj(response, f, READ_SIZE)
+        except (OSError, http.client.HTTPException) as e:
+            raise DownloadError(f"Failed to download {url}: {e}") from e
+        os.replace(tmp_path, path)
+
+    def download_and_extract(self, url, directory, transfer=None):
+        try:
+            size, accepts_ranges = self._head(url)
+            if size and accepts_ranges:
+                stream = RangeStream(
+                    self.pool, url, size, self.chunk_size, self.concurrency, transfer
+                )
+                try:
+                    self._extract(stream, directory, transfer)
+                finally:
+                    stream.close()
+            else:
+                with self.pool.request("GET", url) as response:
+                    if response.status >= 400:
+                        raise DownloadError(f"{url} returned {response.status}")
+                    stream = response
+                    if transfer is not None:
+                        transfer.first_byte()
+                        stream = ThrottledReader(response, transfer)
+                    self._extract(stream, directory, transfer)
+                    response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise DownloadError(f"Failed to download {url}: {e}") from e
+
+    @staticmethod
+    def _extract(stream, directory, transfer=None):
+        # Files are hashed as they stream in, for the weights store and
+        # checksum verification
+        extract_tar(stream, directory, transfer.hashes if transfer is not None else None)
+
+
+BACKENDS = {backend.name: backend for backend in [PgetBackend, HttpBackend]}
+
+
+def get_download_backend(name=None):
+    # WEIGHTS_DOWNLOAD_BACKEND picks a backend, by default pget if it is
+    # installed and the Python backend otherwise
+    name = name or os.getenv("WEIGHTS_DOWNLOAD_BACKEND", "auto")
+    if name == "auto":
+        name = "pget" if PgetBackend.available() else "python"
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown download backend {name}, choose from {', '.join(BACKENDS)}"
+        )
+    return BACKENDS[name]()
@@ -0,0 +1,191 @@
+import os
+import time
+import contextvars
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+DEFAULT_CONCURRENCY = 4
+SIZE_PROBE_CONCURRENCY = 16
+SIZE_PROBE_TIMEOUT = 5
+
+
+def path_size(path):
+    # Size in bytes of a file, or of every file below a directory
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            file_path = os.path.join(root, f)
+            if not os.path.islink(file_path):
+                total += os.path.getsize(file_path)
+    return total
+
+
+def probe_size(url):
+    # Size of the file at url from a HEAD request, or None if unknown
+    try:
+        request = urllib.request.Request(url, method="HEAD")
+        with urllib.request.urlopen(request, timeout=SIZE_PROBE_TIMEOUT) as response:
+            content_length = response.headers.get("Content-Length")
+            return int(content_length) if content_length else None
+    except Exception:
+        return None
+
+
+class DownloadJob:
+    def __init__(self, weight_str, url, dest):
+        self.weight_str = weight_str
+        self.url = url
+        self.dest = dest
+        self.size = None
+        self.bytes_downloaded = 0
+        self.error = None
+
+    def key(self):
+        return (self.url, self.dest)
+
+
+class DownloadScheduler:
+    """
+    Runs weight download jobs with bounded concurrency.
+
+    Jobs are started largest first, so the longest transfers overlap with
+    everything else instead of running on their own at the end. When a job
+    fails no new jobs are started, running jobs are allowed to finish, and
+    the failures are raised in job order so the error is the same from run
+    to run.
+    """
+
+    def __init__(self, weights_downloader, concurrency=None):
+        self.weights_downloader = weights_downloader
+        if concurrency is None:
+            concurrency = int(
+                os.getenv("WEIGHTS_DOWNLOAD_CONCURRENCY", DEFAULT_CONCURRENCY)
+            )
+        self.concurrency = max(1, concurrency)
+
+    def jobs_for(self, weights):
+        jobs = []
+        seen = set()
+        for weight_str in sorted(set(weights)):
+            self.weights_downloader.warn_if_non_commercial(weight_str)
+            for url, dest in self.weights_downloader.get_weight_sources(weight_str):
+                job = DownloadJob(weight_str, url, dest)
+                if job.key() not in seen:
+                    seen.add(job.key())
+                    jobs.append(job)
+        return jobs
+
+    def run(self, weights):
+        jobs = self.jobs_for(weights)
+
+        # Catch truncated or corrupted weights before ComfyUI tries to load them
+        for job in jobs:
+            with self.weights_downloader.claim(job.url, job.dest):
+                if self.weights_downloader.check_if_file_exists(
+                    job.weight_str, job.dest
+                ) and not self.weights_downloader.validate_weight(
+                    job.weight_str, job.dest
+                ):
+                    self.weights_downloader.remove_weight(
+                        job.weight_str, job.url, job.dest
+                    )
+
+        missing = [
+            job
+            for job in jobs
+            if not self.weights_downloader.check_if_file_exists(
+                job.weight_str, job.dest
+            )
+        ]
+
+        ledger = self.weights_downloader.weights_ledger
+        for job in jobs:
+            if job not in missing:
+                print(f"✅ {job.weight_str} exists in {job.dest}")
+                self.weights_downloader.record_hit(job.weight_str, job.url, job.dest)
+
+        if not missing:
+            ledger.save()
+            return
+
+        self._probe_sizes(missing)
+        missing.sort(key=lambda job: (-(job.size or 0), job.weight_str, job.dest))
+        self.weights_downloader.make_room(
+            sum(job.size or 0 for job in missing),
+            exclude=[job.weight_str for job in jobs],
+        )
+
+        print(
+            f"⏳ Downloading {len(missing)} weights with concurrency {self.concurrency}"
+        )
+        failed = Event()
+        start = time.time()
+
+        def run_job(job):
+            if failed.is_set():
+                return
+            try:
+                # Another thread, like the prefetcher, may have downloaded it
+                # since it was found missing
+                with self.weights_downloader.claim(job.url, job.dest):
+                    if self.weights_downloader.check_if_file_exists(
+                        job.weight_str, job.dest
+                    ):
+                        self.weights_downloader.record_hit(
+                            job.weight_str, job.url, job.dest
+                        )
+                        return
+                    job.bytes_downloaded = self.weights_downloader.download(
+                        job.weight_str, job.url, job.dest, job.size
+                    )
+                    self.weights_downloader.record_download(
+                        job.weight_str, job.url, job.dest, job.bytes_downloaded
+                    )
+            except Exception as e:
+                job.error = e
+                failed.set()
+
+        # Each job runs in a copy of this context, so its telemetry is
+        # recorded against the prediction that asked for it
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, run_job, job)
+                for job in missing
+            ]
+            for future in futures:
+                future.result()
+
+        elapsed_time = time.time() - start
+        ledger.save()
+        total_bytes = sum(job.bytes_downloaded for job in missing)
+        total_megabytes = total_bytes / (1024 * 1024)
+        throughput = total_megabytes / elapsed_time if elapsed_time > 0 else 0
+        print(
+            f"✅ Downloaded {total_megabytes:.2f}MB in {elapsed_time:.2f}s ({throughput:.2f}MB/s)"
+        )
+
+        errors = [job for job in missing if job.error is not None]
+        if errors:
+            for job in errors:
+                print(f"❌ Failed to download {job.weight_str}: {job.error}")
+            raise Exception(
+                f"Failed to download weights: {', '.join(job.weight_str for job in errors)}"
+            ) from errors[0].error
+
+    def _probe_sizes(self, jobs):
+        # Sizes come from the checksums manifest where known, otherwise from
+        # a HEAD request for the tarball. Probing in parallel keeps this to a
+        # single round trip for the batch.
+        def probe(job):
+            job.size = self.weights_downloader.get_weight_size(job.weight_str)
+            if job.size is None:
+                job.size = probe_size(job.url)
+
+        with ThreadPoolExecutor(
+            max_workers=min(SIZE_PROBE_CONCURRENCY, len(jobs))
+        ) as executor:
+            list(executor.map(probe, jobs))
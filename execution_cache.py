@@ -0,0 +1,96 @@
+import os
+
+CACHE_MODES = ["keep", "lru", "reset"]
+DEFAULT_LRU_SIZE = 10
+
+
+class ExecutionCache:
+    """
+    How ComfyUI's cache of node outputs is kept between predictions.
+
+    COMFYUI_CACHE_MODE picks one of:
+    - keep: ComfyUI's default cache, holding the outputs of the last prompt.
+      Nodes whose inputs have not changed are not run again.
+    - lru: keeps outputs from the last COMFYUI_CACHE_LRU_SIZE prompts'
+      worth of nodes, so workflows that alternate still hit the cache.
+    - reset: every prediction starts with an empty cache.
+
+    In every mode the cache is also reset after invalidate(), when something
+    the cache cannot see has changed, like weights being replaced on disk.
+    With a pool of servers each one is reset, and resets are tracked by
+    server name. Hits are counted per prompt from ComfyUI's execution_cached
+    messages, so prompts running at once on different servers are counted
+    separately.
+    """
+
+    def __init__(self, mode=None, lru_size=None):
+        self.mode = (mode or os.getenv("COMFYUI_CACHE_MODE", "keep")).lower()
+        if self.mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown COMFYUI_CACHE_MODE {self.mode}, use one of {', '.join(CACHE_MODES)}"
+            )
+        self.lru_size = int(
+            lru_size or os.getenv("COMFYUI_CACHE_LRU_SIZE", DEFAULT_LRU_SIZE)
+        )
+        self.invalidated_because = None
+        # Servers reset since the last invalidate()
+        self.reset_servers = set()
+        # prompt_id: (cached nodes, executed nodes)
+        self.prompts = {}
+        self.total_cached = 0
+        self.total_executed = 0
+
+    def server_args(self):
+        if self.mode == "lru":
+            return f" --cache-lru {self.lru_size}"
+        return ""
+
+    def invalidate(self, reason):
+        print(f"Execution cache will be reset: {reason}")
+        self.invalidated_because = reason
+        self.reset_servers = set()
+
+    def needs_reset(self, server="0"):
+        if self.mode == "reset":
+            return True
+        return (
+            self.invalidated_because is not None and server not in self.reset_servers
+        )
+
+    def reset_done(self, server="0"):
+        self.reset_servers.add(server)
+
+    def start_prompt(self, prompt_id):
+        self.prompts[prompt_id] = (set(), set())
+
+    def on_message(self, message, prompt_id):
+        data = message.get("data", {})
+        if data.get("prompt_id") != prompt_id or prompt_id not in self.prompts:
+            return
+        cached_nodes, executed_nodes = self.prompts[prompt_id]
+        if message["type"] == "execution_cached":
+            cached_nodes.update(data.get("nodes", []))
+        elif message["type"] == "executing" and data.get("node") is not None:
+            executed_nodes.add(data["node"])
+
+    def report(self, prompt_id):
+        cached_nodes, executed_nodes = self.prompts.pop(prompt_id, (set(), set()))
+        cached = len(cached_nodes)
+        executed = len(executed_nodes - cached_nodes)
+        self.total_cached += cached
+        self.total_executed += executed
+
+        total = cached + executed
+        overall = self.total_cached + self.total_executed
+        if total:
+            print(
+                f"Execution cache ({self.mode}): {cached} of {total} nodes cached "
+                f"({cached / total:.0%}), {self.total_cached / overall:.0%} since startup"
+            )
+        return {
+            "mode": self.mode,
+            "cached": cached,
+            "executed": executed,
+            "hit_rate": cached / total if total else None,
+            "total_hit_rate": self.total_cached / overall if overall else None,
+        }
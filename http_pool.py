@@ -0,0 +1,128 @@
+import threading
+import http.client
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urljoin
+
+DEFAULT_TIMEOUT = 30
+MAX_CONNECTIONS_PER_HOST = 16
+MAX_REDIRECTS = 5
+
+
+class HTTPConnectionPool:
+    """
+    Keeps HTTP connections open between requests, per scheme, host and port.
+
+    A request takes an idle connection, or opens a new one, and returns it
+    to the pool once the response has been read in full. A connection that
+    the server closed while idle is replaced and the request retried once.
+    Requests that are not idempotent, like POSTs by default, are only
+    retried when sending them failed. Once a request has been sent, the
+    server may have acted on it even if no response came back.
+    """
+
+    def __init__(
+        self, timeout=DEFAULT_TIMEOUT, max_connections_per_host=MAX_CONNECTIONS_PER_HOST
+    ):
+        self.timeout = timeout
+        self.max_connections_per_host = max_connections_per_host
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def _open(self, key, timeout):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _acquire(self, key, timeout):
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                connection = connections.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+        return self._open(key, timeout), False
+
+    def _release(self, key, connection):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_connections_per_host:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+    @staticmethod
+    def _key(parts):
+        default_port = 443 if parts.scheme == "https" else 80
+        return (parts.scheme, parts.hostname, parts.port or default_port)
+
+    def _send(self, method, url, headers, body, timeout, idempotent):
+        parts = urlsplit(url)
+        key = self._key(parts)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+
+        connection, reused = self._acquire(key, timeout)
+        sent = False
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            sent = True
+            response = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+            if not reused or (sent and not idempotent):
+                raise
+            # The idle connection went stale, retry on a fresh one
+            connection = self._open(key, timeout)
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+        return key, connection, response
+
+    @contextmanager
+    def request(
+        self, method, url, headers=None, body=None, timeout=None, idempotent=None
+    ):
+        headers = headers or {}
+        timeout = timeout or self.timeout
+        if idempotent is None:
+            idempotent = method in ("GET", "HEAD")
+
+        for _ in range(MAX_REDIRECTS + 1):
+            key, connection, response = self._send(
+                method, url, headers, body, timeout, idempotent
+            )
+            if response.status in (301, 302, 303, 307, 308) and response.getheader(
+                "Location"
+            ):
+                response.read()
+                self._finish(key, connection, response)
+                url = urljoin(url, response.getheader("Location"))
+                continue
+            break
+        else:
+            raise http.client.HTTPException(f"Too many redirects for {url}")
+
+        try:
+            yield response
+        finally:
+            self._finish(key, connection, response)
+
+    def _finish(self, key, connection, response):
+        # A connection can only be reused once its response has been consumed
+        if response.isclosed() and not response.will_close:
+            self._release(key, connection)
+        else:
+            connection.close()
+
+
+default_pool = HTTPConnectionPool()
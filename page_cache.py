@@ -0,0 +1,134 @@
+import os
+import time
+import mmap
+import ctypes
+import ctypes.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PAGE_SIZE = mmap.PAGESIZE
+READ_SIZE = 8 * 1024 * 1024
+DEFAULT_THREADS = 2
+RESIDENT_THRESHOLD = 0.99
+
+PROT_READ = 0x1
+MAP_SHARED = 0x01
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _libc.mmap.restype = ctypes.c_void_p
+    _libc.mmap.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_size_t,
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_long,
+    ]
+    _libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    _libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+except (OSError, AttributeError):
+    _libc = None
+
+
+def resident_bytes(path):
+    # Bytes of path currently in the page cache, using mincore(2). Returns
+    # None where that cannot be determined.
+    size = os.path.getsize(path)
+    if size == 0 or _libc is None:
+        return 0 if size == 0 else None
+
+    with open(path, "rb") as f:
+        address = _libc.mmap(None, size, PROT_READ, MAP_SHARED, f.fileno(), 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            return None
+        try:
+            pages = (size + PAGE_SIZE - 1) // PAGE_SIZE
+            vector = (ctypes.c_ubyte * pages)()
+            if _libc.mincore(address, size, vector) != 0:
+                return None
+            resident_pages = pages - bytes(vector).count(0)
+        finally:
+            _libc.munmap(address, size)
+
+    return min(size, resident_pages * PAGE_SIZE)
+
+
+class PageCacheWarmer:
+    """
+    Reads weight files ahead of ComfyUI so they are loaded from memory.
+
+    Files are warmed in the order given, usually the order the workflow
+    loads them, on a few background threads. Files already in the page
+    cache are skipped. With max_bytes_per_second set, reads are paced to
+    that average rate so warming does not starve other disk users.
+    """
+
+    def __init__(self, paths, threads=DEFAULT_THREADS, max_bytes_per_second=None):
+        self.paths = [path for path in paths if os.path.isfile(path)]
+        self.threads = threads
+        self.max_bytes_per_second = max_bytes_per_second
+        self.bytes_read = 0
+        self.start_time = None
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def start(self):
+        self.start_time = time.time()
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        for path in self.paths:
+            self.executor.submit(self._warm, path)
+        self.executor.shutdown(wait=False)
+
+    def wait(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    def _warm(self, path):
+        size = os.path.getsize(path)
+        resident = resident_bytes(path)
+        if resident is not None and resident >= size * RESIDENT_THRESHOLD:
+            return
+
+        buffer = bytearray(READ_SIZE)
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                self._throttle(read)
+
+    def _throttle(self, read):
+        with self.lock:
+            self.bytes_read += read
+            if self.max_bytes_per_second is None:
+                return
+            min_time = self.bytes_read / self.max_bytes_per_second
+            delay = min_time - (time.time() - self.start_time)
+        if delay > 0:
+            time.sleep(delay)
+
+    def report(self):
+        total = 0
+        resident = 0
+        unknown = False
+        for path in self.paths:
+            size = os.path.getsize(path)
+            total += size
+            path_resident = resident_bytes(path)
+            if path_resident is None:
+                unknown = True
+            else:
+                resident += path_resident
+
+        total_gb = total / (1024**3)
+        if unknown:
+            print(
+                f"Page cache warming read {self.bytes_read / (1024 ** 3):.2f}GB of a {total_gb:.2f}GB working set"
+            )
+            return
+
+        percent = resident / total * 100 if total else 100
+        print(
+            f"Page cache holds {resident / (1024 ** 3):.2f}GB of the {total_gb:.2f}GB working set ({percent:.0f}%)"
+        )
@@ -1,10 +1,12 @@
 import os
-import json
 import shutil
+import asyncio
 import mimetypes
 from typing import List
 from cog import BasePredictor, Input, Path
 from comfyui import ComfyUI
+from comfyui_async import AsyncComfyUI
+from workflow_template import WorkflowTemplate
 from cog_model_helpers import optimise_images
 from cog_model_helpers import seed as seed_helper
 
@@ -18,6 +20,29 @@ mimetypes.add_type("image/webp", ".webp")
 # Use the workflow JSON file
 api_json_file = "workflow_api.json"
 
+# Predictor inputs and the node inputs they set in the workflow
+workflow_bindings = {
+    # Jurdn's Groq API Prompt Enhancer (node 662)
+    "prompt": {"class_type": "JurdnsGroqAPIPromptEnhancer", "input": "text"},
+    "negative_prompt": {"class_type": "easy negative", "input": "negative"},
+    "seed": {"class_type": "Seed Everywhere", "input": "seed"},
+    # Only the scheduler with fixed steps, node 712 reads its steps from a node
+    "steps": {"node_id": "709", "class_type": "BasicScheduler", "input": "steps"},
+    "resolution": {"title": "Basic Image size", "input": "resolution"},
+}
+
+# The node with the final image, node 745 previews the first pass and is
+# left out when the workflow is pruned
+workflow_outputs = ["746"]
+
+# Resolution choices and the matching SDXLEmptyLatentSizePicker+ options
+resolutions = {
+    "512x768": "512x768 (0.67)",
+    "768x1280": "768x1280 (0.6)",
+    "1024x1024": "1024x1024 (1.0)",
+    "1024x1536": "1024x1536 (0.67)",
+}
+
 # Force HF offline
 os.environ["HF_DATASETS_OFFLINE"] = "1"
 os.environ["TRANSFORMERS_OFFLINE"] = "1"
@@ -26,12 +51,13 @@ os.environ["HF_HUB_DISABLE_TELEMETRY"] = "1"
 class Predictor(BasePredictor):
     def setup(self):
         self.comfyUI = ComfyUI("127.0.0.1:8188")
-        self.comfyUI.start_server(OUTPUT_DIR, INPUT_DIR)
 
-        # Load the workflow to prepare for weight detection
-        with open(api_json_file, "r") as file:
-            workflow = json.loads(file.read())
-            
+        # ComfyUI boots while the weights download, setup finishes when both are done
+        self.comfyUI.start_server(OUTPUT_DIR, INPUT_DIR, wait=False)
+
+        # The workflow is parsed once, predictions fill in its bound inputs
+        self.workflow_template = WorkflowTemplate.load(api_json_file, workflow_bindings)
+
         # Create directories for custom node models if needed
         os.makedirs("ComfyUI/models/checkpoints", exist_ok=True)
         os.makedirs("ComfyUI/models/loras", exist_ok=True)
@@ -68,11 +94,23 @@ class Predictor(BasePredictor):
             # LUT files
             "Presetpro - Portra 800.cube"
         ]
-        
+
+        # These weights are needed on every run, keep them when evicting
+        self.comfyUI.weights_downloader.pin_weights(weights_to_download)
+
+        self.comfyUI.weights_downloader.telemetry.start_prediction("setup")
+        plan = self.workflow_template.prepare(self.comfyUI.workflow_analyzer)
         self.comfyUI.handle_weights(
-            workflow,
+            self.workflow_template.workflow,
             weights_to_download=weights_to_download,
+            plan=plan,
         )
+        self.comfyUI.weights_downloader.telemetry.summary()
+        self.comfyUI.weights_downloader.telemetry.finish_prediction()
+        self.comfyUI.warm_page_cache()
+        self.comfyUI.wait_for_server()
+        self.comfyUI.report_page_cache()
+        self.comfyUI.scan_weights_in_background()
 
     def filename_with_extension(self, input_file, prefix):
         extension = os.path.splitext(input_file.name)[1]
@@ -82,44 +120,11 @@ class Predictor(BasePredictor):
         self,
         input_file: Path,
         filename: str = "image.png",
+        input_directory: str = INPUT_DIR,
     ):
-        shutil.copy(input_file, os.path.join(INPUT_DIR, filename))
-
-    # Update our workflow based on user inputs
-    def update_workflow(self, workflow, **kwargs):
-        # Update prompt text in Jurdn's Groq API Prompt Enhancer (node 662)
-        for node_id, node in workflow.items():
-            # Update prompt
-            if "class_type" in node and node["class_type"] == "JurdnsGroqAPIPromptEnhancer":
-                node["inputs"]["text"] = kwargs["prompt"]
-                print(f"Updated prompt in node {node_id}")
-            
-            # Update negative prompt
-            if "class_type" in node and node["class_type"] == "easy negative":
-                node["inputs"]["negative"] = kwargs["negative_prompt"]
-                print(f"Updated negative prompt in node {node_id}")
-            
-            # Update seed everywhere
-            if "class_type" in node and node["class_type"] == "Seed Everywhere":
-                node["inputs"]["seed"] = kwargs["seed"]
-                print(f"Updated seed in node {node_id}")
-                
-            # Update scheduler steps (node 709)
-            if node_id == "709" and "class_type" in node and node["class_type"] == "BasicScheduler":
-                node["inputs"]["steps"] = kwargs["steps"]
-                print(f"Updated steps in BasicScheduler to {kwargs['steps']}")
-                
-            # Update resolution if applicable
-            if "_meta" in node and node["_meta"].get("title") == "Basic Image size":
-                if kwargs["resolution"] == "768x1280":
-                    node["inputs"]["resolution"] = "768x1280 (0.6)"
-                elif kwargs["resolution"] == "512x768":
-                    node["inputs"]["resolution"] = "512x768 (0.67)"
-                elif kwargs["resolution"] == "1024x1024":
-                    node["inputs"]["resolution"] = "1024x1024 (1.0)"
-                elif kwargs["resolution"] == "1024x1536":
-                    node["inputs"]["resolution"] = "1024x1536 (0.67)"
-                print(f"Updated resolution in node {node_id}")
+        # AsyncPredictor passes the request's input directory, so concurrent
+        # requests never overwrite each other's inputs
+        shutil.copy(input_file, os.path.join(input_directory, filename))
 
     def predict(
         self,
@@ -148,6 +153,7 @@ class Predictor(BasePredictor):
     ) -> List[Path]:
         """Run image generation using the ComfyUI workflow"""
         self.comfyUI.cleanup(ALL_DIRECTORIES)
+        self.comfyUI.weights_downloader.telemetry.start_prediction()
 
         # Generate a seed if not provided
         seed = seed_helper.generate(seed)
@@ -157,26 +163,145 @@ class Predictor(BasePredictor):
         # No input image in this workflow, but handle it if needed in the future
         image_filename = None
 
-        # Load the workflow
-        with open(api_json_file, "r") as file:
-            workflow = json.loads(file.read())
-
-        # Update workflow with our parameters
-        self.update_workflow(
-            workflow,
+        # Copy the workflow template with our parameters
+        workflow, plan = self.workflow_template.instantiate(
             prompt=prompt,
             negative_prompt=negative_prompt,
-            resolution=resolution,
+            resolution=resolutions[resolution],
             steps=steps,
             seed=seed,
         )
 
-        # Run the workflow
-        wf = self.comfyUI.load_workflow(workflow)
+        # Run the workflow, reusing the template's plan when it still applies
+        wf = self.comfyUI.load_workflow(workflow, plan=plan)
+        self.comfyUI.weights_downloader.telemetry.summary()
+        self.comfyUI.weights_downloader.telemetry.finish_prediction()
         self.comfyUI.connect()
-        self.comfyUI.run_workflow(wf)
+        self.comfyUI.run_workflow(wf, outputs=workflow_outputs)
 
         # Return optimized output images
         return optimise_images.optimise_image_files(
             output_format, output_quality, self.comfyUI.get_files(OUTPUT_DIR)
         )
+
+
+class AsyncPredictor(Predictor):
+    """
+    Runs predictions concurrently on the one ComfyUI server.
+
+    Use it with predict: "predict.py:AsyncPredictor" and a concurrency
+    limit in cog.yaml. Each request queues its prompt as soon as its inputs
+    and weights are ready, so ComfyUI always has the next prompt waiting,
+    and keeps its inputs and outputs in its own subdirectories.
+
+    COMFYUI_POOL_SIZE runs more than one ComfyUI server, for hosts with the
+    memory for several workflows at once, and COMFYUI_POOL_DEVICES lists
+    the CUDA devices, or "cpu", to run the extra servers on. Each prompt
+    goes to the least loaded server. COMFYUI_REMOTE_SERVERS adds servers
+    on other hosts, as a comma separated list of host:port addresses.
+    """
+
+    def setup(self):
+        super().setup()
+        self.comfyUI.cleanup(ALL_DIRECTORIES)
+
+        devices = os.getenv("COMFYUI_POOL_DEVICES")
+        self.server_pool = self.comfyUI.start_server_pool(
+            int(os.getenv("COMFYUI_POOL_SIZE", "1")),
+            devices=devices.split(",") if devices else None,
+            remote_addresses=[
+                address.strip()
+                for address in os.getenv("COMFYUI_REMOTE_SERVERS", "").split(",")
+                if address.strip()
+            ],
+        )
+        # Every server, including server 0 that ComfyUI started, has a client
+        # that knows its pool instance, so a prompt on a server the pool
+        # finds dead fails rather than waiting forever
+        self.server_clients = {
+            server.name: AsyncComfyUI(self.comfyUI, server)
+            for server in self.server_pool.instances
+        }
+        self.comfyUI_async = self.server_clients["0"]
+        self.server_pool.report()
+
+    async def predict(
+        self,
+        prompt: str = Input(
+            description="Text prompt for image generation",
+            default="Love, at night on the beach, dancing, unity, happiness."
+        ),
+        negative_prompt: str = Input(
+            description="Negative prompt to specify what not to include",
+            default="deformed hands, extra fingers, missing fingers, fused fingers, too many fingers, mutated hands, disproportionate hands"
+        ),
+        resolution: str = Input(
+            description="Image resolution (width x height)",
+            default="768x1280",
+            choices=["512x768", "768x1280", "1024x1024", "1024x1536"]
+        ),
+        steps: int = Input(
+            description="Number of steps for image generation (higher = better quality but slower)",
+            default=55,
+            ge=20,
+            le=100
+        ),
+        output_format: str = optimise_images.predict_output_format(),
+        output_quality: int = optimise_images.predict_output_quality(),
+        seed: int = seed_helper.predict_seed(),
+    ) -> List[Path]:
+        """Run image generation using the ComfyUI workflow"""
+        directories = self.comfyUI_async.request_directories()
+        # Set before any threads start, so they record against this request
+        telemetry = self.comfyUI.weights_downloader.telemetry
+        telemetry.start_prediction(directories.request_id)
+        try:
+            seed = seed_helper.generate(seed)
+            print(f"Generating image with prompt: {prompt}, steps: {steps}, seed: {seed}")
+
+            workflow, plan = self.workflow_template.instantiate(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                resolution=resolutions[resolution],
+                steps=steps,
+                seed=seed,
+            )
+
+            # The server is picked first, weights are only downloaded here
+            # for servers on this host
+            server = await asyncio.to_thread(self.server_pool.acquire)
+            try:
+                comfyUI_async = self.server_clients[server.name]
+                # File inputs belong in the request's own directory, with
+                # handle_input_file(..., input_directory=directories.input_directory).
+                # Inputs and weights are fetched off the event loop, so other
+                # requests keep queueing and collecting meanwhile
+                wf = await asyncio.to_thread(
+                    self.comfyUI.load_workflow,
+                    workflow,
+                    plan=plan,
+                    input_directory=directories.input_directory,
+                    lease_id=directories.request_id,
+                    download_weights=not server.remote,
+                )
+                telemetry.summary()
+                outputs = await comfyUI_async.run_workflow(
+                    wf,
+                    outputs=workflow_outputs,
+                    timeout=self.comfyUI.prompt_timeout,
+                    directories=directories,
+                )
+                files = await comfyUI_async.collect_outputs(outputs, directories)
+            finally:
+                self.server_pool.release(server)
+
+            return await asyncio.to_thread(
+                optimise_images.optimise_image_files,
+                output_format,
+                output_quality,
+                [Path(f) for f in files],
+            )
+        finally:
+            self.comfyUI.weights_downloader.release_weights(directories.request_id)
+            telemetry.finish_prediction()
+            self.comfyUI_async.finish_request(directories)
@@ -0,0 +1,264 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import config
+from http_pool import default_pool
+from weights_store import extract_tar
+
+WEIGHTS_STAGING_PATH = config["WEIGHTS_STAGING_PATH"]
+CHUNK_SIZE = 64 * 1024 * 1024
+CHUNK_CONCURRENCY = 4
+READ_SIZE = 1024 * 1024
+REQUEST_TIMEOUT = 30
+
+
+class StagedDownload:
+    """
+    A staging area for one URL, on the same filesystem as the models.
+
+    Downloads land in the staging directory and are only moved into their
+    destination once complete, so an interrupted download never leaves a
+    partial file where ComfyUI or check_if_file_exists would find it. The
+    directory is named after the URL so an interrupted download can be
+    found again after a restart.
+    """
+
+    _locks = {}
+    _locks_lock = threading.Lock()
+
+    def __init__(self, url, root=WEIGHTS_STAGING_PATH):
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        self.url = url
+        self.path = os.path.join(root, url_hash)
+        self.tar_path = os.path.join(self.path, "weights.tar")
+        self.extract_dir = os.path.join(self.path, "extracted")
+
+    def lock(self):
+        # Only one download per URL can use the staging directory at a time
+        with StagedDownload._locks_lock:
+            return StagedDownload._locks.setdefault(self.path, threading.Lock())
+
+    def has_partial_download(self):
+        return os.path.exists(DownloadJournal.path_for(self.tar_path))
+
+    def prepare(self):
+        # Anything extracted by an earlier, interrupted attempt is discarded.
+        # A partially downloaded tarball and its journal are kept.
+        shutil.rmtree(self.extract_dir, ignore_errors=True)
+        os.makedirs(self.extract_dir)
+        return self.extract_dir
+
+    def extract(self, hashes=None):
+        # The tarball is deleted once extracted, before the files are moved
+        # on or ingested, so a large weight is not kept on disk twice
+        with open(self.tar_path, "rb") as f:
+            extract_tar(f, self.extract_dir, hashes)
+        os.remove(self.tar_path)
+
+    def commit(self, dest):
+        self._merge(self.extract_dir, dest)
+        self.cleanup()
+
+    @staticmethod
+    def _merge(source_directory, dest):
+        # Moves each extracted file into dest. Directories are merged, so
+        # files already in dest that the tarball does not contain, like
+        # other weights in a shared directory, are left alone.
+        os.makedirs(dest, exist_ok=True)
+        for name in os.listdir(source_directory):
+            source = os.path.join(source_directory, name)
+            target = os.path.join(dest, name)
+            if os.path.isdir(source) and not os.path.islink(source):
+                if os.path.islink(target) or os.path.isfile(target):
+                    os.remove(target)
+                StagedDownload._merge(source, target)
+                continue
+
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+            try:
+                os.replace(source, target)
+            except OSError:
+                # The destination is on another filesystem
+                shutil.move(source, target)
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class DownloadJournal:
+    # Records which fixed-size chunks of a download are complete. The
+    # journal is only written after a chunk has been written to the part
+    # file, so a killed process loses at most the chunks in flight.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {}
+
+    @staticmethod
+    def path_for(download_path):
+        return f"{download_path}.journal"
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.data = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self.data = {}
+        return self.data
+
+    def start(self, url, size, validator, chunk_size):
+        self.data = {
+            "url": url,
+            "size": size,
+            "validator": validator,
+            "chunk_size": chunk_size,
+            "completed": [],
+        }
+        self.save()
+
+    def matches(self, url, size, validator):
+        return (
+            self.data.get("url") == url
+            and self.data.get("size") == size
+            and self.data.get("validator") == validator
+        )
+
+    def completed_chunks(self):
+        return set(self.data.get("completed", []))
+
+    def complete_chunk(self, index):
+        with self.lock:
+            self.data["completed"].append(index)
+            self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ResumableDownload:
+    """
+    Downloads a URL to a file in byte ranges, resuming from a journal.
+
+    The file is written as <path>.part and renamed to path once every chunk
+    is complete. If the server does not support range requests, or the
+    remote file changed since the journal was written, the download starts
+    from scratch.
+    """
+
+    def __init__(
+        self,
+        url,
+        path,
+        chunk_size=CHUNK_SIZE,
+        concurrency=CHUNK_CONCURRENCY,
+        pool=default_pool,
+        transfer=None,
+    ):
+        self.url = url
+        self.pool = pool
+        self.transfer = transfer
+        self.path = path
+        self.part_path = f"{path}.part"
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.journal = DownloadJournal(DownloadJournal.path_for(path))
+
+    def _head(self):
+        with self.pool.request("HEAD", self.url, timeout=REQUEST_TIMEOUT) as response:
+            if response.status >= 400:
+                raise Exception(f"{self.url} returned {response.status}")
+            size = response.getheader("Content-Length")
+            validator = response.getheader("ETag") or response.getheader(
+                "Last-Modified"
+            )
+            accepts_ranges = response.getheader("Accept-Ranges", "").lower() == "bytes"
+            return (int(size) if size else None), validator, accepts_ranges
+
+    def run(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        size, validator, accepts_ranges = self._head()
+        if size is None or not accepts_ranges:
+            self._download_whole()
+            return
+
+        self.journal.load()
+        if not self.journal.matches(self.url, size, validator) or not os.path.exists(
+            self.part_path
+        ):
+            self.journal.start(self.url, size, validator, self.chunk_size)
+            with open(self.part_path, "wb") as f:
+                f.truncate(size)
+        else:
+            self.chunk_size = self.journal.data["chunk_size"]
+
+        chunk_count = (size + self.chunk_size - 1) // self.chunk_size
+        completed = self.journal.completed_chunks()
+        remaining = [i for i in range(chunk_count) if i not in completed]
+        if completed:
+            print(
+                f"Resuming {self.url} with {len(completed)} of {chunk_count} chunks already downloaded"
+            )
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for _ in executor.map(lambda i: self._download_chunk(i, size), remaining):
+                pass
+
+        os.replace(self.part_path, self.path)
+        self.journal.remove()
+
+    def _download_chunk(self, index, size):
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, size) - 1
+        with self.pool.request(
+            "GET",
+            self.url,
+            headers={"Range": f"bytes={start}-{end}"},
+            timeout=REQUEST_TIMEOUT,
+        ) as response:
+            if response.status != 206:
+                raise Exception(
+                    f"Expected a partial response for {self.url}, got {response.status}"
+                )
+            if self.transfer is not None:
+                self.transfer.first_byte()
+            with open(self.part_path, "r+b") as f:
+                f.seek(start)
+                written = 0
+                for data in iter(lambda: response.read(READ_SIZE), b""):
+                    f.write(data)
+                    written += len(data)
+                    if self.transfer is not None:
+                        self.transfer.received(len(data))
+
+        if written != end - start + 1:
+            raise Exception(
+                f"Chunk {index} of {self.url} was {written} bytes, expected {end - start + 1}"
+            )
+        self.journal.complete_chunk(index)
+
+    def _download_whole(self):
+        self.journal.remove()
+        with self.pool.request("GET", self.url, timeout=REQUEST_TIMEOUT) as response:
+            if response.status >= 400:
+                raise Exception(f"{self.url} returned {response.status}")
+            if self.transfer is not None:
+                self.transfer.first_byte()
+            with open(self.part_path, "wb") as f:
+                for data in iter(lambda: response.read(READ_SIZE), b""):
+                    f.write(data)
+                    if self.transfer is not None:
+                        self.transfer.received(len(data))
+        os.replace(self.part_path, self.path)
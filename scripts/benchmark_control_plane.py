@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""
+This script measures the HTTP control requests made around each
+prediction, against a local stand-in for the ComfyUI server. It compares a
+new urllib connection per request, as ComfyUI used to make, with the
+kept-alive connections of ComfyUIClient.
+
+Each prediction clears the queue, interrupts, queues workflow_api.json as
+the prompt and reads its history.
+
+Usage: python scripts/benchmark_control_plane.py [--predictions <n>]
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from comfyui_client import ComfyUIClient
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # ComfyUI's aiohttp server sends without delay too, otherwise Nagle's
+    # algorithm holds back each response body on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/prompt"):
+            self._respond({"prompt_id": "benchmark", "number": 1})
+        else:
+            self._respond({})
+
+    def do_GET(self):
+        self._respond({"benchmark": {"outputs": {}, "status": {}}})
+
+
+def prediction_with_urllib(server_address, prompt):
+    def post(endpoint, data):
+        request = urllib.request.Request(
+            f"http://{server_address}{endpoint}",
+            data=json.dumps(data).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    post("/queue", {"clear": True})
+    post("/interrupt", {})
+    prompt_id = post("/prompt", {"prompt": prompt, "client_id": "benchmark"})[
+        "prompt_id"
+    ]
+    with urllib.request.urlopen(
+        f"http://{server_address}/history/{prompt_id}"
+    ) as response:
+        json.loads(response.read())
+
+
+def prediction_with_client(client, prompt):
+    client.post_json("/queue", {"clear": True}, idempotent=True)
+    client.post_json("/interrupt", {}, idempotent=True)
+    prompt_id = client.post_json("/prompt", {"prompt": prompt, "client_id": "benchmark"})[
+        "prompt_id"
+    ]
+    client.get_json(f"/history/{prompt_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ComfyUI control requests")
+    parser.add_argument("--predictions", type=int, default=500)
+    args = parser.parse_args()
+
+    # The shipped workflow, so prompts are the size ComfyUI receives
+    with open(os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")) as f:
+        prompt = json.load(f)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server_address = f"127.0.0.1:{server.server_port}"
+
+    start_time = time.time()
+    for _ in range(args.predictions):
+        prediction_with_urllib(server_address, prompt)
+    urllib_time = (time.time() - start_time) / args.predictions
+
+    client = ComfyUIClient(server_address)
+    start_time = time.time()
+    for _ in range(args.predictions):
+        prediction_with_client(client, prompt)
+    client_time = (time.time() - start_time) / args.predictions
+
+    print(f"urllib, new connection per request: {urllib_time * 1000:.2f}ms per prediction")
+    print(f"ComfyUIClient, kept-alive connections: {client_time * 1000:.2f}ms per prediction")
+    client.report()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
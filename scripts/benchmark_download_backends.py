@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+This script compares the throughput of the weight download backends.
+It builds a synthetic weights tarball, serves it from a local HTTP server
+that supports range requests, and times each available backend downloading
+and extracting it.
+
+Usage: python scripts/benchmark_download_backends.py [--size-mb <MB>] [--runs <n>]
+"""
+
+import sys
+import os
+import time
+import shutil
+import tarfile
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from download_backends import BACKENDS
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    directory = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_headers(self):
+        path = os.path.join(self.directory, self.path.lstrip("/"))
+        if not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range")
+        if range_header:
+            first, last = range_header.split("=", 1)[1].split("-")
+            start = int(first)
+            end = int(last) if last else size - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        return path, start, end
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        sent = self._send_headers()
+        if sent is None:
+            return
+        path, start, end = sent
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(remaining, 1024 * 1024))
+                self.wfile.write(data)
+                remaining -= len(data)
+
+
+def create_tarball(directory, size_mb):
+    weight_path = os.path.join(directory, "benchmark.safetensors")
+    with open(weight_path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+
+    tar_path = os.path.join(directory, "benchmark.safetensors.tar")
+    with tarfile.open(tar_path, "w") as tar:
+        tar.add(weight_path, arcname="benchmark.safetensors")
+    os.remove(weight_path)
+    return tar_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark download backends")
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        tar_path = create_tarball(work_dir, args.size_mb)
+        RangeRequestHandler.directory = work_dir
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/{os.path.basename(tar_path)}"
+
+        for name, backend_class in BACKENDS.items():
+            if not backend_class.available():
+                print(f"{name}: not available")
+                continue
+
+            backend = backend_class()
+            timings = []
+            for _ in range(args.runs):
+                extract_dir = tempfile.mkdtemp(dir=work_dir)
+                start = time.time()
+                backend.download_and_extract(url, extract_dir)
+                timings.append(time.time() - start)
+                shutil.rmtree(extract_dir)
+
+            best = min(timings)
+            print(
+                f"{name}: best {best:.2f}s, {args.size_mb / best:.2f}MB/s over {args.runs} runs"
+            )
+
+        server.shutdown()
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
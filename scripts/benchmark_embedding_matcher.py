@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+This script compares finding embedding references in prompts with a
+SubstringMatcher against checking every embedding name in turn, as
+handle_weights used to. It builds synthetic embedding names and prompts,
+and reports the time per prompt for a range of embedding list sizes.
+
+Usage: python scripts/benchmark_embedding_matcher.py [--prompts <n>] [--words <n>]
+"""
+
+import sys
+import os
+import random
+import string
+import timeit
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from substring_matcher import SubstringMatcher
+
+
+def random_word(rng):
+    return "".join(
+        rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10))
+    )
+
+
+def find_embeddings_by_scanning(embedding_to_fullname, text):
+    # The previous approach: one substring search per embedding to find
+    # out whether any match, then another to collect them
+    if any(key in text for key in embedding_to_fullname):
+        return [
+            embedding_to_fullname[key]
+            for key in embedding_to_fullname
+            if key in text
+        ]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding matching")
+    parser.add_argument("--prompts", type=int, default=50)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for embedding_count in [10, 100, 1000, 5000]:
+        embedding_to_fullname = {}
+        while len(embedding_to_fullname) < embedding_count:
+            name = f"{random_word(rng)}_{random_word(rng)}"
+            embedding_to_fullname[name] = f"{name}.safetensors"
+        names = list(embedding_to_fullname)
+        prompts = [
+            " ".join(random_word(rng) for _ in range(args.words))
+            + f", embedding:{rng.choice(names)}"
+            for _ in range(args.prompts)
+        ]
+
+        matcher = SubstringMatcher(names)
+        automaton = SubstringMatcher(names, min_automaton_patterns=0)
+        for prompt in prompts:
+            expected = find_embeddings_by_scanning(embedding_to_fullname, prompt)
+            found = [embedding_to_fullname[key] for key in automaton.find(prompt)]
+            assert found == expected, prompt
+
+        def per_prompt(find):
+            seconds = timeit.timeit(
+                lambda: [find(prompt) for prompt in prompts], number=args.runs
+            )
+            return seconds / args.runs / len(prompts) * 1e6
+
+        scanning = per_prompt(
+            lambda prompt: find_embeddings_by_scanning(embedding_to_fullname, prompt)
+        )
+        print(
+            f"{embedding_count} embeddings: scanning {scanning:.1f}us, "
+            f"automaton {per_prompt(automaton.find):.1f}us, "
+            f"matcher {per_prompt(matcher.find):.1f}us per prompt"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+This script records the size and sha256 of installed weights in
+weights_checksums.json. Downloads are verified against these checksums and
+the fast integrity scan uses the sizes to spot truncated files.
+
+Usage: python scripts/generate_weights_checksums.py [--remote] [<weight> ...]
+With no weights every weight in the manifest is recorded, if installed.
+With --remote each weight's tarball is streamed from its URL and hashed
+as it is read, without being written to disk, so weights do not need to
+be installed.
+"""
+
+import sys
+import os
+import json
+import hashlib
+import argparse
+import tarfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from weights_downloader import WeightsDownloader
+from weights_manifest import WEIGHTS_CHECKSUMS_PATH
+from weights_store import sha256_file, HASH_CHUNK_SIZE
+from http_pool import default_pool
+
+
+def checksums_for(wd, weight_str):
+    for _, dest in wd.get_weight_sources(weight_str):
+        if wd.check_if_file_exists(weight_str, dest):
+            return {
+                key: {
+                    "size": os.path.getsize(file_path),
+                    "sha256": sha256_file(file_path),
+                }
+                for file_path, key in wd.weight_files(weight_str, dest)
+            }
+    return None
+
+
+def remote_checksums_for(wd, weight_str):
+    url, _ = wd.get_weight_sources(weight_str)[0]
+    checksums = {}
+    with default_pool.request("GET", url) as response:
+        if response.status >= 400:
+            print(f"{url} returned {response.status}")
+            return None
+        with tarfile.open(fileobj=response, mode="r|") as tar:
+            for member in tar:
+                if not member.isreg():
+                    continue
+                sha256 = hashlib.sha256()
+                source = tar.extractfile(member)
+                for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+                checksums[os.path.normpath(member.name)] = {
+                    "size": member.size,
+                    "sha256": sha256.hexdigest(),
+                }
+        response.read()
+    return checksums
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record weights checksums")
+    parser.add_argument("weights", nargs="*")
+    parser.add_argument(
+        "--remote",
+        action="store_true",
+        help="Hash the tarballs at their URLs rather than installed weights",
+    )
+    args = parser.parse_args()
+
+    wd = WeightsDownloader()
+    checksums = dict(wd.weights_manifest.checksums)
+
+    for weight_str in args.weights or sorted(wd.weights_map):
+        if args.remote:
+            weight_checksums = remote_checksums_for(wd, weight_str)
+        else:
+            weight_checksums = checksums_for(wd, weight_str)
+        if weight_checksums:
+            print(f"Recording {weight_str}")
+            checksums[weight_str] = weight_checksums
+        elif args.remote:
+            print(f"Could not hash {weight_str}")
+        elif args.weights:
+            print(f"{weight_str} is not installed")
+
+    with open(WEIGHTS_CHECKSUMS_PATH, "w") as f:
+        json.dump(dict(sorted(checksums.items())), f, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
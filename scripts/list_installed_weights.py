@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+"""
+This script lists the weights installed across ComfyUI/models and the
+custom node directories the weights manifest downloads into, with where
+they are and how big they are. With --orphans it lists the weight files
+in those directories that are not in the manifest instead.
+
+Usage: python scripts/list_installed_weights.py [--orphans] [--type <substring>]
+"""
+
+import sys
+import os
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from weights_downloader import WeightsDownloader
+from download_scheduler import path_size
+
+
+def format_size(num_bytes):
+    return f"{num_bytes / (1024 ** 2):.2f}MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List installed weights")
+    parser.add_argument(
+        "--orphans",
+        action="store_true",
+        help="List files in the weights directories that are not in the manifest",
+    )
+    parser.add_argument(
+        "--type",
+        help="Only include paths containing this substring, e.g. loras",
+    )
+    args = parser.parse_args()
+
+    wd = WeightsDownloader()
+    if args.orphans:
+        entries = [(path, path) for path in wd.orphaned_paths()]
+        label = "orphaned"
+    else:
+        entries = list(wd.installed_weights())
+        label = "installed"
+
+    if args.type:
+        entries = [(name, path) for name, path in entries if args.type in path]
+
+    total = 0
+    for name, path in entries:
+        size = path_size(path)
+        total += size
+        if name == path:
+            print(f"{path} ({format_size(size)})")
+        else:
+            print(f"{name}: {path} ({format_size(size)})")
+
+    print(f"\n{len(entries)} {label}, {format_size(total)} in total")
+
+
+if __name__ == "__main__":
+    main()
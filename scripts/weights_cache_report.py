@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+This script reports on the weights cache recorded in the weights ledger.
+It shows the hit rate, how many bytes were downloaded and saved, how much
+of the disk budget is in use, and the weights that would be evicted first.
+
+Usage: python scripts/weights_cache_report.py [--budget-gb <GB>] [--limit <n>]
+"""
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from weights_ledger import WeightsLedger
+
+
+def format_gb(num_bytes):
+    return f"{num_bytes / (1024 ** 3):.2f}GB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report on the weights cache")
+    parser.add_argument(
+        "--budget-gb",
+        type=float,
+        help="Disk budget to report against, defaults to WEIGHTS_DISK_BUDGET_GB",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=20,
+        help="Number of eviction candidates to list",
+    )
+    args = parser.parse_args()
+
+    budget_bytes = (
+        int(args.budget_gb * 1024**3) if args.budget_gb is not None else None
+    )
+    ledger = WeightsLedger(budget_bytes=budget_bytes)
+    stats = ledger.stats
+
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = stats["hits"] / lookups * 100 if lookups else 0
+
+    print(f"Weights tracked: {len(ledger.entries)} ({len(ledger.pinned)} pinned)")
+    print(f"Size on disk: {format_gb(ledger.used_bytes())}")
+    if ledger.budget_bytes is not None:
+        print(f"Disk budget: {format_gb(ledger.budget_bytes)}")
+    else:
+        print("Disk budget: unlimited (set WEIGHTS_DISK_BUDGET_GB)")
+    print(f"Hit rate: {hit_rate:.1f}% ({stats['hits']} hits, {stats['misses']} misses)")
+    print(f"Downloaded: {format_gb(stats['bytes_downloaded'])}")
+    print(f"Saved: {format_gb(stats['bytes_saved'])}")
+    print(f"Evicted: {format_gb(stats['bytes_evicted'])}")
+
+    candidates = ledger.eviction_candidates()[: args.limit]
+    if candidates:
+        print("\nNext to be evicted:")
+        for weight_str in candidates:
+            entry = ledger.entries[weight_str]
+            print(
+                f"  {weight_str} ({format_gb(entry['size'])}, last used {time.ctime(entry.get('last_used', 0))})"
+            )
+
+
+if __name__ == "__main__":
+    main()
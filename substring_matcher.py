@@ -0,0 +1,70 @@
+from collections import deque
+
+# Below this many patterns, checking each one with the `in` operator is
+# faster in CPython than walking the automaton character by character
+AHO_CORASICK_MIN_PATTERNS = 200
+
+
+class SubstringMatcher:
+    """
+    Finds which of a fixed set of patterns occur in a text, in one pass.
+
+    Large pattern sets are compiled into an Aho-Corasick automaton, so the
+    cost of a search depends on the length of the text and not on the
+    number of patterns. Small sets use one `in` check per pattern instead.
+    Matches are returned in the order the patterns were given.
+    """
+
+    def __init__(self, patterns, min_automaton_patterns=AHO_CORASICK_MIN_PATTERNS):
+        self.patterns = list(dict.fromkeys(pattern for pattern in patterns if pattern))
+        self.use_automaton = len(self.patterns) >= min_automaton_patterns
+        if self.use_automaton:
+            self._build()
+
+    def _build(self):
+        # goto[state] maps a character to the next state, fail[state] is the
+        # longest proper suffix that is also a state, and output[state] holds
+        # the indexes of the patterns ending at state
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                    self.goto[state][char] = next_state
+                state = next_state
+            self.output[state] += (index,)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def find(self, text):
+        if not self.use_automaton:
+            return [pattern for pattern in self.patterns if pattern in text]
+
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return [self.patterns[index] for index in sorted(found)]
@@ -0,0 +1,243 @@
+import os
+import json
+import uuid
+import asyncio
+import threading
+from aiohttp import web
+
+
+class StandInComfyUI:
+    """
+    A stand-in for a ComfyUI server, enough of its API to run prompts.
+
+    It serves /prompt, /ws, /history, /queue, /upload/image, /view,
+    /object_info and /free on a free local port, from its own thread and
+    event loop. A queued prompt "runs" every node in order: LoadImage
+    nodes must name a file in the input directory, as ComfyUI validates
+    them, and each SaveImage node writes a file to the output directory.
+    Prompts run one at a time, like on a real server.
+
+    hang keeps prompts from finishing, so tests can see what happens to a
+    prompt on a server that stops responding.
+    """
+
+    def __init__(self, directory, models=()):
+        self.output_directory = os.path.join(directory, "output")
+        self.input_directory = os.path.join(directory, "input")
+        self.temp_directory = os.path.join(directory, "temp")
+        for path in [self.output_directory, self.input_directory, self.temp_directory]:
+            os.makedirs(path, exist_ok=True)
+        self.models = list(models)
+        self.prompts = {}
+        self.history = {}
+        self.uploads = []
+        self.frees = []
+        self.pending = []
+        self.running = None
+        self.hang = False
+        self.sockets = {}
+        self.tasks = set()
+        self.loop = None
+        self.address = None
+
+    def start(self):
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self.thread.start()
+        ready.wait(10)
+        return self
+
+    def _run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._serve())
+        ready.set()
+        self.loop.run_forever()
+
+    async def _serve(self):
+        app = web.Application()
+        app.router.add_post("/prompt", self.handle_prompt)
+        app.router.add_get("/ws", self.handle_ws)
+        app.router.add_get("/history/{prompt_id}", self.handle_history)
+        app.router.add_get("/queue", self.handle_queue)
+        app.router.add_post("/upload/image", self.handle_upload)
+        app.router.add_get("/view", self.handle_view)
+        app.router.add_get("/object_info", self.handle_object_info)
+        app.router.add_post("/free", self.handle_free)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.address = f"127.0.0.1:{port}"
+        self.lock = asyncio.Lock()
+
+    def stop(self):
+        if self.loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        future.result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+        self.loop = None
+
+    async def _shutdown(self):
+        for task in list(self.tasks):
+            task.cancel()
+        for ws in list(self.sockets.values()):
+            await ws.close()
+        await self.runner.cleanup()
+
+    async def handle_prompt(self, request):
+        body = await request.json()
+        workflow = body["prompt"]
+        for node in workflow.values():
+            if node.get("class_type") == "LoadImage":
+                path = os.path.join(self.input_directory, node["inputs"]["image"])
+                if not os.path.isfile(path):
+                    return web.json_response(
+                        {"error": f"Invalid image file: {node['inputs']['image']}"},
+                        status=400,
+                    )
+
+        prompt_id = uuid.uuid4().hex
+        self.prompts[prompt_id] = workflow
+        self.pending.append(prompt_id)
+        task = asyncio.ensure_future(self._execute(prompt_id, body.get("client_id")))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.json_response({"prompt_id": prompt_id, "number": len(self.prompts)})
+
+    async def _execute(self, prompt_id, client_id):
+        async with self.lock:
+            self.pending.remove(prompt_id)
+            self.running = prompt_id
+            workflow = self.prompts[prompt_id]
+            outputs = {}
+            for node_id, node in workflow.items():
+                await self._send(
+                    client_id,
+                    {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}},
+                )
+                if node.get("class_type") == "SaveImage":
+                    filename = f"{prompt_id}_{node_id}.png"
+                    with open(os.path.join(self.output_directory, filename), "wb") as f:
+                        f.write(f"{prompt_id} {node_id}".encode("utf-8"))
+                    outputs[node_id] = {
+                        "images": [{"filename": filename, "subfolder": "", "type": "output"}]
+                    }
+                await asyncio.sleep(0.01)
+
+            while self.hang:
+                await asyncio.sleep(0.05)
+
+            self.history[prompt_id] = {"outputs": outputs, "status": {"messages": []}}
+            self.running = None
+            await self._send(
+                client_id,
+                {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}},
+            )
+
+    async def _send(self, client_id, message):
+        ws = self.sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_str(json.dumps(message))
+
+    async def handle_ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId")
+        self.sockets[client_id] = ws
+        async for _ in ws:
+            pass
+        return ws
+
+    async def handle_history(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        if prompt_id not in self.history:
+            return web.json_response({})
+        return web.json_response({prompt_id: self.history[prompt_id]})
+
+    async def handle_queue(self, request):
+        return web.json_response(
+            {
+                "queue_running": [[0, self.running]] if self.running else [],
+                "queue_pending": [[0, prompt_id] for prompt_id in self.pending],
+            }
+        )
+
+    async def handle_upload(self, request):
+        form = await request.post()
+        image = form["image"]
+        subfolder = form.get("subfolder", "")
+        directory = os.path.join(self.input_directory, subfolder)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, image.filename), "wb") as f:
+            f.write(image.file.read())
+        self.uploads.append(os.path.join(subfolder, image.filename))
+        return web.json_response(
+            {"name": image.filename, "subfolder": subfolder, "type": "input"}
+        )
+
+    async def handle_view(self, request):
+        roots = {"output": self.output_directory, "temp": self.temp_directory}
+        root = roots.get(request.query.get("type", "output"))
+        if root is None:
+            return web.Response(status=400, text="Invalid type")
+        path = os.path.join(
+            root, request.query.get("subfolder", ""), request.query["filename"]
+        )
+        if not os.path.isfile(path):
+            return web.Response(status=404, text="Not found")
+        return web.FileResponse(path)
+
+    async def handle_object_info(self, request):
+        return web.json_response(
+            {
+                "CheckpointLoaderSimple": {
+                    "input": {"required": {"ckpt_name": [self.models]}},
+                    "output_node": False,
+                },
+                "SaveImage": {"input": {"required": {}}, "output_node": True},
+            }
+        )
+
+    async def handle_free(self, request):
+        self.frees.append(await request.json())
+        return web.json_response({})
+
+
+class StandInFrontEnd:
+    """
+    The parts of ComfyUI, the front end class in comfyui.py, that
+    AsyncComfyUI uses, pointed at a stand-in server.
+    """
+
+    def __init__(self, server, directory, cache_mode="keep"):
+        from execution_cache import ExecutionCache
+        from weights_downloader import WeightsDownloader
+
+        self.server_address = server.address
+        self.input_directory = server.input_directory
+        self.output_directory = server.output_directory
+        self.temp_directory = server.temp_directory
+        self.execution_cache = ExecutionCache(mode=cache_mode)
+        self.client = type("Client", (), {"timeout": 10})()
+        self.weights_downloader = type(
+            "Downloader", (), {"supported_filetypes": WeightsDownloader.supported_filetypes}
+        )()
+        self.executed = []
+
+    def prepare_for_queue(self, workflow, outputs=None):
+        return workflow
+
+    def print_executing_node(self, workflow, node_id):
+        self.executed.append(node_id)
+
+    def raise_execution_error(self, message):
+        raise Exception(f"Prompt failed: {message['data']}")
+
+    def reset_workflow(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with open(os.path.join(root, "reset.json"), "r") as f:
+            return json.load(f)
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+import comfyui_async
+from comfyui_async import AsyncComfyUI
+from comfyui_pool import ServerPool
+from standin_comfyui import StandInComfyUI, StandInFrontEnd
+
+SAVE_WORKFLOW = {
+    "1": {"class_type": "EmptyImage", "inputs": {"width": 64, "height": 64}},
+    "2": {"class_type": "SaveImage", "inputs": {"images": ["1", 0]}},
+}
+
+
+@pytest.fixture
+def servers(tmp_path):
+    started = [
+        StandInComfyUI(str(tmp_path / f"server{index}")).start() for index in range(2)
+    ]
+    yield started
+    for server in started:
+        server.stop()
+
+
+def local_pool(servers):
+    pool = ServerPool()
+    for index, server in enumerate(servers):
+        pool.add_existing(
+            str(index),
+            server.address,
+            server.output_directory,
+            server.input_directory,
+            server.temp_directory,
+        )
+    return pool
+
+
+def test_acquire_picks_the_least_loaded_healthy_server(servers):
+    pool = local_pool(servers)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert {first.name, second.name} == {"0", "1"}
+
+    pool.release(first)
+    assert pool.acquire() is first
+
+    first.healthy = False
+    pool.release(second)
+    assert pool.acquire() is second
+
+
+def test_check_health_reads_queue_depth(servers):
+    pool = local_pool(servers)
+    instance = pool.instances[0]
+    servers[0].pending = ["a", "b"]
+    servers[0].running = "c"
+    assert instance.check_health()
+    assert instance.queue_depth == 3
+
+    servers[0].stop()
+    assert not instance.check_health()
+    assert not instance.healthy
+
+
+def test_concurrent_requests_run_on_their_own_servers(servers, tmp_path):
+    pool = local_pool(servers)
+    front_end = StandInFrontEnd(servers[0], str(tmp_path))
+    clients = {
+        instance.name: AsyncComfyUI(front_end, instance) for instance in pool.instances
+    }
+
+    async def run_request():
+        directories = clients["0"].request_directories()
+        instance = await asyncio.to_thread(pool.acquire)
+        try:
+            client = clients[instance.name]
+            outputs = await client.run_workflow(
+                dict(SAVE_WORKFLOW), directories=directories
+            )
+            files = await client.collect_outputs(outputs, directories)
+        finally:
+            pool.release(instance)
+        return instance.name, directories, files
+
+    async def main():
+        try:
+            return await asyncio.gather(run_request(), run_request())
+        finally:
+            for client in clients.values():
+                await client.close()
+
+    results = asyncio.run(main())
+    assert sorted(name for name, _, _ in results) == ["0", "1"]
+    for _, directories, files in results:
+        assert len(files) == 1
+        assert files[0].startswith(directories.output_directory)
+    assert sum(len(server.prompts) for server in servers) == 2
+
+
+def test_execution_cache_resets_ahead_of_each_prompt(servers, tmp_path):
+    front_end = StandInFrontEnd(servers[0], str(tmp_path), cache_mode="reset")
+    client = AsyncComfyUI(front_end)
+
+    async def main():
+        try:
+            await client.run_workflow(dict(SAVE_WORKFLOW))
+            await client.run_workflow(dict(SAVE_WORKFLOW))
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+    reset = front_end.reset_workflow()
+    queued = list(servers[0].prompts.values())
+    assert queued == [reset, SAVE_WORKFLOW, reset, SAVE_WORKFLOW]
+    # Only lru mode needs /free, which would also unload models
+    assert servers[0].frees == []
+
+
+def test_prompt_on_a_dead_server_fails_instead_of_waiting(servers, tmp_path, monkeypatch):
+    monkeypatch.setattr(comfyui_async, "HEARTBEAT_INTERVAL", 0.1)
+    pool = local_pool(servers)
+    instance = pool.instances[0]
+    client = AsyncComfyUI(StandInFrontEnd(servers[0], str(tmp_path)), instance)
+    servers[0].hang = True
+
+    async def main():
+        try:
+            task = asyncio.ensure_future(client.run_workflow(dict(SAVE_WORKFLOW)))
+            await asyncio.sleep(0.3)
+            assert not task.done()
+            # As the pool's health check does when the server stops answering
+            instance.healthy = False
+            await asyncio.wait_for(task, 5)
+        finally:
+            servers[0].hang = False
+            await client.close()
+
+    with pytest.raises(Exception, match="stopped responding"):
+        asyncio.run(main())
@@ -0,0 +1,112 @@
+import os
+import asyncio
+
+import pytest
+
+from comfyui_async import AsyncComfyUI, input_choices
+from comfyui_pool import ServerPool
+from standin_comfyui import StandInComfyUI, StandInFrontEnd
+
+MODEL = "sd_xl_base_1.0.safetensors"
+
+
+@pytest.fixture
+def local(tmp_path):
+    server = StandInComfyUI(str(tmp_path / "local")).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def remote(tmp_path):
+    server = StandInComfyUI(str(tmp_path / "remote"), models=[MODEL]).start()
+    yield server
+    server.stop()
+
+
+def remote_client(local, remote, tmp_path):
+    pool = ServerPool()
+    instance = pool.add_remote("1", remote.address)
+    assert instance.healthy and instance.remote
+    return AsyncComfyUI(StandInFrontEnd(local, str(tmp_path)), instance)
+
+
+def image_workflow(image, ckpt_name=MODEL):
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt_name}},
+        "2": {"class_type": "LoadImage", "inputs": {"image": image}},
+        "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0]}},
+    }
+
+
+def run(client, coroutine_function):
+    async def main():
+        try:
+            return await coroutine_function()
+        finally:
+            await client.close()
+
+    return asyncio.run(main())
+
+
+def test_inputs_are_uploaded_and_outputs_downloaded(local, remote, tmp_path):
+    client = remote_client(local, remote, tmp_path)
+    directories = client.request_directories()
+    with open(os.path.join(directories.input_directory, "photo.png"), "wb") as f:
+        f.write(b"photo")
+    # As handle_inputs names files in a request's directory
+    image = os.path.relpath(
+        os.path.join(directories.input_directory, "photo.png"), local.input_directory
+    )
+
+    async def request():
+        outputs = await client.run_workflow(image_workflow(image), directories=directories)
+        return await client.collect_outputs(outputs, directories)
+
+    files = run(client, request)
+
+    assert remote.uploads == [os.path.join(directories.request_id, "photo.png")]
+    queued = next(iter(remote.prompts.values()))
+    assert queued["2"]["inputs"]["image"] == f"{directories.request_id}/photo.png"
+    assert len(files) == 1
+    assert os.path.dirname(files[0]) == directories.output_directory
+    with open(files[0], "rb") as f:
+        assert f.read().endswith(b" 3")
+
+
+def test_weights_missing_on_the_remote_server_are_reported(local, remote, tmp_path):
+    client = remote_client(local, remote, tmp_path)
+    directories = client.request_directories()
+    with open(os.path.join(directories.input_directory, "photo.png"), "wb") as f:
+        f.write(b"photo")
+    image = f"{directories.request_id}/photo.png"
+
+    with pytest.raises(Exception, match="does not have the weights missing.safetensors"):
+        run(
+            client,
+            lambda: client.run_workflow(
+                image_workflow(image, ckpt_name="missing.safetensors"),
+                directories=directories,
+            ),
+        )
+    assert remote.prompts == {}
+
+
+def test_outputs_that_cannot_be_downloaded_raise(local, remote, tmp_path):
+    client = remote_client(local, remote, tmp_path)
+    directories = client.request_directories()
+    outputs = {"3": {"images": [{"filename": "gone.png", "subfolder": "", "type": "output"}]}}
+
+    async def collect():
+        await client.start()
+        return await client.collect_outputs(outputs, directories)
+
+    with pytest.raises(Exception, match="Could not download gone.png"):
+        run(client, collect)
+
+
+def test_input_choices_from_object_info():
+    assert input_choices([["a.safetensors", "b.ckpt"]]) == ["a.safetensors", "b.ckpt"]
+    assert input_choices(["COMBO", {"options": ["c.pt"]}]) == ["c.pt"]
+    assert input_choices(["INT", {"default": 1}]) == []
+    assert input_choices("STRING") == []
@@ -0,0 +1,51 @@
+import random
+
+from substring_matcher import SubstringMatcher
+
+
+def naive_find(patterns, text):
+    return [pattern for pattern in dict.fromkeys(patterns) if pattern and pattern in text]
+
+
+def random_word(rng, alphabet, max_length):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, max_length)))
+
+
+def test_automaton_matches_naive_scan():
+    rng = random.Random(0)
+    for _ in range(200):
+        patterns = [random_word(rng, "abc", 5) for _ in range(rng.randint(1, 30))]
+        text = random_word(rng, "abcd", 60)
+        matcher = SubstringMatcher(patterns, min_automaton_patterns=1)
+        assert matcher.use_automaton
+        assert matcher.find(text) == naive_find(patterns, text)
+
+
+def test_small_pattern_sets_scan_directly():
+    matcher = SubstringMatcher(["easynegative", "bad_hands"])
+    assert not matcher.use_automaton
+    assert matcher.find("embedding:bad_hands, easynegative") == [
+        "easynegative",
+        "bad_hands",
+    ]
+
+
+def test_overlapping_and_nested_patterns():
+    patterns = ["he", "she", "his", "hers", "ers", "s"]
+    matcher = SubstringMatcher(patterns, min_automaton_patterns=1)
+    assert matcher.find("ushers") == ["he", "she", "hers", "ers", "s"]
+    assert matcher.find("xyz") == []
+
+
+def test_duplicate_and_empty_patterns_are_ignored():
+    matcher = SubstringMatcher(["ab", "", "ab", "b"], min_automaton_patterns=1)
+    assert matcher.patterns == ["ab", "b"]
+    assert matcher.find("cab") == ["ab", "b"]
+
+
+def test_large_pattern_set_of_embedding_names():
+    patterns = [f"embedding_{index}" for index in range(500)]
+    matcher = SubstringMatcher(patterns)
+    assert matcher.use_automaton
+    text = "a photo, embedding_42 and embedding_420, (embedding_7:1.2)"
+    assert matcher.find(text) == naive_find(patterns, text)
@@ -0,0 +1,75 @@
+import pytest
+
+from workflow_graph import output_nodes, prune_to_outputs, topological_order
+
+WORKFLOW = {
+    "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd.safetensors"}},
+    "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "a cat", "clip": ["1", 1]}},
+    "3": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+    "4": {
+        "class_type": "KSampler",
+        "inputs": {"model": ["1", 0], "positive": ["2", 0], "negative": ["2", 0], "latent_image": ["3", 0]},
+    },
+    "5": {"class_type": "VAEDecode", "inputs": {"samples": ["4", 0], "vae": ["1", 2]}},
+    "6": {"class_type": "SaveImage", "inputs": {"images": ["5", 0]}},
+    "7": {"class_type": "PreviewImage", "inputs": {"images": ["5", 0]}},
+    "8": {"class_type": "CLIPTextEncode", "inputs": {"text": "unused", "clip": ["1", 1]}},
+    "9": {"class_type": "PreviewImage", "inputs": {"images": ["10", 0]}},
+    "10": {"class_type": "LoadImage", "inputs": {"image": "example.png"}},
+}
+OUTPUT_NODE_TYPES = {"SaveImage", "PreviewImage"}
+
+
+def test_prune_keeps_only_the_ancestors_of_the_outputs():
+    pruned = prune_to_outputs(WORKFLOW, ["6"])
+    assert list(pruned) == ["1", "2", "3", "4", "5", "6"]
+    assert pruned["4"] is WORKFLOW["4"]
+
+
+def test_prune_to_several_outputs():
+    pruned = prune_to_outputs(WORKFLOW, ["6", "9"])
+    assert list(pruned) == ["1", "2", "3", "4", "5", "6", "9", "10"]
+
+
+def test_prune_rejects_unknown_outputs():
+    with pytest.raises(ValueError, match="99"):
+        prune_to_outputs(WORKFLOW, ["6", "99"])
+
+
+def test_prune_ignores_links_to_missing_nodes():
+    workflow = {
+        "1": {"class_type": "SaveImage", "inputs": {"images": ["42", 0]}},
+    }
+    assert prune_to_outputs(workflow, ["1"]) == workflow
+
+
+def test_output_nodes_leave_out_previews():
+    assert output_nodes(WORKFLOW, OUTPUT_NODE_TYPES) == ["6"]
+    assert output_nodes(WORKFLOW, OUTPUT_NODE_TYPES, keep_previews=True) == ["6", "7", "9"]
+
+
+def test_output_nodes_keep_previews_when_they_are_all_there_is():
+    workflow = {node_id: node for node_id, node in WORKFLOW.items() if node_id != "6"}
+    assert output_nodes(workflow, OUTPUT_NODE_TYPES) == ["7", "9"]
+
+
+def test_output_nodes_without_types_are_the_sinks():
+    assert output_nodes(WORKFLOW) == ["6", "7", "8", "9"]
+
+
+def test_topological_order_puts_dependencies_first():
+    order = topological_order(WORKFLOW)
+    position = {node_id: index for index, node_id in enumerate(order)}
+    for node_id, node in WORKFLOW.items():
+        for value in node["inputs"].values():
+            if isinstance(value, list):
+                assert position[value[0]] < position[node_id]
+
+
+def test_topological_order_rejects_cycles():
+    workflow = {
+        "1": {"class_type": "A", "inputs": {"x": ["2", 0]}},
+        "2": {"class_type": "B", "inputs": {"x": ["1", 0]}},
+    }
+    with pytest.raises(ValueError, match="cycle"):
+        topological_order(workflow)
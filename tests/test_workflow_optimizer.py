@@ -0,0 +1,80 @@
+import json
+import os
+
+from workflow_graph import is_link
+from workflow_optimizer import FOLDABLE_NODES, fold_node, optimize_workflow
+
+EXAMPLE_WORKFLOW = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "workflow_api.json"
+)
+
+
+def load_example():
+    with open(EXAMPLE_WORKFLOW, "r") as f:
+        return json.load(f)
+
+
+def test_example_workflow_folds_simple_math_nodes():
+    workflow = load_example()
+    optimized, eliminated = optimize_workflow(workflow)
+
+    folded = [
+        node_id
+        for node_id, replacement in eliminated.items()
+        if replacement.startswith("folded")
+    ]
+    assert len(folded) == 13
+    assert all(workflow[node_id]["class_type"] in FOLDABLE_NODES for node_id in folded)
+    assert not set(folded) & set(optimized)
+
+    # Nothing still reads from a folded node
+    for node in optimized.values():
+        for value in node["inputs"].values():
+            assert not (is_link(value) and value[0] in folded)
+
+    # 685 multiplies outputs of a non-constant node, so it is left alone
+    assert optimized["685"]["class_type"] == "SimpleMathDual+"
+
+
+def test_example_workflow_folded_values_reach_their_readers():
+    optimized, _ = optimize_workflow(load_example())
+    # 711 is 3.2, and 703 clamps it to at most 5
+    assert optimized["701"]["inputs"]["guidance"] == 3.2
+
+
+def test_optimizing_leaves_the_workflow_unchanged():
+    workflow = load_example()
+    before = json.dumps(workflow, sort_keys=True)
+    optimize_workflow(workflow)
+    assert json.dumps(workflow, sort_keys=True) == before
+
+
+def test_duplicate_pure_nodes_are_merged():
+    workflow = {
+        "1": {"class_type": "VAELoader", "inputs": {"vae_name": "ae.safetensors"}},
+        "2": {"class_type": "VAELoader", "inputs": {"vae_name": "ae.safetensors"}},
+        "3": {"class_type": "VAEDecode", "inputs": {"vae": ["2", 0], "samples": ["4", 0]}},
+        "4": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+        "5": {"class_type": "SaveImage", "inputs": {"images": ["3", 0]}},
+    }
+    optimized, eliminated = optimize_workflow(workflow)
+    assert eliminated == {"2": "merged into node 1"}
+    assert optimized["3"]["inputs"]["vae"] == ["1", 0]
+
+
+def test_unsupported_expressions_are_not_folded():
+    workflow = {
+        "1": {"class_type": "SimpleMath+", "inputs": {"value": "__import__('os')"}},
+        "2": {"class_type": "PrimitiveNode", "inputs": {"value": ["1", 0]}},
+    }
+    optimized, eliminated = optimize_workflow(workflow)
+    assert eliminated == {}
+    assert optimized == workflow
+
+
+def test_fold_node_matches_simple_math_outputs():
+    assert fold_node("SimpleMath+", {"value": "a/b", "a": 7, "b": 2}) == (4, 3.5)
+    assert fold_node("SimpleMathInt+", {"value": 3}) == (3,)
+    assert fold_node(
+        "SimpleMathSlider+", {"value": 0.5, "min": 0, "max": 10, "rounding": 0}
+    ) == (5.0, 5)
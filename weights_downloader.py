@@ -1,7 +1,17 @@
-import subprocess
 import time
 import os
+import shutil
+import threading
+from contextlib import contextmanager
 from weights_manifest import WeightsManifest
+from download_scheduler import DownloadScheduler, path_size, probe_size
+from weights_store import WeightsStore, sha256_file
+from weights_ledger import WeightsLedger
+from weights_integrity import validate_file
+from resumable_download import StagedDownload
+from download_backends import get_download_backend
+from weights_telemetry import DownloadTelemetry, Transfer
+from weights_inventory import WeightsInventory
 
 
 class WeightsDownloader:
@@ -17,9 +27,31 @@ class WeightsDownloader:
         ".patch",
     ]
 
+    _shared = None
+    _shared_lock = threading.Lock()
+
     def __init__(self):
-        self.weights_manifest = WeightsManifest()
+        self.weights_manifest = WeightsManifest.shared()
         self.weights_map = self.weights_manifest.weights_map
+        self.weights_store = WeightsStore()
+        self.weights_inventory = WeightsInventory()
+        self.weights_ledger = WeightsLedger(inventory=self.weights_inventory)
+        self.download_backend = get_download_backend()
+        self.telemetry = DownloadTelemetry()
+        # (url, dest) of weights a thread is downloading, validating or removing
+        self.claims = set()
+        self.claims_condition = threading.Condition()
+        # Throttled transfers of claimed weights, sped up when waited on
+        self.claimed_transfers = {}
+
+    @classmethod
+    def shared(cls):
+        # The downloader used by ComfyUI and the custom node helpers, so they
+        # share one manifest, ledger and set of telemetry
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
 
     def get_canonical_weight_str(self, weight_str):
         return self.weights_manifest.get_canonical_weight_str(weight_str)
@@ -27,69 +59,339 @@ class WeightsDownloader:
     def get_weights_by_type(self, type):
         return self.weights_manifest.get_weights_by_type(type)
 
-    def download_weights(self, weight_str):
-        if weight_str in self.weights_map:
-            if self.weights_manifest.is_non_commercial_only(weight_str):
-                print(
-                    f"⚠️  {weight_str} is for non-commercial use only. Unless you have obtained a commercial license.\nDetails: https://github.com/replicate/cog-comfyui/blob/main/weights_licenses.md"
-                )
+    def find_embeddings(self, text):
+        return self.weights_manifest.find_embeddings(text)
+
+    def get_weight_size(self, weight_str):
+        return self.weights_manifest.get_weight_size(weight_str)
+
+    def warn_if_non_commercial(self, weight_str):
+        if self.weights_manifest.is_non_commercial_only(weight_str):
+            print(
+                f"⚠️  {weight_str} is for non-commercial use only. Unless you have obtained a commercial license.\nDetails: https://github.com/replicate/cog-comfyui/blob/main/weights_licenses.md"
+            )
 
+    def get_weight_sources(self, weight_str):
+        if weight_str in self.weights_map:
             if isinstance(self.weights_map[weight_str], list):
-                for weight in self.weights_map[weight_str]:
-                    self.download_if_not_exists(
-                        weight_str, weight["url"], weight["dest"]
-                    )
-            else:
-                self.download_if_not_exists(
-                    weight_str,
+                return [
+                    (weight["url"], weight["dest"])
+                    for weight in self.weights_map[weight_str]
+                ]
+            return [
+                (
                     self.weights_map[weight_str]["url"],
                     self.weights_map[weight_str]["dest"],
                 )
+            ]
         else:
             raise ValueError(
                 f"{weight_str} unavailable. View the list of available weights: https://github.com/replicate/cog-comfyui/blob/main/supported_weights.md"
             )
 
-    def check_if_file_exists(self, weight_str, dest):
+    def download_weights(self, weight_str):
+        self.warn_if_non_commercial(weight_str)
+        for url, dest in self.get_weight_sources(weight_str):
+            self.download_if_not_exists(weight_str, url, dest)
+
+    def download_all_weights(self, weights):
+        DownloadScheduler(self).run(weights)
+
+    def pin_weights(self, weights):
+        # Pinned weights are never evicted to stay within the disk budget
+        self.weights_ledger.pin(weights)
+        self.weights_ledger.save()
+
+    def lease_weights(self, lease_id, weights):
+        # Leased weights are not evicted for other requests until released,
+        # once the prediction that resolved them has run its prompt
+        self.weights_ledger.lease(lease_id, weights)
+
+    def release_weights(self, lease_id):
+        self.weights_ledger.release(lease_id)
+
+    def make_room(self, incoming_bytes, exclude=()):
+        with self.claims_condition:
+            busy_urls = {url for url, _ in self.claims}
+        self.weights_ledger.make_room(
+            incoming_bytes, self.weights_store, exclude=exclude, busy_urls=busy_urls
+        )
+
+    @contextmanager
+    def claim(self, url, dest, wait=True):
+        # Only one thread at a time downloads, validates or removes the weight
+        # from url in dest. Yields whether the claim was made, which is only
+        # False when wait is False and another thread holds it. Check whether
+        # the weight exists after claiming it, not before.
+        key = (url, os.path.normpath(dest))
+        with self.claims_condition:
+            while wait and key in self.claims:
+                transfer = self.claimed_transfers.get(key)
+                if transfer is not None:
+                    transfer.unthrottle()
+                self.claims_condition.wait()
+            claimed = key not in self.claims
+            if claimed:
+                self.claims.add(key)
+        try:
+            yield claimed
+        finally:
+            if claimed:
+                with self.claims_condition:
+                    self.claims.discard(key)
+                    self.claims_condition.notify_all()
+
+    def weight_path(self, weight_str, dest):
         if dest.endswith(weight_str):
-            path_string = dest
+            return dest
+        return os.path.join(dest, weight_str)
+
+    def check_if_file_exists(self, weight_str, dest):
+        return self.weights_inventory.exists(self.weight_path(weight_str, dest))
+
+    def is_installed(self, weight_str):
+        try:
+            sources = self.get_weight_sources(weight_str)
+        except ValueError:
+            return False
+        return all(self.check_if_file_exists(weight_str, dest) for _, dest in sources)
+
+    def record_hit(self, weight_str, url, dest):
+        path = self.weight_path(weight_str, dest)
+        size = path_size(path)
+        self.weights_ledger.record_hit(weight_str, url, path, size)
+        self.telemetry.record("exists", weight_str, url, dest, size=size)
+
+    def record_download(self, weight_str, url, dest, fetched_bytes):
+        path = self.weight_path(weight_str, dest)
+        size = path_size(path) if os.path.exists(path) else fetched_bytes
+        self.weights_ledger.record_download(weight_str, url, path, size, fetched_bytes)
+
+    def weight_files(self, weight_str, dest):
+        # Yields each file of an installed weight with its checksums key,
+        # its path relative to the directory the weight was extracted into
+        path = self.weight_path(weight_str, dest)
+        base = os.path.dirname(path)
+        if os.path.isfile(path):
+            yield path, os.path.relpath(path, base)
+            return
+        for root, _, files in os.walk(path):
+            for f in sorted(files):
+                file_path = os.path.join(root, f)
+                yield file_path, os.path.relpath(file_path, base)
+
+    def installed_files(self, weights):
+        files = []
+        for weight_str in weights:
+            try:
+                sources = self.get_weight_sources(weight_str)
+            except ValueError:
+                continue
+            for _, dest in sources:
+                if self.check_if_file_exists(weight_str, dest):
+                    files.extend(
+                        file_path for file_path, _ in self.weight_files(weight_str, dest)
+                    )
+        return list(dict.fromkeys(files))
+
+    def validate_weight(self, weight_str, dest):
+        # Fast check of sizes and safetensors headers, no hashing
+        expected_files = self.weights_manifest.get_weight_checksums(weight_str)
+        for file_path, key in self.weight_files(weight_str, dest):
+            reason = validate_file(file_path, expected_files.get(key))
+            if reason:
+                print(f"❌ {weight_str} is corrupted, {file_path}: {reason}")
+                return False
+        return True
+
+    def verify_download(self, weight_str, url, dest, hashes=None):
+        # Compares the sha256 of every downloaded file against the manifest.
+        # Files in the weights store were hashed as they were ingested, and
+        # hashes has the files the backend hashed as it extracted them.
+        expected_files = self.weights_manifest.get_weight_checksums(weight_str)
+        if not expected_files:
+            return self.validate_weight(weight_str, dest)
+
+        if self.weights_store.enabled:
+            ref = self.weights_store.get_ref(url)
+            actual_files = {
+                entry["path"]: {"size": entry["size"], "sha256": entry["blob"]}
+                for entry in ref["entries"]
+                if "blob" in entry
+            }
         else:
-            path_string = os.path.join(dest, weight_str)
-        return os.path.exists(path_string)
+            hashes = hashes or {}
+            actual_files = {
+                key: hashes.get(key)
+                or {"size": os.path.getsize(file_path), "sha256": sha256_file(file_path)}
+                for file_path, key in self.weight_files(weight_str, dest)
+            }
+
+        for key, expected in expected_files.items():
+            actual = actual_files.get(key)
+            if actual is None:
+                print(f"❌ {weight_str} is missing {key}")
+                return False
+            if actual["size"] != expected["size"] or actual["sha256"] != expected["sha256"]:
+                print(f"❌ {weight_str} checksum mismatch for {key}")
+                return False
+        return True
+
+    def remove_weight(self, weight_str, url, dest):
+        path = self.weight_path(weight_str, dest)
+        if os.path.islink(path) or os.path.isfile(path):
+            os.remove(path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
+        self.weights_inventory.remove(path)
+        print(f"Deleted {path}")
+        self.weights_store.forget(url)
+        self.weights_ledger.forget(weight_str)
 
     def download_if_not_exists(self, weight_str, url, dest):
-        if self.check_if_file_exists(weight_str, dest):
-            print(f"✅ {weight_str} exists in {dest}")
-            return
-        WeightsDownloader.download(weight_str, url, dest)
+        with self.claim(url, dest):
+            if self.check_if_file_exists(
+                weight_str, dest
+            ) and not self.validate_weight(weight_str, dest):
+                self.remove_weight(weight_str, url, dest)
+
+            if self.check_if_file_exists(weight_str, dest):
+                print(f"✅ {weight_str} exists in {dest}")
+                self.record_hit(weight_str, url, dest)
+                self.weights_ledger.save()
+                return
+
+            size = self.get_weight_size(weight_str)
+            if size is None:
+                size = probe_size(url)
+            self.make_room(size or 0, exclude=[weight_str])
+            fetched_bytes = self.download(weight_str, url, dest, size)
+            self.record_download(weight_str, url, dest, fetched_bytes)
+            self.weights_ledger.save()
+
+    def fetch(self, url, dest, size=None, transfer=None):
+        # Downloads and extracts into a staging directory first, then moves
+        # the extracted files into dest once everything has arrived
+        staged = StagedDownload(url)
+        with staged.lock():
+            staged.prepare()
+            self.download_backend.fetch(url, staged, size, transfer)
+            staged.commit(dest)
+
+    def download(self, weight_str, url, dest, size=None, max_bytes_per_second=None):
+        # Callers claim the weight first. A throttled download runs at full
+        # speed once another thread waits for the claim.
+        if size is None:
+            size = self.get_weight_size(weight_str)
+        transfer = Transfer(max_bytes_per_second)
+        if transfer.throttled:
+            key = (url, os.path.normpath(dest))
+            with self.claims_condition:
+                self.claimed_transfers[key] = transfer
+            try:
+                return self._download(weight_str, url, dest, size, transfer)
+            finally:
+                with self.claims_condition:
+                    self.claimed_transfers.pop(key, None)
+        return self._download(weight_str, url, dest, size, transfer)
+
+    def _download(self, weight_str, url, dest, size, transfer):
+        weight_dest = dest
+
+        def fetch(url, directory):
+            self.fetch(url, directory, size, transfer)
+            return transfer.hashes
 
-    @staticmethod
-    def download(weight_str, url, dest):
         if "/" in weight_str:
             subfolder = weight_str.rsplit("/", 1)[0]
             dest = os.path.join(dest, subfolder)
             os.makedirs(dest, exist_ok=True)
 
+        if self.weights_store.enabled and self.weights_store.has(url):
+            self.weights_store.materialize(url, dest, fetch)
+            self.weights_inventory.add(self.weight_path(weight_str, weight_dest))
+            print(f"🔗 {weight_str} linked from the weights store to {dest}")
+            self.telemetry.record_transfer(
+                "linked", weight_str, url, weight_dest, transfer, 0
+            )
+            return 0
+
         print(f"⏳ Downloading {weight_str} to {dest}")
         start = time.time()
-        subprocess.check_call(
-            ["pget", "--log-level", "warn", "-xf", url, dest], close_fds=False
-        )
-        elapsed_time = time.time() - start
         try:
-            file_size_bytes = os.path.getsize(
-                os.path.join(dest, os.path.basename(weight_str))
-            )
-            file_size_megabytes = file_size_bytes / (1024 * 1024)
-            print(
-                f"✅ {weight_str} downloaded to {dest} in {elapsed_time:.2f}s, size: {file_size_megabytes:.2f}MB"
+            if self.weights_store.enabled:
+                self.weights_store.materialize(url, dest, fetch)
+            else:
+                fetch(url, dest)
+
+            self.weights_inventory.add(self.weight_path(weight_str, weight_dest))
+            if not self.verify_download(weight_str, url, weight_dest, transfer.hashes):
+                self.remove_weight(weight_str, url, weight_dest)
+                raise Exception(
+                    f"{weight_str} failed integrity checks after downloading"
+                )
+        except Exception as e:
+            self.telemetry.record_transfer(
+                "failed",
+                weight_str,
+                url,
+                weight_dest,
+                transfer,
+                0,
+                backend=self.download_backend.name,
+                error=str(e),
             )
-        except FileNotFoundError:
+            raise
+
+        elapsed_time = time.time() - start
+        downloaded_path = os.path.join(dest, os.path.basename(weight_str))
+        file_size_bytes = (
+            path_size(downloaded_path) if os.path.exists(downloaded_path) else 0
+        )
+        self.telemetry.record_transfer(
+            "downloaded",
+            weight_str,
+            url,
+            weight_dest,
+            transfer,
+            file_size_bytes,
+            backend=self.download_backend.name,
+        )
+        if not os.path.exists(downloaded_path):
             print(f"✅ {weight_str} downloaded to {dest} in {elapsed_time:.2f}s")
+            return 0
+
+        file_size_megabytes = file_size_bytes / (1024 * 1024)
+        print(
+            f"✅ {weight_str} downloaded to {dest} in {elapsed_time:.2f}s, size: {file_size_megabytes:.2f}MB"
+        )
+        return file_size_bytes
+
+    def installed_weights(self):
+        # Yields (weight_str, path) for every installed weight in the manifest
+        for weight_str in sorted(self.weights_map):
+            for _, dest in self.get_weight_sources(weight_str):
+                if self.check_if_file_exists(weight_str, dest):
+                    yield weight_str, self.weight_path(weight_str, dest)
+
+    def orphaned_paths(self):
+        # Weight files in the weights directories that are not in the manifest
+        sources = [
+            (weight_str, dest)
+            for weight_str in self.weights_map
+            for _, dest in self.get_weight_sources(weight_str)
+        ]
+        return self.weights_inventory.orphans(
+            {dest for _, dest in sources},
+            [self.weight_path(weight_str, dest) for weight_str, dest in sources],
+            self.supported_filetypes,
+        )
 
     def delete_weights(self, weight_str):
         if weight_str in self.weights_map:
-            weight_path = os.path.join(self.weights_map[weight_str]["dest"], weight_str)
-            if os.path.exists(weight_path):
-                os.remove(weight_path)
-                print(f"Deleted {weight_path}")
+            for url, dest in self.get_weight_sources(weight_str):
+                if self.check_if_file_exists(weight_str, dest):
+                    self.remove_weight(weight_str, url, dest)
+                else:
+                    self.weights_store.forget(url)
+            self.weights_ledger.save()
@@ -0,0 +1,107 @@
+import os
+import json
+import struct
+import threading
+
+# A safetensors file starts with an 8 byte little-endian header length,
+# followed by a JSON header describing the byte range of every tensor
+SAFETENSORS_HEADER_LENGTH_BYTES = 8
+SAFETENSORS_MAX_HEADER_BYTES = 100 * 1024 * 1024
+
+
+def validate_safetensors(path):
+    # Checks the header and tensor offsets against the file size without
+    # reading any tensor data. Returns None if valid, or the reason it isn't.
+    file_size = os.path.getsize(path)
+    if file_size < SAFETENSORS_HEADER_LENGTH_BYTES:
+        return f"file is only {file_size} bytes"
+
+    with open(path, "rb") as f:
+        (header_length,) = struct.unpack("<Q", f.read(SAFETENSORS_HEADER_LENGTH_BYTES))
+        if header_length > SAFETENSORS_MAX_HEADER_BYTES:
+            return f"header length {header_length} is too large"
+        if SAFETENSORS_HEADER_LENGTH_BYTES + header_length > file_size:
+            return f"header length {header_length} runs past the end of the file"
+
+        try:
+            header = json.loads(f.read(header_length))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return "header is not valid JSON"
+
+    if not isinstance(header, dict):
+        return "header is not a JSON object"
+
+    data_length = 0
+    for name, tensor in header.items():
+        if name == "__metadata__":
+            continue
+        try:
+            start, end = tensor["data_offsets"]
+        except (TypeError, KeyError, ValueError):
+            return f"tensor {name} has no data offsets"
+        if not isinstance(start, int) or not isinstance(end, int) or start > end:
+            return f"tensor {name} has invalid data offsets"
+        data_length = max(data_length, end)
+
+    expected_size = SAFETENSORS_HEADER_LENGTH_BYTES + header_length + data_length
+    if expected_size != file_size:
+        return f"expected {expected_size} bytes from the header but the file is {file_size} bytes"
+    return None
+
+
+def validate_file(path, expected=None):
+    # Fast validation: only the size and, for safetensors, the header are read
+    if not os.path.isfile(path):
+        return "file is missing"
+
+    if expected and "size" in expected:
+        file_size = os.path.getsize(path)
+        if file_size != expected["size"]:
+            return f"expected {expected['size']} bytes but the file is {file_size} bytes"
+
+    if path.endswith(".safetensors"):
+        return validate_safetensors(path)
+    return None
+
+
+class IntegrityScanner:
+    """
+    Validates installed weights on a background thread.
+
+    Corrupted weights are removed so they are downloaded again the next time
+    a workflow asks for them, rather than failing mid-execution. Each weight
+    is claimed from the downloader while it is checked, and weights that a
+    prediction is downloading or checking are skipped.
+    """
+
+    def __init__(self, weights_downloader):
+        self.weights_downloader = weights_downloader
+        self.thread = None
+        self.corrupted = []
+
+    def start(self, weights):
+        self.thread = threading.Thread(
+            target=self.scan, args=(list(weights),), daemon=True
+        )
+        self.thread.start()
+
+    def scan(self, weights):
+        for weight_str in weights:
+            try:
+                sources = self.weights_downloader.get_weight_sources(weight_str)
+            except ValueError:
+                continue
+
+            for url, dest in sources:
+                with self.weights_downloader.claim(url, dest, wait=False) as claimed:
+                    if not claimed or not self.weights_downloader.check_if_file_exists(
+                        weight_str, dest
+                    ):
+                        continue
+                    if not self.weights_downloader.validate_weight(weight_str, dest):
+                        self.corrupted.append(weight_str)
+                        self.weights_downloader.remove_weight(weight_str, url, dest)
+
+        print(
+            f"Integrity scan checked {len(weights)} weights, {len(self.corrupted)} corrupted"
+        )
@@ -0,0 +1,131 @@
+import os
+import threading
+
+
+class WeightsInventory:
+    """
+    An index of what is installed in each weights directory.
+
+    Each directory is listed with a single scandir the first time a path in
+    it is checked, and later checks are answered from that listing while
+    the directory's modification time is unchanged. A changed directory is
+    listed again, so weights deleted by other means, like by hand or by
+    another host sharing the models volume, are no longer reported. The
+    downloader adds and removes entries as it downloads and deletes weights.
+    Files that appear by other means, like custom nodes downloading their
+    own models, are picked up when a path is not in the index.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # directory: (st_mtime_ns when listed, names mapped to is_dir)
+        self.listings = {}
+
+    @staticmethod
+    def _mtime(directory):
+        try:
+            return os.stat(directory).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def _listing(self, directory):
+        mtime = self._mtime(directory)
+        cached = self.listings.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        listing = {}
+        if mtime is not None:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        listing[entry.name] = entry.is_dir()
+            except (FileNotFoundError, NotADirectoryError):
+                mtime = None
+        self.listings[directory] = (mtime, listing)
+        return listing
+
+    def entries(self, directory):
+        # Names in directory, mapped to whether they are directories
+        with self.lock:
+            return dict(self._listing(os.path.normpath(directory)))
+
+    def exists(self, path):
+        path = os.path.normpath(path)
+        directory, name = os.path.split(path)
+        with self.lock:
+            if name in self._listing(directory):
+                return True
+        if os.path.exists(path):
+            self.add(path)
+            return True
+        return False
+
+    def add(self, path):
+        path = os.path.normpath(path)
+        is_dir = os.path.isdir(path)
+        with self.lock:
+            self._forget_below(path)
+            while True:
+                directory, name = os.path.split(path)
+                cached = self.listings.get(directory)
+                if not name or cached is None:
+                    break
+                listing = cached[1]
+                new = name not in listing
+                listing[name] = is_dir
+                if not new:
+                    break
+                # A new entry may also be a new directory in its parent
+                path = directory
+                is_dir = True
+
+    def remove(self, path):
+        path = os.path.normpath(path)
+        directory, name = os.path.split(path)
+        with self.lock:
+            self._forget_below(path)
+            cached = self.listings.get(directory)
+            if cached is not None:
+                cached[1].pop(name, None)
+
+    def refresh(self):
+        with self.lock:
+            self.listings = {}
+
+    def _forget_below(self, path):
+        prefix = path + os.sep
+        for directory in list(self.listings):
+            if directory == path or directory.startswith(prefix):
+                del self.listings[directory]
+
+    def orphans(self, directories, claimed_paths, filetypes):
+        # Weight files and directories in the given directories that no
+        # claimed path accounts for. Hidden entries, like the weights store,
+        # are skipped.
+        claimed = {os.path.normpath(path) for path in claimed_paths}
+        claimed_parents = set()
+        for path in claimed:
+            parent = os.path.dirname(path)
+            while parent and parent not in claimed_parents:
+                claimed_parents.add(parent)
+                parent = os.path.dirname(parent)
+
+        orphans = []
+        pending = sorted({os.path.normpath(directory) for directory in directories})
+        claimed_parents.update(pending)
+        seen = set()
+        while pending:
+            directory = pending.pop()
+            if directory in seen:
+                continue
+            seen.add(directory)
+            for name, is_dir in sorted(self.entries(directory).items()):
+                path = os.path.join(directory, name)
+                if name.startswith(".") or path in claimed:
+                    continue
+                if is_dir and path in claimed_parents:
+                    pending.append(path)
+                elif is_dir or name.endswith(tuple(filetypes)):
+                    orphans.append(path)
+        return sorted(orphans)
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import shutil
+import threading
+from config import config
+
+WEIGHTS_LEDGER_PATH = config["WEIGHTS_LEDGER_PATH"]
+
+
+def disk_budget_bytes():
+    budget_gb = os.getenv("WEIGHTS_DISK_BUDGET_GB")
+    if not budget_gb:
+        return None
+    return int(float(budget_gb) * 1024 * 1024 * 1024)
+
+
+class WeightsLedger:
+    """
+    Records when each weight was last used and how big it is on disk.
+
+    With WEIGHTS_DISK_BUDGET_GB set, the least recently used weights are
+    evicted to make room before a download. Pinned weights, weights the
+    current workflow needs, weights leased by a prediction that has yet to
+    run its prompt, and weights from urls another thread has claimed are
+    never evicted. Evicted paths are removed
+    from the downloader's WeightsInventory, when given one, so they are not
+    still reported as installed.
+    """
+
+    def __init__(self, path=WEIGHTS_LEDGER_PATH, budget_bytes=None, inventory=None):
+        self.path = path
+        self.inventory = inventory
+        self.budget_bytes = (
+            budget_bytes if budget_bytes is not None else disk_budget_bytes()
+        )
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.pinned = set()
+        # lease_id: weights a running prediction has resolved
+        self.leases = {}
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "bytes_downloaded": 0,
+            "bytes_saved": 0,
+            "bytes_evicted": 0,
+        }
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            print(f"⚠️  Ignoring unreadable weights ledger {self.path}")
+            return
+
+        self.entries = data.get("entries", {})
+        self.pinned = set(data.get("pinned", []))
+        self.stats.update(data.get("stats", {}))
+
+    def save(self):
+        with self.lock:
+            data = {
+                "entries": self.entries,
+                "pinned": sorted(self.pinned),
+                "stats": self.stats,
+            }
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def pin(self, weights):
+        with self.lock:
+            self.pinned = set(weights)
+
+    def lease(self, lease_id, weights):
+        with self.lock:
+            self.leases[lease_id] = set(weights)
+
+    def release(self, lease_id):
+        with self.lock:
+            self.leases.pop(lease_id, None)
+
+    def _touch(self, weight_str, url, path, size):
+        entry = self.entries.setdefault(
+            weight_str, {"size": 0, "paths": [], "urls": []}
+        )
+        if path not in entry["paths"]:
+            entry["paths"].append(path)
+            entry["size"] += size
+        if url not in entry["urls"]:
+            entry["urls"].append(url)
+        entry["last_used"] = time.time()
+
+    def record_hit(self, weight_str, url, path, size):
+        with self.lock:
+            self._touch(weight_str, url, path, size)
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += size
+
+    def record_download(self, weight_str, url, path, size, fetched_bytes):
+        # fetched_bytes is smaller than size when the weight was linked from
+        # the weights store rather than downloaded
+        with self.lock:
+            self._touch(weight_str, url, path, size)
+            self.stats["misses"] += 1
+            self.stats["bytes_downloaded"] += fetched_bytes
+            self.stats["bytes_saved"] += max(0, size - fetched_bytes)
+
+    def forget(self, weight_str):
+        with self.lock:
+            self.entries.pop(weight_str, None)
+
+    def used_bytes(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def eviction_candidates(self, exclude=(), busy_urls=()):
+        protected = self.pinned | set(exclude)
+        for leased in self.leases.values():
+            protected |= leased
+        busy_urls = set(busy_urls)
+        candidates = [
+            (entry.get("last_used", 0), weight_str)
+            for weight_str, entry in self.entries.items()
+            if weight_str not in protected and not busy_urls.intersection(entry["urls"])
+        ]
+        return [weight_str for _, weight_str in sorted(candidates)]
+
+    def make_room(self, incoming_bytes, weights_store=None, exclude=(), busy_urls=()):
+        if self.budget_bytes is None:
+            return
+
+        with self.lock:
+            used = self.used_bytes()
+            if used + incoming_bytes <= self.budget_bytes:
+                return
+
+            for weight_str in self.eviction_candidates(exclude, busy_urls):
+                if used + incoming_bytes <= self.budget_bytes:
+                    break
+                entry = self.entries.pop(weight_str)
+                self._evict(weight_str, entry, weights_store)
+                used -= entry["size"]
+                self.stats["bytes_evicted"] += entry["size"]
+
+            if used + incoming_bytes > self.budget_bytes:
+                print(
+                    f"⚠️  Weights need {(used + incoming_bytes) / (1024 ** 3):.2f}GB, over the {self.budget_bytes / (1024 ** 3):.2f}GB disk budget, but nothing else can be evicted"
+                )
+
+        self.save()
+
+    def _evict(self, weight_str, entry, weights_store):
+        for path in entry["paths"]:
+            if os.path.islink(path) or os.path.isfile(path):
+                os.remove(path)
+            elif os.path.isdir(path):
+                shutil.rmtree(path)
+            if self.inventory is not None:
+                self.inventory.remove(path)
+
+        if weights_store is not None:
+            for url in entry["urls"]:
+                weights_store.forget(url)
+
+        print(
+            f"🗑️  Evicted {weight_str} ({entry['size'] / (1024 * 1024):.2f}MB, last used {time.ctime(entry.get('last_used', 0))})"
+        )
@@ -1,65 +1,282 @@
-import subprocess
 import time
 import os
 import json
+import glob
+import hashlib
+import threading
+import http.client
 import custom_node_helpers as helpers
 from config import config
+from http_pool import default_pool
+from substring_matcher import SubstringMatcher
 
 USER_WEIGHTS_MANIFEST_PATH = config["USER_WEIGHTS_MANIFEST_PATH"]
 REMOTE_WEIGHTS_MANIFEST_URL = config["REMOTE_WEIGHTS_MANIFEST_URL"]
 REMOTE_WEIGHTS_MANIFEST_PATH = "updated_weights.json"
+REMOTE_WEIGHTS_MANIFEST_CACHE_PATH = "updated_weights_cache.json"
+REMOTE_WEIGHTS_MANIFEST_TIMEOUT = 5
 WEIGHTS_MANIFEST_PATH = "weights.json"
 WEIGHTS_SYNONYMS_PATH = "weight_synonyms.json"
+WEIGHTS_CHECKSUMS_PATH = "weights_checksums.json"
+WEIGHTS_MANIFEST_SNAPSHOT_PATH = config["WEIGHTS_MANIFEST_SNAPSHOT_PATH"]
+SNAPSHOT_VERSION = 1
 BASE_URL = config["WEIGHTS_BASE_URL"]
 MODELS_PATH = config["MODELS_PATH"]
 
 
+def source_paths():
+    # Every file the compiled manifest is built from, including the helpers
+    # that contribute their own weights maps, and the code that compiles
+    # it, so a change to how weights are mapped recompiles the snapshot
+    helpers_path = os.path.abspath(helpers.__path__[0])
+    helper_paths = sorted(glob.glob(os.path.join(helpers_path, "*.py")))
+    code_directory = os.path.dirname(os.path.abspath(__file__))
+    code_paths = [
+        os.path.join(code_directory, name)
+        for name in ["weights_manifest.py", "config.py", "custom_node_helper.py"]
+    ]
+    return [
+        WEIGHTS_MANIFEST_PATH,
+        REMOTE_WEIGHTS_MANIFEST_PATH,
+        USER_WEIGHTS_MANIFEST_PATH,
+        WEIGHTS_SYNONYMS_PATH,
+        WEIGHTS_CHECKSUMS_PATH,
+        *code_paths,
+        *helper_paths,
+    ]
+
+
+def source_stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def source_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def describe_source(path):
+    description = source_stat(path)
+    if description is not None:
+        description["sha256"] = source_hash(path)
+    return description
+
+
 class WeightsManifest:
+    """
+    The merged weights manifests, synonyms, checksums and weights map.
+
+    Building the weights map means reading and merging every manifest and
+    asking each custom node helper for its weights. The result is compiled
+    into a snapshot keyed by the mtimes and hashes of those files, and
+    later instances load the snapshot instead while the sources are
+    unchanged. Use WeightsManifest.shared() for the process-wide instance.
+
+    With DOWNLOAD_LATEST_WEIGHTS_MANIFEST=true the remote manifest is
+    revalidated in the background, and weights it adds are applied to the
+    live weights map. Startup uses the last downloaded copy and never waits
+    on the remote manifest.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
     @staticmethod
     def base_url():
         return BASE_URL
 
-    def __init__(self):
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def __init__(self, snapshot_path=WEIGHTS_MANIFEST_SNAPSHOT_PATH):
+        self.snapshot_path = snapshot_path
         self.download_latest_weights_manifest = (
             os.getenv("DOWNLOAD_LATEST_WEIGHTS_MANIFEST", "false").lower() == "true"
         )
-        self.weights_manifest = self._load_weights_manifest()
-        self.synonyms = self._initialize_synonyms()
-        self.weights_map = self._initialize_weights_map()
+        # Seconds between refreshes of the remote manifest, 0 to refresh once
+        self.refresh_interval = int(
+            os.getenv("WEIGHTS_MANIFEST_REFRESH_SECONDS", "0")
+        )
+        self.lock = threading.Lock()
+        # Incremented whenever a refresh changes the live manifest
+        self.generation = 0
+
+        snapshot = self._load_snapshot()
+        if snapshot is None:
+            snapshot = self._compile()
+            self._save_snapshot(snapshot)
 
-    def _load_weights_manifest(self):
+        self.weights_manifest = snapshot["weights_manifest"]
+        self.synonyms = snapshot["synonyms"]
+        self.checksums = snapshot["checksums"]
+        self.weights_map = snapshot["weights_map"]
+        self.non_commercial = set(self.non_commercial_weights())
+        self._build_embedding_matcher()
+
+        self.refresh_thread = None
         if self.download_latest_weights_manifest:
-            self._download_updated_weights_manifest()
-        return self._merge_manifests()
+            self.refresh_thread = threading.Thread(
+                target=self._refresh_in_background, daemon=True
+            )
+            self.refresh_thread.start()
+
+    def _compile(self):
+        start = time.time()
+        sources = {path: describe_source(path) for path in source_paths()}
+        weights_manifest = self._merge_manifests()
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "base_url": BASE_URL,
+            "models_path": MODELS_PATH,
+            "sources": sources,
+            "weights_manifest": weights_manifest,
+            "synonyms": self._initialize_synonyms(),
+            "checksums": self._initialize_checksums(),
+            "weights_map": self._initialize_weights_map(weights_manifest),
+        }
+        print(f"Compiled weights manifest in {time.time() - start:.2f}s")
+        return snapshot
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        if (
+            snapshot.get("version") != SNAPSHOT_VERSION
+            or snapshot.get("base_url") != BASE_URL
+            or snapshot.get("models_path") != MODELS_PATH
+            or set(snapshot.get("sources", {})) != set(source_paths())
+        ):
+            return None
+
+        # Sources are compared by mtime and size, falling back to their hash
+        # when those changed, for example after a fresh checkout
+        touched = False
+        for path, compiled in snapshot["sources"].items():
+            current = source_stat(path)
+            if current is None or compiled is None:
+                if current != compiled:
+                    return None
+                continue
+            if (
+                current["mtime_ns"] == compiled["mtime_ns"]
+                and current["size"] == compiled["size"]
+            ):
+                continue
+            if (
+                current["size"] != compiled["size"]
+                or source_hash(path) != compiled["sha256"]
+            ):
+                return None
+            compiled.update(current)
+            touched = True
+
+        if touched:
+            self._save_snapshot(snapshot)
+        return snapshot
+
+    def _save_snapshot(self, snapshot):
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"⚠️  Could not save the weights manifest snapshot: {e}")
+
+    def _refresh_in_background(self):
+        while True:
+            try:
+                if self._download_updated_weights_manifest():
+                    self._apply(self._compile())
+            except Exception as e:
+                print(f"⚠️  Failed to refresh the weights manifest: {e}")
+            if self.refresh_interval <= 0:
+                return
+            time.sleep(self.refresh_interval)
 
     def _download_updated_weights_manifest(self):
-        if not os.path.exists(REMOTE_WEIGHTS_MANIFEST_PATH):
-            print(
-                f"Downloading updated weights manifest from {REMOTE_WEIGHTS_MANIFEST_URL}"
-            )
-            start = time.time()
+        # Revalidates the cached copy of the remote manifest with its ETag
+        # and Last-Modified date. Returns True if a new copy was downloaded.
+        cache = {}
+        if os.path.exists(REMOTE_WEIGHTS_MANIFEST_PATH) and os.path.exists(
+            REMOTE_WEIGHTS_MANIFEST_CACHE_PATH
+        ):
             try:
-                subprocess.check_call(
-                    [
-                        "pget",
-                        "--log-level",
-                        "warn",
-                        "-f",
-                        REMOTE_WEIGHTS_MANIFEST_URL,
-                        REMOTE_WEIGHTS_MANIFEST_PATH,
-                    ],
-                    close_fds=False,
-                    timeout=5,
-                )
-                print(
-                    f"Downloading {REMOTE_WEIGHTS_MANIFEST_URL} took: {(time.time() - start):.2f}s"
-                )
-            except subprocess.CalledProcessError:
-                print(f"Failed to download {REMOTE_WEIGHTS_MANIFEST_URL}")
-                pass
-            except subprocess.TimeoutExpired:
-                print(f"Download from {REMOTE_WEIGHTS_MANIFEST_URL} timed out")
-                pass
+                with open(REMOTE_WEIGHTS_MANIFEST_CACHE_PATH, "r") as f:
+                    cache = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                cache = {}
+
+        headers = {}
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+
+        start = time.time()
+        try:
+            with default_pool.request(
+                "GET",
+                REMOTE_WEIGHTS_MANIFEST_URL,
+                headers=headers,
+                timeout=REMOTE_WEIGHTS_MANIFEST_TIMEOUT,
+            ) as response:
+                body = response.read()
+                status = response.status
+                etag = response.getheader("ETag")
+                last_modified = response.getheader("Last-Modified")
+        except (OSError, http.client.HTTPException) as e:
+            print(f"Failed to download {REMOTE_WEIGHTS_MANIFEST_URL}: {e}")
+            return False
+
+        if status == 304:
+            print("Weights manifest is up to date")
+            return False
+        if status >= 400:
+            print(f"Failed to download {REMOTE_WEIGHTS_MANIFEST_URL}: {status}")
+            return False
+
+        json.loads(body)
+        tmp_path = f"{REMOTE_WEIGHTS_MANIFEST_PATH}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, REMOTE_WEIGHTS_MANIFEST_PATH)
+        with open(REMOTE_WEIGHTS_MANIFEST_CACHE_PATH, "w") as f:
+            json.dump({"etag": etag, "last_modified": last_modified}, f)
+        print(
+            f"Downloading {REMOTE_WEIGHTS_MANIFEST_URL} took: {(time.time() - start):.2f}s"
+        )
+        return True
+
+    def _apply(self, snapshot):
+        # Updates the live manifest in place, so the weights map held by the
+        # downloader sees the new weights
+        self._save_snapshot(snapshot)
+        with self.lock:
+            added = set(snapshot["weights_map"]) - set(self.weights_map)
+            self.weights_manifest.update(snapshot["weights_manifest"])
+            self.synonyms.update(snapshot["synonyms"])
+            self.checksums.update(snapshot["checksums"])
+            self.weights_map.update(snapshot["weights_map"])
+            self._build_embedding_matcher()
+            self.generation += 1
+        if added:
+            print(f"Added {len(added)} weights from the updated weights manifest")
 
     def _merge_manifests(self):
         if os.path.exists(WEIGHTS_MANIFEST_PATH):
@@ -79,10 +296,12 @@ class WeightsManifest:
                     manifest_to_merge = json.load(f)
                     for key in manifest_to_merge:
                         if key in original_manifest:
+                            existing = set(original_manifest[key])
                             for item in manifest_to_merge[key]:
-                                if item not in original_manifest[key]:
+                                if item not in existing:
                                     print(f"Adding {item} to {key}")
                                     original_manifest[key].append(item)
+                                    existing.add(item)
                         else:
                             original_manifest[key] = manifest_to_merge[key]
 
@@ -92,10 +311,27 @@ class WeightsManifest:
         with open(WEIGHTS_SYNONYMS_PATH, "r") as f:
             return json.load(f)
 
+    def _initialize_checksums(self):
+        # Sizes and sha256 hashes of the files each weight extracts to,
+        # keyed by their path relative to the directory they extract into
+        if not os.path.exists(WEIGHTS_CHECKSUMS_PATH):
+            return {}
+        with open(WEIGHTS_CHECKSUMS_PATH, "r") as f:
+            return json.load(f)
+
+    def get_weight_checksums(self, weight_str):
+        return self.checksums.get(weight_str, {})
+
+    def get_weight_size(self, weight_str):
+        files = self.get_weight_checksums(weight_str)
+        if not files:
+            return None
+        return sum(file["size"] for file in files.values())
+
     def get_canonical_weight_str(self, weight_str):
         return self.synonyms.get(weight_str, weight_str)
 
-    def _initialize_weights_map(self):
+    def _initialize_weights_map(self, weights_manifest):
         weights_map = {}
 
         def generate_weights_map(keys, directory_name):
@@ -137,8 +373,8 @@ class WeightsManifest:
                 else:
                     weights_map[k] = v
 
-        for key in self.weights_manifest.keys():
-            map = generate_weights_map(self.weights_manifest[key], key)
+        for key in weights_manifest.keys():
+            map = generate_weights_map(weights_manifest[key], key)
             update_weights_map(map)
 
         for module_name in dir(helpers):
@@ -197,7 +433,19 @@ class WeightsManifest:
         ]
 
     def is_non_commercial_only(self, weight_str):
-        return weight_str in self.non_commercial_weights()
+        return weight_str in self.non_commercial
 
     def get_weights_by_type(self, weight_type):
         return self.weights_manifest.get(weight_type, [])
+
+    def _build_embedding_matcher(self):
+        # Prompts refer to embeddings by their filename without an extension
+        embeddings = self.get_weights_by_type("EMBEDDINGS")
+        self.embedding_to_fullname = {emb.split(".")[0]: emb for emb in embeddings}
+        self.embedding_matcher = SubstringMatcher(self.embedding_to_fullname)
+
+    def find_embeddings(self, text):
+        return [
+            self.embedding_to_fullname[key]
+            for key in self.embedding_matcher.find(text)
+        ]
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import queue
+import threading
+from config import config
+from download_scheduler import probe_size
+
+WEIGHTS_COOCCURRENCE_PATH = config["WEIGHTS_COOCCURRENCE_PATH"]
+MIN_CONFIDENCE = 0.5
+MAX_COMPANIONS = 5
+IDLE_SECONDS = 300
+
+
+class CooccurrenceStats:
+    """
+    Counts how often weights are requested by the same workflow.
+
+    The confidence that a weight B follows a weight A is the share of
+    workflows using A that also used B.
+    """
+
+    def __init__(self, path=WEIGHTS_COOCCURRENCE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.pairs = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            print(f"⚠️  Ignoring unreadable co-occurrence stats {self.path}")
+            return
+        self.counts = data.get("counts", {})
+        self.pairs = data.get("pairs", {})
+
+    def save(self):
+        with self.lock:
+            data = {"counts": self.counts, "pairs": self.pairs}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+    def record(self, weights):
+        weights = sorted(set(weights))
+        with self.lock:
+            for weight in weights:
+                self.counts[weight] = self.counts.get(weight, 0) + 1
+                companions = self.pairs.setdefault(weight, {})
+                for other in weights:
+                    if other != weight:
+                        companions[other] = companions.get(other, 0) + 1
+
+    def companions(self, weight, min_confidence=MIN_CONFIDENCE):
+        with self.lock:
+            count = self.counts.get(weight, 0)
+            if not count:
+                return []
+            return sorted(
+                (
+                    (other, together / count)
+                    for other, together in self.pairs.get(weight, {}).items()
+                    if together / count >= min_confidence
+                ),
+                key=lambda companion: (-companion[1], companion[0]),
+            )
+
+    def most_used(self):
+        with self.lock:
+            return sorted(self.counts, key=lambda weight: -self.counts[weight])
+
+
+class WeightsPrefetcher:
+    """
+    Downloads weights that are likely to be requested soon, in the background.
+
+    When a workflow requests weights, their most likely companions are
+    queued. When the node has been idle for a while, the most used weights
+    that are not installed are queued too. Prefetches run one at a time,
+    are read at no more than WEIGHTS_PREFETCH_MAX_MBPS, and are skipped
+    rather than evicting anything to stay within the disk budget.
+
+    Weights are claimed from the downloader before they are prefetched, so
+    a weight a prediction is already downloading is skipped. A prediction
+    that needs a weight being prefetched waits for it, and the transfer
+    stops being throttled.
+    """
+
+    def __init__(self, weights_downloader, stats=None):
+        self.weights_downloader = weights_downloader
+        self.stats = stats or CooccurrenceStats()
+        self.enabled = os.getenv("WEIGHTS_PREFETCH", "false").lower() == "true"
+        max_mbps = os.getenv("WEIGHTS_PREFETCH_MAX_MBPS")
+        self.max_bytes_per_second = (
+            float(max_mbps) * 1024 * 1024 if max_mbps else None
+        )
+        self.idle_seconds = int(os.getenv("WEIGHTS_PREFETCH_IDLE_SECONDS", IDLE_SECONDS))
+        self.queue = queue.PriorityQueue()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.last_request_time = time.time()
+        self.thread = None
+
+        if self.enabled:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def on_request(self, weights):
+        self.last_request_time = time.time()
+        self.stats.record(weights)
+        self.stats.save()
+        if not self.enabled:
+            return
+
+        requested = set(weights)
+        for weight in sorted(requested):
+            for companion, confidence in self.stats.companions(weight)[
+                :MAX_COMPANIONS
+            ]:
+                if companion not in requested:
+                    self._enqueue(companion, confidence)
+
+    def _enqueue(self, weight, confidence):
+        with self.lock:
+            if weight in self.queued:
+                return
+            self.queued.add(weight)
+        self.queue.put((-confidence, weight))
+
+    def _queue_idle_prefetches(self):
+        for weight in self.stats.most_used()[:MAX_COMPANIONS]:
+            if not self.weights_downloader.is_installed(weight):
+                self._enqueue(weight, 0)
+
+    def _run(self):
+        while True:
+            try:
+                _, weight = self.queue.get(timeout=self.idle_seconds)
+            except queue.Empty:
+                if time.time() - self.last_request_time >= self.idle_seconds:
+                    self._queue_idle_prefetches()
+                continue
+
+            try:
+                with self.weights_downloader.telemetry.background():
+                    self._prefetch(weight)
+            except Exception as e:
+                print(f"⚠️  Prefetching {weight} failed: {e}")
+            finally:
+                with self.lock:
+                    self.queued.discard(weight)
+
+    def _prefetch(self, weight):
+        downloader = self.weights_downloader
+        try:
+            sources = downloader.get_weight_sources(weight)
+        except ValueError:
+            return
+
+        for url, dest in sources:
+            with downloader.claim(url, dest, wait=False) as claimed:
+                if not claimed or downloader.check_if_file_exists(weight, dest):
+                    continue
+
+                size = downloader.get_weight_size(weight) or probe_size(url) or 0
+                ledger = downloader.weights_ledger
+                if (
+                    ledger.budget_bytes is not None
+                    and ledger.used_bytes() + size > ledger.budget_bytes
+                ):
+                    print(
+                        f"Skipping prefetch of {weight}, it would exceed the disk budget"
+                    )
+                    return
+
+                print(f"Prefetching {weight}")
+                fetched_bytes = downloader.download(
+                    weight,
+                    url,
+                    dest,
+                    size,
+                    max_bytes_per_second=self.max_bytes_per_second,
+                )
+                downloader.record_download(weight, url, dest, fetched_bytes)
+                ledger.save()
@@ -0,0 +1,231 @@
+import os
+import json
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import threading
+from config import config
+
+WEIGHTS_STORE_PATH = config["WEIGHTS_STORE_PATH"]
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def sha256_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def extract_tar(fileobj, directory, hashes=None, mode="r|"):
+    # Extracts a tarball as it is read. With hashes, the size and sha256 of
+    # each regular file are recorded as it is written, so it never has to be
+    # read back to be hashed.
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        for member in tar:
+            if hashes is None or not member.isreg():
+                tar.extract(member, directory, filter="data")
+                continue
+
+            member = tarfile.data_filter(member, directory)
+            path = os.path.join(directory, member.name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            sha256 = hashlib.sha256()
+            source = tar.extractfile(member)
+            with open(path, "wb") as f:
+                for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+                    f.write(chunk)
+            if member.mode is not None:
+                os.chmod(path, member.mode)
+            if member.mtime is not None:
+                os.utime(path, (member.mtime, member.mtime))
+            hashes[os.path.normpath(member.name)] = {
+                "size": member.size,
+                "sha256": sha256.hexdigest(),
+            }
+
+
+class WeightsStore:
+    """
+    A content-addressed store for downloaded weights.
+
+    Every file extracted from a weights tarball is stored once under
+    blobs/, named by its sha256. A ref per URL records the tree the tarball
+    unpacked to, so any number of destinations can be populated from the
+    same download. Files are hardlinked into place, falling back to
+    symlinks when the destination is on another filesystem. Symlinks inside
+    a tarball, such as those in Hugging Face cache directories, are
+    recreated as they are.
+    """
+
+    def __init__(self, root=WEIGHTS_STORE_PATH):
+        self.root = root
+        self.blobs_dir = os.path.join(root, "blobs")
+        self.refs_dir = os.path.join(root, "refs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.enabled = os.getenv("WEIGHTS_STORE", "true").lower() == "true"
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock_for(self, url):
+        with self._locks_lock:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def _ref_path(self, url):
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.refs_dir, f"{url_hash}.json")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    def get_ref(self, url):
+        ref_path = self._ref_path(url)
+        if not os.path.exists(ref_path):
+            return None
+        with open(ref_path, "r") as f:
+            ref = json.load(f)
+
+        for entry in ref["entries"]:
+            if "blob" in entry and not os.path.exists(self._blob_path(entry["blob"])):
+                return None
+        return ref
+
+    def has(self, url):
+        return self.get_ref(url) is not None
+
+    def materialize(self, url, dest, fetch):
+        # Populates dest with the contents of url, calling fetch(url, directory)
+        # only if the store does not already hold them. fetch can return the
+        # hashes of the files it wrote, as extract_tar records them. Returns
+        # the number of bytes fetched, which is 0 when everything was linked
+        # from the store.
+        with self._lock_for(url):
+            fetched_bytes = 0
+            ref = self.get_ref(url)
+            if ref is None:
+                ref = self._fetch(url, fetch)
+                fetched_bytes = sum(entry.get("size", 0) for entry in ref["entries"])
+
+            self._link(ref, dest)
+            return fetched_bytes
+
+    def _fetch(self, url, fetch):
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=self.tmp_dir)
+        try:
+            hashes = fetch(url, staging)
+            ref = {"url": url, "entries": self._ingest(staging, hashes or {})}
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        os.makedirs(self.refs_dir, exist_ok=True)
+        ref_path = self._ref_path(url)
+        tmp_ref_path = f"{ref_path}.tmp"
+        with open(tmp_ref_path, "w") as f:
+            json.dump(ref, f)
+        os.replace(tmp_ref_path, ref_path)
+        return ref
+
+    def _ingest(self, staging, hashes):
+        # Files hashed while they were extracted are not read again
+        entries = []
+        for root, dirs, files in os.walk(staging):
+            for name in sorted(dirs + files):
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, staging)
+
+                if os.path.islink(path):
+                    entries.append({"path": rel_path, "symlink": os.readlink(path)})
+                elif os.path.isdir(path):
+                    entries.append({"path": rel_path, "dir": True})
+                else:
+                    size = os.path.getsize(path)
+                    known = hashes.get(rel_path)
+                    if known is not None and known["size"] == size:
+                        digest = known["sha256"]
+                    else:
+                        digest = sha256_file(path)
+                    blob_path = self._blob_path(digest)
+                    if os.path.exists(blob_path):
+                        os.remove(path)
+                    else:
+                        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                        os.replace(path, blob_path)
+                    entries.append({"path": rel_path, "blob": digest, "size": size})
+        return entries
+
+    def _link(self, ref, dest):
+        os.makedirs(dest, exist_ok=True)
+        for entry in ref["entries"]:
+            target = os.path.join(dest, entry["path"])
+            if "dir" in entry:
+                os.makedirs(target, exist_ok=True)
+                continue
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if "symlink" in entry:
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(entry["symlink"], target)
+                continue
+
+            blob_path = self._blob_path(entry["blob"])
+            if os.path.exists(target) and os.path.samefile(target, blob_path):
+                continue
+
+            tmp_target = f"{target}.link-tmp"
+            if os.path.lexists(tmp_target):
+                os.remove(tmp_target)
+            try:
+                os.link(blob_path, tmp_target)
+            except OSError:
+                # Hardlinks cannot cross filesystems, e.g. into /root/.cache
+                os.symlink(os.path.abspath(blob_path), tmp_target)
+            os.replace(tmp_target, target)
+
+    def forget(self, url):
+        # Drops the ref for url, and any blobs no longer linked anywhere else,
+        # so the next request downloads it again. Symlinks to a blob do not
+        # count towards its links, so blobs other refs list are kept too.
+        with self._lock_for(url):
+            ref_path = self._ref_path(url)
+            if not os.path.exists(ref_path):
+                return
+            with open(ref_path, "r") as f:
+                ref = json.load(f)
+            os.remove(ref_path)
+
+            referenced = None
+            for entry in ref["entries"]:
+                if "blob" not in entry:
+                    continue
+                blob_path = self._blob_path(entry["blob"])
+                if not os.path.exists(blob_path) or os.stat(blob_path).st_nlink > 1:
+                    continue
+                if referenced is None:
+                    referenced = self._referenced_blobs()
+                if entry["blob"] not in referenced:
+                    os.remove(blob_path)
+
+    def _referenced_blobs(self):
+        referenced = set()
+        try:
+            with os.scandir(self.refs_dir) as entries:
+                ref_paths = [
+                    entry.path for entry in entries if entry.name.endswith(".json")
+                ]
+        except FileNotFoundError:
+            return referenced
+        for ref_path in ref_paths:
+            try:
+                with open(ref_path, "r") as f:
+                    ref = json.load(f)
+            except (OSError, ValueError):
+                continue
+            referenced.update(
+                entry["blob"] for entry in ref["entries"] if "blob" in entry
+            )
+        return referenced
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from config import config
+
+WEIGHTS_TELEMETRY_PATH = config["WEIGHTS_TELEMETRY_PATH"]
+
+
+class Transfer:
+    """
+    Timings for one download, filled in by the download backends.
+
+    Backends call first_byte() when the first response arrives, which may
+    happen on several threads for parallel range requests; only the first
+    call counts. Backends that cannot observe responses, like pget, leave
+    the time to first byte unknown.
+
+    Backends that extract the tarball themselves also record the size and
+    sha256 of each file as it is written, in hashes, keyed by its path in
+    the tarball.
+
+    A transfer can be limited to max_bytes_per_second. Backends call
+    received() as data is read, which sleeps as long as needed to keep the
+    average rate within the limit.
+    """
+
+    def __init__(self, max_bytes_per_second=None):
+        self.start_time = time.time()
+        self.first_byte_time = None
+        self.hashes = {}
+        self.max_bytes_per_second = max_bytes_per_second
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+
+    @property
+    def throttled(self):
+        return self.max_bytes_per_second is not None
+
+    def first_byte(self):
+        if self.first_byte_time is None:
+            self.first_byte_time = time.time()
+
+    def received(self, byte_count):
+        with self.lock:
+            self.bytes_received += byte_count
+            if self.max_bytes_per_second is None:
+                return
+            delay = (
+                self.start_time
+                + self.bytes_received / self.max_bytes_per_second
+                - time.time()
+            )
+        if delay > 0:
+            time.sleep(delay)
+
+    def unthrottle(self):
+        # Lets the rest of the transfer run at full speed, for when a
+        # prediction is waiting on it
+        self.max_bytes_per_second = None
+
+    @property
+    def ttfb(self):
+        if self.first_byte_time is None:
+            return None
+        return self.first_byte_time - self.start_time
+
+
+class PredictionTelemetry:
+    # The events recorded for one prediction
+    def __init__(self, prediction_id=None):
+        self.prediction_id = prediction_id or uuid.uuid4().hex
+        self.start_time = time.time()
+        self.events = []
+
+
+current_prediction = contextvars.ContextVar("current_prediction", default=None)
+
+
+class DownloadTelemetry:
+    """
+    Structured events for every weight the downloader resolves.
+
+    Each event is one of "exists", "linked", "downloaded" or "failed", and
+    is appended as a line of JSON to WEIGHTS_TELEMETRY_PATH unless
+    WEIGHTS_TELEMETRY=false.
+
+    start_prediction() sets up the prediction for the current context, so
+    concurrent predictions each see their own events, and summary()
+    reports on it. finish_prediction() drops its events. Threads working
+    for a prediction need to run in a copy of its context. Downloads made
+    in the background, like prefetches, or outside a prediction are only
+    exported.
+    """
+
+    def __init__(self, path=WEIGHTS_TELEMETRY_PATH):
+        self.path = path
+        self.enabled = os.getenv("WEIGHTS_TELEMETRY", "true").lower() != "false"
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start_prediction(self, prediction_id=None):
+        prediction = PredictionTelemetry(prediction_id)
+        current_prediction.set(prediction)
+        return prediction
+
+    def finish_prediction(self):
+        current_prediction.set(None)
+
+    @contextmanager
+    def background(self):
+        self.local.background = True
+        try:
+            yield
+        finally:
+            self.local.background = False
+
+    def record(self, event, weight_str, url, dest, **fields):
+        background = getattr(self.local, "background", False)
+        prediction = None if background else current_prediction.get()
+        entry = {
+            "time": time.time(),
+            "event": event,
+            "weight": weight_str,
+            "url": url,
+            "host": urlsplit(url).hostname if url else None,
+            "dest": dest,
+            "background": background,
+            "prediction_id": prediction.prediction_id if prediction else None,
+            **fields,
+        }
+        with self.lock:
+            if prediction is not None:
+                prediction.events.append(entry)
+            if self.enabled:
+                self._export(entry)
+        return entry
+
+    def record_transfer(
+        self, event, weight_str, url, dest, transfer, bytes_fetched, **fields
+    ):
+        duration = time.time() - transfer.start_time
+        return self.record(
+            event,
+            weight_str,
+            url,
+            dest,
+            bytes=bytes_fetched,
+            duration=duration,
+            ttfb=transfer.ttfb,
+            throughput_mbps=(
+                bytes_fetched / (1024 * 1024) / duration if duration > 0 else None
+            ),
+            **fields,
+        )
+
+    def _export(self, entry):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"⚠️  Could not write download telemetry to {self.path}: {e}")
+            self.enabled = False
+
+    def summary(self):
+        prediction = current_prediction.get()
+        if prediction is None:
+            return None
+        with self.lock:
+            events = list(prediction.events)
+
+        downloads = [event for event in events if event["event"] == "downloaded"]
+        hits = [event for event in events if event["event"] in ("exists", "linked")]
+        failures = [event for event in events if event["event"] == "failed"]
+        bytes_downloaded = sum(event["bytes"] or 0 for event in downloads)
+        download_time = sum(event["duration"] for event in downloads)
+
+        summary = {
+            "prediction_id": prediction.prediction_id,
+            "weights": len(events),
+            "hits": len(hits),
+            "misses": len(downloads) + len(failures),
+            "failures": len(failures),
+            "bytes_downloaded": bytes_downloaded,
+            "download_time": download_time,
+            "elapsed_time": time.time() - prediction.start_time,
+            "slowest_download": None,
+        }
+
+        if not events:
+            return summary
+
+        print(
+            f"Weights: {len(hits)} cached, {len(downloads)} downloaded, {len(failures)} failed, "
+            f"{bytes_downloaded / (1024 * 1024):.2f}MB fetched in {download_time:.2f}s"
+        )
+
+        timed = [event for event in downloads if event["throughput_mbps"] is not None]
+        if timed:
+            slowest = min(timed, key=lambda event: event["throughput_mbps"])
+            summary["slowest_download"] = slowest
+            ttfb = (
+                f", {slowest['ttfb']:.2f}s to first byte"
+                if slowest["ttfb"] is not None
+                else ""
+            )
+            print(
+                f"Slowest download: {slowest['weight']} from {slowest['host']} "
+                f"at {slowest['throughput_mbps']:.2f}MB/s{ttfb}"
+            )
+        return summary
@@ -0,0 +1,309 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import custom_node_helpers as helpers
+from custom_node_helper import CustomNodeHelper
+from node import Node
+from workflow_graph import topological_order, is_link
+
+NODE_METHODS = ["check_for_unsupported_nodes", "add_weights"]
+
+# Nodes that download their own LoRAs from a URL
+URL_LORA_LOADERS = ["HFHubLoraLoader", "LoraLoaderFromURL"]
+INPUT_FILETYPES = [".png", ".jpg", ".jpeg", ".webp", ".mp4", ".webm"]
+PLAN_CACHE_SIZE = 64
+
+
+class HelperIndex:
+    """
+    Maps node class types to the custom node helper methods interested in them.
+
+    Helpers declare the class types they act on with node_types(). Helpers
+    that do not are called for every node, as before.
+    """
+
+    def __init__(self):
+        self.by_type = {method_name: {} for method_name in NODE_METHODS}
+        self.every_node = {method_name: [] for method_name in NODE_METHODS}
+
+        for module_name in dir(helpers):
+            helper = getattr(helpers, module_name)
+            if not isinstance(helper, type) or not issubclass(
+                helper, CustomNodeHelper
+            ):
+                continue
+            node_types = helper.node_types()
+            for method_name in NODE_METHODS:
+                method = getattr(helper, method_name)
+                if method is getattr(CustomNodeHelper, method_name):
+                    continue
+                if node_types is None:
+                    self.every_node[method_name].append(method)
+                    continue
+                for class_type in node_types:
+                    self.by_type[method_name].setdefault(class_type, []).append(
+                        method
+                    )
+
+    def methods(self, method_name, class_type):
+        return self.every_node[method_name] + self.by_type[method_name].get(
+            class_type, []
+        )
+
+
+class WorkflowPlan:
+    def __init__(self):
+        # Weights in the order the workflow loads them
+        self.weights = []
+        # (node_id, input_key, url) for inputs to download
+        self.input_urls = []
+        # Input files the workflow expects to be provided
+        self.input_files = []
+        # Descriptions of the changes made to the workflow
+        self.rewrites = []
+        # (node_id, class_type, inputs set, input keys removed) for each node
+        # the analysis changed, so the changes can be replayed
+        self.edits = []
+
+    def copy(self):
+        plan = WorkflowPlan()
+        plan.weights = list(self.weights)
+        plan.input_urls = list(self.input_urls)
+        plan.input_files = list(self.input_files)
+        plan.rewrites = list(self.rewrites)
+        plan.edits = list(self.edits)
+        return plan
+
+    def record_edits(self, before, workflow):
+        for node_id, node in workflow.items():
+            class_type, inputs = before[node_id]
+            new_inputs = node.get("inputs", {})
+            changed = {
+                key: value
+                for key, value in new_inputs.items()
+                if key not in inputs or inputs[key] is not value
+            }
+            removed = [key for key in inputs if key not in new_inputs]
+            new_class_type = node.get("class_type")
+            if changed or removed or new_class_type != class_type:
+                self.edits.append((node_id, new_class_type, changed, removed))
+
+    def apply_edits(self, workflow):
+        for node_id, class_type, changed, removed in self.edits:
+            node = workflow[node_id]
+            node["class_type"] = class_type
+            inputs = node.setdefault("inputs", {})
+            inputs.update(changed)
+            for key in removed:
+                inputs.pop(key, None)
+
+
+class PlanCache:
+    """
+    Workflow plans by structural hash, least recently used first out.
+
+    Workflows that failed validation are cached too, as the error to raise.
+    """
+
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = int(os.getenv("WORKFLOW_PLAN_CACHE_SIZE", PLAN_CACHE_SIZE))
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class WorkflowAnalyzer:
+    """
+    Visits each node of an API-format workflow once and plans what it needs.
+
+    The plan lists the weights to download, the inputs to fetch or check,
+    and the rewrites applied to the workflow, like converting LoRA URLs and
+    model synonyms. Unsupported nodes raise a ValueError. Helper methods are
+    looked up in a HelperIndex built once, instead of on every node.
+
+    Plans are cached by the structure of the workflow, ignoring inputs that
+    cannot change the plan such as prompts and seeds. A cached plan replays
+    its rewrites onto the new workflow.
+    """
+
+    def __init__(self, weights_downloader, helper_index=None, plan_cache=None):
+        self.weights_downloader = weights_downloader
+        self.helper_index = helper_index or HelperIndex()
+        self.plan_cache = plan_cache if plan_cache is not None else PlanCache()
+
+    def has_helpers(self, class_type):
+        return bool(
+            self.helper_index.methods("add_weights", class_type)
+            or self.helper_index.methods("check_for_unsupported_nodes", class_type)
+        )
+
+    def _plan_relevant(self, value):
+        # The part of a plain input value that can change the plan, or None
+        if is_link(value):
+            return value
+        if not isinstance(value, str):
+            return None
+        weights_filetypes = tuple(self.weights_downloader.supported_filetypes)
+        if value.startswith(("http://", "https://")) or value.lower().endswith(
+            tuple(INPUT_FILETYPES) + weights_filetypes
+        ):
+            return value
+        return self.weights_downloader.find_embeddings(value) or None
+
+    def affects_plan(self, class_type, value):
+        return self.has_helpers(class_type) or self._plan_relevant(value) is not None
+
+    def structural_hash(self, workflow):
+        # Only inputs that can change the plan are hashed. Nodes with
+        # helpers keep every input, as helpers may read any of them. For the
+        # rest, numbers and free text are left out, keeping only the
+        # embeddings the text refers to.
+        structure = [self.weights_downloader.weights_manifest.generation]
+        for node_id, node in workflow.items():
+            class_type = node.get("class_type")
+            has_helpers = self.has_helpers(class_type)
+            inputs = []
+            for input_key, input_value in node.get("inputs", {}).items():
+                if has_helpers:
+                    inputs.append((input_key, input_value))
+                    continue
+                relevant = self._plan_relevant(input_value)
+                if relevant is not None:
+                    inputs.append((input_key, relevant))
+            structure.append((node_id, class_type, inputs))
+
+        encoded = json.dumps(structure, default=repr).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def analyze(self, workflow):
+        key = self.structural_hash(workflow)
+        cached = self.plan_cache.get(key)
+        if cached is not None:
+            if isinstance(cached, ValueError):
+                raise ValueError(str(cached))
+            plan = cached.copy()
+            plan.apply_edits(workflow)
+            for description in plan.rewrites:
+                print(description)
+            return plan
+
+        before = {
+            node_id: (node.get("class_type"), dict(node.get("inputs", {})))
+            for node_id, node in workflow.items()
+        }
+        try:
+            plan = self._analyze(workflow)
+        except ValueError as e:
+            self.plan_cache.put(key, e)
+            raise
+        plan.record_edits(before, workflow)
+        self.plan_cache.put(key, plan.copy())
+        return plan
+
+    def _analyze(self, workflow):
+        plan = WorkflowPlan()
+        weights_filetypes = tuple(self.weights_downloader.supported_filetypes)
+        seen_inputs = set()
+
+        # Nodes are visited in the order ComfyUI will run them, so weights
+        # are listed in the order they will be loaded
+        for node_id in topological_order(workflow):
+            node = workflow[node_id]
+            class_type = node.get("class_type")
+            wrapped = Node(node)
+
+            for method in self.helper_index.methods(
+                "check_for_unsupported_nodes", class_type
+            ):
+                method(wrapped)
+
+            if class_type == "LoraLoader":
+                self._convert_lora_loader(node_id, node, plan)
+                class_type = node.get("class_type")
+
+            if class_type not in ["LoraLoaderFromURL", "LoraLoader"]:
+                self._plan_inputs(node_id, node, plan, seen_inputs)
+
+            # LoRA loaders from URLs handle their own weights
+            if class_type in URL_LORA_LOADERS:
+                continue
+
+            for method in self.helper_index.methods("add_weights", class_type):
+                method(plan.weights, wrapped)
+
+            for input_key, input_value in node.get("inputs", {}).items():
+                if not isinstance(input_value, str):
+                    continue
+                embeddings = self.weights_downloader.find_embeddings(input_value)
+                if embeddings:
+                    plan.weights.extend(embeddings)
+                elif input_value.endswith(weights_filetypes):
+                    # Sometimes a model will have a number of common filenames
+                    weight_str = self.weights_downloader.get_canonical_weight_str(
+                        input_value
+                    )
+                    if weight_str != input_value:
+                        self._rewrite(
+                            plan,
+                            f"Converting model synonym {input_value} to {weight_str}",
+                        )
+                        node["inputs"][input_key] = weight_str
+                    plan.weights.append(weight_str)
+
+        return plan
+
+    @staticmethod
+    def _rewrite(plan, description):
+        print(description)
+        plan.rewrites.append(description)
+
+    def _convert_lora_loader(self, node_id, node, plan):
+        inputs = node.get("inputs", {})
+        lora_name = inputs.get("lora_name")
+        if isinstance(lora_name, str) and lora_name.startswith(("http://", "https://")):
+            self._rewrite(
+                plan, f"Converting LoraLoader node {node_id} to LoraLoaderFromURL"
+            )
+            node["class_type"] = "LoraLoaderFromURL"
+            inputs["url"] = lora_name
+            del inputs["lora_name"]
+
+    @staticmethod
+    def _plan_inputs(node_id, node, plan, seen_inputs):
+        for input_key, input_value in node.get("inputs", {}).items():
+            if not isinstance(input_value, str):
+                continue
+            if input_value.startswith(("http://", "https://")):
+                # The same URL may be included in a workflow more than once,
+                # every use is rewritten to the downloaded file
+                plan.input_urls.append((node_id, input_key, input_value))
+            elif (
+                input_value.lower().endswith(tuple(INPUT_FILETYPES))
+                and input_value not in seen_inputs
+            ):
+                seen_inputs.add(input_value)
+                plan.input_files.append(input_value)
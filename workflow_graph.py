@@ -0,0 +1,105 @@
+# Output nodes that only display their inputs in the ComfyUI interface,
+# writing them to ComfyUI/temp
+PREVIEW_NODES = ["PreviewImage", "PreviewAudio", "MaskPreview+"]
+
+
+def is_link(value):
+    # In the API format a node input linked to another node's output is
+    # a [node_id, output_index] pair
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+def node_dependencies(node):
+    return [
+        value[0] for value in node.get("inputs", {}).values() if is_link(value)
+    ]
+
+
+def topological_order(workflow):
+    # Node ids ordered so that every node comes after the nodes it reads
+    # from. Ties keep the order of the workflow, and links to missing nodes
+    # are ignored.
+    order = []
+    done = set()
+    in_progress = set()
+
+    for root in workflow:
+        stack = [(root, False)]
+        while stack:
+            node_id, dependencies_done = stack.pop()
+            if node_id in done or node_id not in workflow:
+                continue
+            if dependencies_done:
+                in_progress.discard(node_id)
+                done.add(node_id)
+                order.append(node_id)
+                continue
+            if node_id in in_progress:
+                raise ValueError(f"Workflow has a cycle through node {node_id}")
+
+            in_progress.add(node_id)
+            stack.append((node_id, True))
+            for dependency in reversed(node_dependencies(workflow[node_id])):
+                if dependency not in done:
+                    stack.append((dependency, False))
+    return order
+
+
+def sink_nodes(workflow):
+    linked = {
+        dependency
+        for node in workflow.values()
+        for dependency in node_dependencies(node)
+    }
+    return [node_id for node_id in workflow if node_id not in linked]
+
+
+def ancestors(workflow, node_ids):
+    # The given nodes and every node they read from, directly or not
+    found = set()
+    pending = list(node_ids)
+    while pending:
+        node_id = pending.pop()
+        if node_id in found or node_id not in workflow:
+            continue
+        found.add(node_id)
+        pending.extend(node_dependencies(workflow[node_id]))
+    return found
+
+
+def output_nodes(workflow, output_node_types=None, keep_previews=False):
+    # The nodes ComfyUI runs the workflow for. Previews are left out unless
+    # they are the only outputs. Without the server's output node types,
+    # every sink counts as an output and previews cannot be told apart from
+    # sinks like Anything Everywhere, so they are all kept.
+    if output_node_types is None:
+        return sink_nodes(workflow)
+
+    outputs = [
+        node_id
+        for node_id, node in workflow.items()
+        if node.get("class_type") in output_node_types
+    ]
+    if keep_previews:
+        return outputs
+    return [
+        node_id
+        for node_id in outputs
+        if workflow[node_id].get("class_type") not in PREVIEW_NODES
+    ] or outputs
+
+
+def prune_to_outputs(workflow, outputs):
+    # Only the nodes the outputs need, in their original order
+    missing = [node_id for node_id in outputs if node_id not in workflow]
+    if missing:
+        raise ValueError(
+            f"Requested output nodes are not in the workflow: {', '.join(missing)}"
+        )
+    needed = ancestors(workflow, outputs)
+    return {node_id: node for node_id, node in workflow.items() if node_id in needed}
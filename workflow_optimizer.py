@@ -0,0 +1,185 @@
+import ast
+import json
+import math
+import operator
+from workflow_graph import topological_order, is_link
+
+# Node types whose outputs depend only on their inputs. Two of these with
+# the same class_type and inputs produce the same outputs, so one can stand
+# in for the other.
+PURE_NODES = [
+    "BasicGuider",
+    "BasicScheduler",
+    "CheckpointLoaderSimple",
+    "CLIPLoader",
+    "CLIPTextEncode",
+    "ControlNetLoader",
+    "DisableNoise",
+    "DualCLIPLoader",
+    "EmptyLatentImage",
+    "FluxGuidance",
+    "KSamplerSelect",
+    "LatentCrop",
+    "LatentUpscale",
+    "LoraLoader",
+    "ModelSamplingFlux",
+    "RandomNoise",
+    "SAMLoader",
+    "SDXLEmptyLatentSizePicker+",
+    "UltralyticsDetectorProvider",
+    "UNETLoader",
+    "UpscaleModelLoader",
+    "VAEDecode",
+    "VAEEncode",
+    "VAELoader",
+]
+
+# Arithmetic from ComfyUI_essentials that can be worked out before queueing
+# when every input is a constant
+FOLDABLE_NODES = [
+    "SimpleMath+",
+    "SimpleMathDual+",
+    "SimpleMathFloat+",
+    "SimpleMathInt+",
+    "SimpleMathSlider+",
+]
+
+# The subset of SimpleMath+ expressions that folding supports. Expressions
+# using anything else are left for ComfyUI to evaluate.
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: operator.pow,
+    ast.Mod: operator.mod,
+}
+UNARY_OPERATORS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+FUNCTIONS = {"min": min, "max": max, "round": round}
+
+
+class CannotFold(Exception):
+    pass
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _evaluate(expression, variables):
+    def evaluate(node):
+        if isinstance(node, ast.Constant) and _is_number(node.value):
+            return node.value
+        if isinstance(node, ast.Name) and node.id in variables:
+            return variables[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            return BINARY_OPERATORS[type(node.op)](
+                evaluate(node.left), evaluate(node.right)
+            )
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            return UNARY_OPERATORS[type(node.op)](evaluate(node.operand))
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in FUNCTIONS
+            and not node.keywords
+        ):
+            return FUNCTIONS[node.func.id](*[evaluate(arg) for arg in node.args])
+        raise CannotFold(ast.dump(node))
+
+    try:
+        result = evaluate(ast.parse(expression, mode="eval").body)
+    except (SyntaxError, TypeError, ValueError, ArithmeticError) as e:
+        raise CannotFold(str(e))
+    if not _is_number(result):
+        raise CannotFold(f"{expression} is not a number")
+    if math.isnan(result):
+        result = 0.0
+    return result
+
+
+def _simple_math(expression, inputs):
+    variables = {name: inputs.get(name, 0.0) for name in ["a", "b", "c", "d"]}
+    if not all(_is_number(value) for value in variables.values()):
+        raise CannotFold("inputs are not numbers")
+    result = _evaluate(expression, variables)
+    return (round(result), result)
+
+
+def fold_node(class_type, inputs):
+    # The outputs of a foldable node, as the node would return them
+    if class_type == "SimpleMath+":
+        return _simple_math(inputs["value"], inputs)
+    if class_type == "SimpleMathDual+":
+        return _simple_math(inputs["value_1"], inputs) + _simple_math(
+            inputs["value_2"], inputs
+        )
+    if class_type == "SimpleMathFloat+":
+        return (float(inputs["value"]),)
+    if class_type == "SimpleMathInt+":
+        return (int(inputs["value"]),)
+    if class_type == "SimpleMathSlider+":
+        # ComfyUI converts FLOAT widget values to floats before running nodes
+        minimum, maximum = float(inputs["min"]), float(inputs["max"])
+        value = minimum + float(inputs["value"]) * (maximum - minimum)
+        if inputs["rounding"] > 0:
+            value = round(value, inputs["rounding"])
+        return (value, round(value))
+    raise CannotFold(class_type)
+
+
+def optimize_workflow(workflow, pure_node_types=PURE_NODES):
+    """
+    Removes duplicate and constant nodes from an API-format workflow.
+
+    Nodes in FOLDABLE_NODES whose inputs are all constants are evaluated,
+    and the nodes reading them get the values instead of links. Nodes in
+    pure_node_types with the same class_type and inputs as an earlier one
+    are merged into it. Returns the optimized workflow and, for each node
+    removed, what replaced it.
+    """
+    optimized = {}
+    eliminated = {}
+    folded = {}
+    merged = {}
+    seen = {}
+
+    for node_id in topological_order(workflow):
+        node = workflow[node_id]
+        class_type = node.get("class_type")
+
+        inputs = {}
+        for input_key, input_value in node.get("inputs", {}).items():
+            if is_link(input_value):
+                source_id, output_index = input_value
+                if source_id in folded and output_index < len(folded[source_id]):
+                    input_value = folded[source_id][output_index]
+                elif source_id in merged:
+                    input_value = [merged[source_id], output_index]
+            inputs[input_key] = input_value
+
+        if class_type in FOLDABLE_NODES and not any(
+            is_link(value) for value in inputs.values()
+        ):
+            try:
+                folded[node_id] = fold_node(class_type, inputs)
+                eliminated[node_id] = f"folded to {list(folded[node_id])}"
+                continue
+            except (CannotFold, KeyError, TypeError, ValueError, ArithmeticError):
+                pass
+
+        if class_type in pure_node_types:
+            key = json.dumps([class_type, inputs], sort_keys=True, default=repr)
+            if key in seen:
+                merged[node_id] = seen[key]
+                eliminated[node_id] = f"merged into node {seen[key]}"
+                continue
+            seen[key] = node_id
+
+        optimized[node_id] = {**node, "inputs": inputs}
+
+    # Keep the original order of the workflow
+    return {
+        node_id: optimized[node_id] for node_id in workflow if node_id in optimized
+    }, eliminated
@@ -0,0 +1,99 @@
+import json
+
+SELECTOR_KEYS = ["node_id", "class_type", "title"]
+
+
+class WorkflowTemplate:
+    """
+    A workflow parsed once, with predictor inputs bound to node inputs.
+
+    Bindings map each parameter name to one or more selectors, each naming
+    an input and the node_id, class_type and/or _meta title of the nodes it
+    belongs to. Selectors are resolved to (node_id, input_key) paths when the
+    template is created, so instantiate() only copies the workflow and
+    assigns values, instead of searching every node on every prediction.
+
+    After prepare(), the template holds the plan for its workflow. Requests
+    whose bound values cannot change that plan reuse it, the rest get None
+    and are analyzed as usual.
+    """
+
+    def __init__(self, workflow, bindings):
+        if not isinstance(workflow, dict):
+            workflow = json.loads(workflow)
+        self.workflow = workflow
+        self.paths = {
+            name: self._resolve(name, selectors) for name, selectors in bindings.items()
+        }
+        self.workflow_analyzer = None
+        self.plan = None
+        self.plan_generation = None
+
+    @classmethod
+    def load(cls, path, bindings):
+        with open(path, "r") as file:
+            return cls(json.loads(file.read()), bindings)
+
+    def _resolve(self, name, selectors):
+        if isinstance(selectors, dict):
+            selectors = [selectors]
+
+        paths = []
+        for selector in selectors:
+            unknown = set(selector) - set(SELECTOR_KEYS) - {"input"}
+            if unknown or "input" not in selector:
+                raise ValueError(f"Invalid binding for {name}: {selector}")
+            for node_id, node in self.workflow.items():
+                if (
+                    selector.get("node_id", node_id) == node_id
+                    and selector.get("class_type", node.get("class_type"))
+                    == node.get("class_type")
+                    and selector.get("title", node.get("_meta", {}).get("title"))
+                    == node.get("_meta", {}).get("title")
+                ):
+                    paths.append((node_id, selector["input"]))
+
+        if not paths:
+            raise ValueError(f"No node in the workflow matches the binding for {name}")
+        return paths
+
+    def prepare(self, workflow_analyzer):
+        # Analyzing the template applies its rewrites, like model synonyms,
+        # to the template itself, so every instance starts rewritten
+        self.workflow_analyzer = workflow_analyzer
+        self.plan = workflow_analyzer.analyze(self.workflow)
+        self.plan_generation = self._manifest_generation()
+        return self.plan
+
+    def _manifest_generation(self):
+        return self.workflow_analyzer.weights_downloader.weights_manifest.generation
+
+    def instantiate(self, **values):
+        # Returns the workflow for these values, and the template's plan if
+        # it still applies
+        unknown = set(values) - set(self.paths)
+        if unknown:
+            raise ValueError(f"Unknown workflow parameters: {', '.join(sorted(unknown))}")
+
+        # Nodes and their inputs are copied, input values are shared with
+        # the template, as they are replaced rather than changed in place
+        workflow = {
+            node_id: {**node, "inputs": dict(node.get("inputs", {}))}
+            for node_id, node in self.workflow.items()
+        }
+        for name, value in values.items():
+            for node_id, input_key in self.paths[name]:
+                workflow[node_id]["inputs"][input_key] = value
+                print(f"Updated {name} in node {node_id}")
+
+        return workflow, self._plan_for(workflow, values)
+
+    def _plan_for(self, workflow, values):
+        if self.plan is None or self.plan_generation != self._manifest_generation():
+            return None
+        for name, value in values.items():
+            for node_id, input_key in self.paths[name]:
+                class_type = workflow[node_id].get("class_type")
+                if self.workflow_analyzer.affects_plan(class_type, value):
+                    return None
+        return self.plan.copy()